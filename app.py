@@ -1,14 +1,28 @@
+from instrumentation import CallbackMetrics, StartupProfiler
+
+# Set DASH_BLM_PROFILE_STARTUP=1 to log how long each phase of startup takes, and DASH_BLM_STARTUP_BUDGET to a number
+# of seconds to fail when startup takes longer. The profiler starts before the other imports so they're counted too
+
+startup = StartupProfiler.from_environment()
+startup.phase("imports")
+
+import io
+from types import SimpleNamespace
+
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 import plotly.graph_objects as go
-import plotly.express as px
+import flask
 import numpy as np
 import os
 import pandas as pd
+from artifact_watcher import ArtifactWatcher, manifest_version, read_artifacts
 from processing import DashBLM
+from serialization import LayoutCache, enable_fast_json
 
+# plotly.express is only needed once someone moves a slider, so it's imported in the callbacks rather than here
 
 # ----------------------------------------------------------------------------#
 # Basic dash configuration
@@ -17,288 +31,686 @@ from processing import DashBLM
 app = dash.Dash(__name__)
 app.title = "UK BLM App"
 
+# Time every callback and serve the results on /metrics. Set DASH_BLM_ALLOW_PROFILING=1 to be able to send the
+# X-Dash-Profile header with a request and get a cProfile dump of it in the profiles folder
+
+metrics = CallbackMetrics(
+    profile_dir=os.getcwd() + "/profiles",
+    allow_profiling=os.environ.get("DASH_BLM_ALLOW_PROFILING") == "1",
+)
+metrics.instrument(app)
+
+# Set DASH_BLM_FAST_JSON=1 to encode figures with orjson, which writes numpy arrays out directly
+
+if os.environ.get("DASH_BLM_FAST_JSON") == "1":
+    enable_fast_json()
+
 # ----------------------------------------------------------------------------#
 # Import data
 # ----------------------------------------------------------------------------#
 
 path = os.getcwd() + "/data/"
 
-# Read in dataframes for graphing
+# Every file in the data directory the app is built from. When processing.py writes new versions of them the app loads
+# them in the background and swaps them in, see the bottom of this file
 
-df_clean = pd.read_csv(path + "df_clean.csv")
-filtered_df = pd.read_csv(path + "filtered_df.csv")
-df_blackpops = pd.read_csv(path + "df_blackpops.csv")
-df_ids = pd.read_csv(path + "df_ids.csv")
-df_scatter = pd.read_csv(path + "df_scatter.csv")
-df_sunburst = pd.read_csv(path + "df_sunburst.csv")
+artifact_files = [
+    "filtered_df.csv",
+    "df_blackpops.csv",
+    "df_ids.csv",
+    "df_scatter.csv",
+    "df_sunburst.csv",
+    "df_density.csv",
+    "df_trends.csv",
+    "df_justice_cube.csv",
+    "df_ethnic_shares.csv",
+    "df_disparities.csv",
+    DashBLM.geojson_filename,
+]
 
-# Read in mapbox token and geojson for choroplethmapbox graph used in 'Stop and Search' section
+# Read in mapbox token for choroplethmapbox graph used in 'Stop and Search' section. Without one the map falls back to
+# tiles that don't need a token
 
-DashBLM = DashBLM()
+token = DashBLM.read_mapbox_token()
 
-token = DashBLM.make_choropleth_inputs()[0]
-geojson = DashBLM.make_choropleth_inputs()[1]
+# The district boundaries are served from a route of their own so the browser fetches them once and caches them,
+# rather than them being embedded in the map figure. This works offline as the file comes from the data directory
 
-# ----------------------------------------------------------------------------#
-# Draw figures
-# ----------------------------------------------------------------------------#
 
-# Scatter mapbox on top of choropleth mapbox for 'Stop and Search' section
-
-choro = go.Choroplethmapbox(
-    geojson=geojson,
-    locations=df_ids.ids,
-    z=df_blackpops["Value"],
-    colorscale="Reds",
-    text=df_ids.ids,
-    hovertemplate="""Black Population: %{z}% <br> Area: %{text} <extra></extra>""",
-    # extra tags removes trace name
-    hoverlabel={"bgcolor": "white"},
-    showscale=False,
-)
+@app.server.route("/geojson/<filename>")
+def serve_geojson(filename):
+    if not filename.endswith(".geojson"):
+        flask.abort(404)
+    return flask.send_from_directory(path, filename, max_age=24 * 60 * 60)
 
-scatt = go.Scattermapbox(
-    lat=df_scatter.lats,
-    lon=df_scatter.longs,
-    mode="markers",
-    text=df_scatter["text"],
-    textposition="top left",
-    marker={
-        "size": df_scatter["size"],
-        "color": df_scatter["color"],
-        "sizemin": 1,
-        "colorscale": "Icefire",
-    },
-    hovertemplate="%{text} <extra></extra>",
-)
 
-layout = go.Layout(
-    mapbox=dict(
-        center=dict(lat=52.370216, lon=-1), accesstoken=token, zoom=6, style="dark"
+# Which version of each data file is being served
+
+
+@app.server.route("/artifacts")
+def serve_manifest():
+    return flask.jsonify(version=artifacts.version, files=artifacts.manifest)
+
+
+def map_points_chunk(map_points, chunk):
+    """
+    Gets a chunk of the searches on the stop and search map ready to send. Co-ordinates are rounded to a tenth of a
+    metre; float32 values would otherwise be written out with twice as many digits as they're accurate to.
+    :param map_points: dict of the searches' lat, lon, text, size and color arrays, in the order they're sent.
+    :param chunk: slice of the searches to send.
+    :return: dict of the same keys to lists.
+    """
+
+    return {
+        "lat": map_points["lat"][chunk].astype("float64").round(6).tolist(),
+        "lon": map_points["lon"][chunk].astype("float64").round(6).tolist(),
+        "text": map_points["text"][chunk].tolist(),
+        "size": map_points["size"][chunk].tolist(),
+        "color": map_points["color"][chunk].tolist(),
+    }
+
+
+def load_artifacts(path, filenames, phase=lambda name: None):
+    """
+    Reads in the data files and draws everything the app serves from them: the pre-sorted views the callbacks look
+    things up in, the stop and search map and the page layout. Everything is kept together in one bundle so a newer
+    set of files can be loaded alongside the one being served and swapped in whole.
+    :param path: string, the data directory.
+    :param filenames: list of the data files in it to load.
+    :param phase: function called with the name of each stage of loading, for the startup profiler.
+    :return: a SimpleNamespace of the views and figures the callbacks use, with the layout as its page attribute.
+    """
+
+    phase("data load")
+
+    # Each file is read once and its hash worked out from the same bytes that are parsed, so the version served
+    # always matches the data behind it
+
+    files, manifest = read_artifacts(path, filenames)
+    version = manifest_version(manifest)
+
+    # Read in dataframes for graphing
+
+    filtered_df = pd.read_csv(io.BytesIO(files["filtered_df.csv"]))
+    df_blackpops = pd.read_csv(io.BytesIO(files["df_blackpops.csv"]))
+    df_ids = pd.read_csv(io.BytesIO(files["df_ids.csv"]))
+    df_scatter = DashBLM.read_scatter_dataframe(io.BytesIO(files["df_scatter.csv"]))
+    df_sunburst = pd.read_csv(io.BytesIO(files["df_sunburst.csv"]))
+    df_density = pd.read_csv(io.BytesIO(files["df_density.csv"]))
+
+    # Monthly stop and search trends are only there once processing.py has been run over harvested police data
+
+    if "df_trends.csv" in files:
+        df_trends = pd.read_csv(io.BytesIO(files["df_trends.csv"]))
+    else:
+        df_trends = pd.DataFrame(
+            columns=["Month", "Area", "Ethnicity", "Searches", "Searches per 1k"]
+        )
+
+    # The justice data for every sex, age group, offence group and police force area it is published for. Older data
+    # folders only have the totals
+
+    if "df_justice_cube.csv" in files:
+        df_justice_cube = pd.read_csv(io.BytesIO(files["df_justice_cube.csv"]))
+    else:
+        df_justice_cube = df_sunburst.assign(
+            **{dimension: "All" for dimension in DashBLM.justice_dimensions}
+        )
+
+    # Every ethnicity's share of its national population living in each district, in the same order as the district ids.
+    # Older data folders only have the black population share
+
+    if "df_ethnic_shares.csv" in files:
+        df_ethnic_shares = pd.read_csv(
+            io.BytesIO(files["df_ethnic_shares.csv"]), index_col=0
+        )
+    else:
+        df_ethnic_shares = pd.DataFrame(index=df_ids.ids)
+
+    # How many times as likely each group is as white people to be arrested or searched, with confidence intervals, for
+    # every year and area. Older data folders don't have these
+
+    if "df_disparities.csv" in files:
+        df_disparities = pd.read_csv(io.BytesIO(files["df_disparities.csv"]))
+    else:
+        df_disparities = pd.DataFrame(
+            columns=[
+                "Dataset",
+                "Year",
+                "Area",
+                "Ethnicity",
+                "Ratio",
+                "Lower",
+                "Upper",
+                "Rank",
+            ]
+        )
+
+    # Pre-sorted views of the arrests and justice data keyed by year and indexed by ethnicity. These are built once here
+    # and only ever read by the callbacks below, so they can be shared safely between threads when the server handles
+    # requests concurrently
+
+    arrests_by_year = DashBLM.make_year_views(
+        filtered_df, sort_by=["Year", "Ethnicity"], index="Ethnicity"
     )
-)
+    minority_arrests_by_year = DashBLM.make_year_views(
+        filtered_df[~filtered_df.Ethnicity.str.contains("White")],
+        sort_by=["Year", "Ethnicity"],
+        index="Ethnicity",
+    )
+    sunburst_by_year = DashBLM.make_year_views(
+        df_sunburst, sort_by=["Year", "Ethnicity"], index="Ethnicity"
+    )
+    justice_by_selection = DashBLM.make_selection_views(
+        df_justice_cube,
+        by=["Year"] + DashBLM.justice_dimensions,
+        sort_by=["Year", "Ethnicity"],
+        index="Ethnicity",
+    )
+    trends_by_area = DashBLM.make_trend_views(df_trends)
+    disparities_by_selection = DashBLM.make_selection_views(
+        df_disparities,
+        by=["Dataset", "Area", "Year"],
+        sort_by=["Rank"],
+        index="Ethnicity",
+    )
+
+    # The stop and search text is written from the latest year of national searches, when there are any
+
+    searches_years = [
+        key[2]
+        for key in disparities_by_selection
+        if key[:2] == ("Stop and search", "National")
+    ]
+    if searches_years:
+        searches_text = DashBLM.describe_disparities(
+            disparities_by_selection[
+                ("Stop and search", "National", max(searches_years))
+            ],
+            "In {}".format(max(searches_years)),
+            "stopped and searched",
+        )
+    else:
+        searches_text = """In 2019 black people were **9.5** times more likely to be stopped and searched 
+            than white people, asian and mixed people were 2.75 times more likely.  
+            """
+
+    # The geojson url changes with the file's contents so browsers don't keep using boundaries they've cached
+
+    geojson = app.get_relative_path(DashBLM.geojson_url())
+    if DashBLM.geojson_filename in manifest:
+        geojson += "?v=" + manifest[DashBLM.geojson_filename][:12]
+
+    phase("figure build")
+
+    # The choropleth can be coloured by any ethnicity's share; the map opens on all black groups together. Each measure is
+    # just one value per district, so switching between them only has to send these arrays. They're lined up with the
+    # district ids by name so they colour the right districts whatever order the files were written in. Older data
+    # folders only have the black population share, which is on its own scale, so it's only used when there aren't any
+    # others
+
+    df_ethnic_shares = df_ethnic_shares.reindex(df_ids.ids)
+    choropleth_measures = {
+        ethnicity: df_ethnic_shares[ethnicity].to_numpy()
+        for ethnicity in df_ethnic_shares.columns
+    }
+    if "Black" not in choropleth_measures:
+        choropleth_measures = {
+            "Black": df_blackpops.set_index("Geography_name")["Value"]
+            .reindex(df_ids.ids)
+            .to_numpy()
+        }
+    choropleth_measures = {
+        "Black": choropleth_measures.pop("Black"),
+        **choropleth_measures,
+    }
+    choropleth_hovertemplate = (
+        "{} Population: %{{z}}% <br> Area: %{{text}} <extra></extra>"
+    )
+
+    # Scatter mapbox on top of choropleth mapbox for 'Stop and Search' section
+
+    choro = go.Choroplethmapbox(
+        geojson=geojson,
+        locations=df_ids.ids,
+        z=choropleth_measures["Black"],
+        colorscale="Reds",
+        text=df_ids.ids,
+        hovertemplate=choropleth_hovertemplate.format("Black"),
+        # extra tags removes trace name
+        hoverlabel={"bgcolor": "white"},
+        showscale=False,
+    )
+
+    # The map opens with a sample of searches spread over the whole country and the rest are streamed in after it, in
+    # chunks, so it is ready to use however many searches there are. The searches are put in the order they'll be sent
+    # once here, keeping the compact types they were read in with; each chunk is only made ready to send when it's sent
+
+    map_stream_sample = 2000
+    map_stream_chunk = 10000
+
+    stream_order = DashBLM.spatial_stream_order(
+        df_scatter.lats.to_numpy(), df_scatter.longs.to_numpy()
+    )
+    map_points = {
+        "lat": df_scatter.lats.to_numpy()[stream_order],
+        "lon": df_scatter.longs.to_numpy()[stream_order],
+        "text": df_scatter["text"].array.take(stream_order),
+        "size": df_scatter["size"].to_numpy()[stream_order],
+        "color": df_scatter["color"].to_numpy()[stream_order],
+    }
+    map_stream_chunks = -(
+        -max(len(stream_order) - map_stream_sample, 0) // map_stream_chunk
+    )
+
+    sample = map_points_chunk(map_points, slice(0, map_stream_sample))
+    scatt = go.Scattermapbox(
+        lat=sample["lat"],
+        lon=sample["lon"],
+        mode="markers",
+        text=sample["text"],
+        textposition="top left",
+        marker={
+            "size": sample["size"],
+            "color": sample["color"],
+            "sizemin": 1,
+            "colorscale": "Icefire",
+        },
+        hovertemplate="%{text} <extra></extra>",
+    )
+
+    layout = go.Layout(
+        mapbox=dict(
+            center=dict(lat=52.370216, lon=-1),
+            accesstoken=token,
+            zoom=6,
+            style="dark" if token else "carto-darkmatter",
+        )
+    )
+
+    ethnicity_map = go.Figure(data=[choro, scatt], layout=layout)
+    ethnicity_map.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
+    ethnicity_map["layout"]["titlefont"] = {"family": "Roboto", "size": 14}
+    ethnicity_map.layout.font.family = "Roboto"
+
+    # The same searches binned into cells of different sizes, drawn as a heatmap on the choropleth in callbacks below
+
+    density_by_resolution = {
+        resolution: df.reset_index(drop=True)
+        for resolution, df in df_density.groupby("Resolution")
+    }
 
-ethnicity_map = go.Figure(data=[choro, scatt], layout=layout)
-ethnicity_map.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
-ethnicity_map["layout"]["titlefont"] = {"family": "Roboto", "size": 14}
-ethnicity_map.layout.font.family = "Roboto"
+    phase("layout build")
+
+    # The bundle only keeps what the callbacks and layout use, so the rest of what was read in can be freed
+
+    bundle = SimpleNamespace(
+        version=version,
+        manifest=manifest,
+        filtered_df=filtered_df,
+        df_ids=df_ids,
+        df_sunburst=df_sunburst,
+        df_justice_cube=df_justice_cube,
+        df_disparities=df_disparities,
+        arrests_by_year=arrests_by_year,
+        minority_arrests_by_year=minority_arrests_by_year,
+        sunburst_by_year=sunburst_by_year,
+        justice_by_selection=justice_by_selection,
+        trends_by_area=trends_by_area,
+        disparities_by_selection=disparities_by_selection,
+        searches_text=searches_text,
+        choropleth_measures=choropleth_measures,
+        choropleth_hovertemplate=choropleth_hovertemplate,
+        choro=choro,
+        map_stream_sample=map_stream_sample,
+        map_stream_chunk=map_stream_chunk,
+        map_stream_chunks=map_stream_chunks,
+        map_points=map_points,
+        scatt=scatt,
+        layout=layout,
+        ethnicity_map=ethnicity_map,
+        density_by_resolution=density_by_resolution,
+    )
+    bundle.page = make_layout(bundle)
+
+    return bundle
 
-# The arrests by race and justice graph sections contain interactive graphs so the code for that is in callbacks below
 
 # ----------------------------------------------------------------------------#
 # Application Layout
 # ----------------------------------------------------------------------------#
 
-app.layout = html.Div(
-    [
-        dcc.Tabs(
-            [
-                dcc.Tab(
-                    label="Mission Statement",
-                    children=[
-                        html.H1(
-                            "About",
-                            style={
-                                "width": "100%",
-                                "text-align": "center",
-                                "padding-top": "5%",
-                            },
-                        ),
-                        html.Div(
-                            dcc.Markdown(
-                                """
-                
-                This app has been made in response to the UK government's disappointing reaction to recent Black Lives
-                Matter protests in Britain. 
-                
-                The government's principal response to protests was to set up a UK race inequality commission.
-                
-                
-                However the head of the commission has previously doubted the existence of institutional racism in the 
-                UK.
-                
-                This app tries to use to data to show how mistaken this is. You can view the source code [here](https://github.com/osintalex/Dash-BLM).
-                
-                *Sources*:
-                
-                [Police Data](https://data.police.uk)
-
-                [UK Government Ethnicity Facts and Figures](https://www.ethnicity-facts-figures.service.gov.uk)
-                
-                [UK Government Arrests Data](https://assets.publishing.service.gov.uk/government/uploads/system/uploads/attachment_data/file/841253/arrest-police-powers-procedures-mar19-hosb2519-tables.ods)
-                
-                [Office of National Statistics Population Data](https://www.ons.gov.uk/file?uri=%2fpeoplepopulationandcommunity%2fpopulationandmigration%2fpopulationestimates%2fdatasets%2fpopulationestimatesforukenglandandwalesscotlandandnorthernireland%2fmid2001tomid2018detailedtimeseries/ukpopulationestimates18382018.xlsx)
-                
-                [UK Local Area District Co-Ordinates](https://github.com/martinjc/UK-GeoJSON)
-                """
+
+def make_layout(data):
+    """
+    Builds the page from a bundle of loaded artifacts.
+    :param data: the SimpleNamespace returned by load_artifacts.
+    :return: the dash layout.
+    """
+
+    return html.Div(
+        [
+            dcc.Tabs(
+                [
+                    dcc.Tab(
+                        label="Mission Statement",
+                        children=[
+                            html.H1(
+                                "About",
+                                style={
+                                    "width": "100%",
+                                    "text-align": "center",
+                                    "padding-top": "5%",
+                                },
                             ),
-                            style={
-                                "width": "80%",
-                                "margin": "0 10% 0 10%",
-                                "text-align": "center",
-                            },
-                        ),
-                    ],
-                ),
-                dcc.Tab(
-                    label="Arrests by Race",
-                    children=[
-                        html.Div(
-                            [
-                                html.H3(
-                                    "Number and Proportion of Arrests by Ethnicity",
-                                    style={"width": "100%", "text-align": "center"},
-                                ),
-                                html.P(
-                                    "Data for England and Wales only",
-                                    style={"width": "100%", "text-align": "center"},
-                                ),
-                            ]
-                        ),
-                        html.Div(
-                            [
-                                dcc.Markdown(
-                                    id="times-more-likely",
-                                    style={
-                                        "backgroundColor": "#B5D7E7",
-                                        "text-align": "center",
-                                    },
-                                ),
-                            ]
-                        ),
-                        html.Div(
-                            [
-                                dcc.Graph(
-                                    id="arrests-graph", config={"displayModeBar": False}
-                                ),
-                            ]
-                        ),
-                        dcc.Slider(
-                            id="year-slider",
-                            min=df_clean["Year"].min(),
-                            max=df_clean["Year"].max(),
-                            value=df_clean["Year"].min(),
-                            marks={
-                                str(year): str(year)
-                                for year in df_clean["Year"].unique()
-                            },
-                            step=None,
-                        ),
-                    ],
-                ),
-                dcc.Tab(
-                    label="Stop and Search",
-                    children=[
-                        html.H3(
-                            "Map of Searches Made",
-                            style={"width": "100%", "text-align": "center"},
-                        ),
-                        html.P(
-                            "Data for England and Wales and 2019 only.",
-                            style={"width": "100%", "text-align": "center"},
-                        ),
-                        html.P(
-                            """Bubble colour represents ethnicity. Bigger bubbles mean younger suspects. The redder a map section, 
-               the more black people live in the area.""",
-                            style={"width": "100%", "text-align": "center"},
-                        ),
-                        html.Div(
-                            [
+                            html.Div(
                                 dcc.Markdown(
-                                    """In 2019 black people were **9.5** times more likely to be stopped and searched 
-        than white people, asian and mixed people were 2.75 times more likely.  
-        """,
-                                    style={
-                                        "backgroundColor": "#B5D7E7",
-                                        "text-align": "center",
-                                    },
-                                )
-                            ]
-                        ),
-                        html.Div(
-                            [
-                                dcc.Graph(
-                                    figure=ethnicity_map,
-                                    config={"displayModeBar": False},
+                                    """
+
+                    This app has been made in response to the UK government's disappointing reaction to recent Black Lives
+                    Matter protests in Britain. 
+
+                    The government's principal response to protests was to set up a UK race inequality commission.
+
+
+                    However the head of the commission has previously doubted the existence of institutional racism in the 
+                    UK.
+
+                    This app tries to use to data to show how mistaken this is. You can view the source code [here](https://github.com/osintalex/Dash-BLM).
+
+                    *Sources*:
+
+                    [Police Data](https://data.police.uk)
+
+                    [UK Government Ethnicity Facts and Figures](https://www.ethnicity-facts-figures.service.gov.uk)
+
+                    [UK Government Arrests Data](https://assets.publishing.service.gov.uk/government/uploads/system/uploads/attachment_data/file/841253/arrest-police-powers-procedures-mar19-hosb2519-tables.ods)
+
+                    [Office of National Statistics Population Data](https://www.ons.gov.uk/file?uri=%2fpeoplepopulationandcommunity%2fpopulationandmigration%2fpopulationestimates%2fdatasets%2fpopulationestimatesforukenglandandwalesscotlandandnorthernireland%2fmid2001tomid2018detailedtimeseries/ukpopulationestimates18382018.xlsx)
+
+                    [UK Local Area District Co-Ordinates](https://github.com/martinjc/UK-GeoJSON)
+                    """
                                 ),
-                            ]
-                        ),
-                    ],
-                ),
-                dcc.Tab(
-                    label="Department of Justice",
-                    children=[
-                        html.Div(
-                            [
+                                style={
+                                    "width": "80%",
+                                    "margin": "0 10% 0 10%",
+                                    "text-align": "center",
+                                },
+                            ),
+                        ],
+                    ),
+                    dcc.Tab(
+                        label="Arrests by Race",
+                        children=[
+                            html.Div(
+                                [
+                                    html.H3(
+                                        "Number and Proportion of Arrests by Ethnicity",
+                                        style={"width": "100%", "text-align": "center"},
+                                    ),
+                                    html.P(
+                                        "Data for England and Wales only",
+                                        style={"width": "100%", "text-align": "center"},
+                                    ),
+                                ]
+                            ),
+                            html.Div(
+                                [
+                                    dcc.Markdown(
+                                        id="times-more-likely",
+                                        style={
+                                            "backgroundColor": "#B5D7E7",
+                                            "text-align": "center",
+                                        },
+                                    ),
+                                ]
+                            ),
+                            html.Div(
+                                [
+                                    dcc.Graph(
+                                        id="arrests-graph",
+                                        config={"displayModeBar": False},
+                                    ),
+                                ]
+                            ),
+                            dcc.Slider(
+                                id="year-slider",
+                                min=min(data.arrests_by_year),
+                                max=max(data.arrests_by_year),
+                                value=min(data.arrests_by_year),
+                                marks={
+                                    str(year): str(year)
+                                    for year in data.arrests_by_year
+                                },
+                                step=None,
+                            ),
+                        ],
+                    ),
+                    dcc.Tab(
+                        label="Stop and Search",
+                        children=[
+                            html.H3(
+                                "Map of Searches Made",
+                                style={"width": "100%", "text-align": "center"},
+                            ),
+                            html.P(
+                                "Data for England and Wales and 2019 only.",
+                                style={"width": "100%", "text-align": "center"},
+                            ),
+                            html.P(
+                                """Bubble colour represents ethnicity. Bigger bubbles mean younger suspects. The redder a map section, 
+                   the more of the ethnic group picked below live in the area.""",
+                                style={"width": "100%", "text-align": "center"},
+                            ),
+                            html.Div(
+                                [
+                                    dcc.Markdown(
+                                        data.searches_text,
+                                        style={
+                                            "backgroundColor": "#B5D7E7",
+                                            "text-align": "center",
+                                        },
+                                    )
+                                ]
+                            ),
+                            dcc.RadioItems(
+                                id="map-mode",
+                                options=[{"label": "Searches", "value": "points"}]
+                                + [
+                                    {
+                                        "label": "Heatmap ({} degree cells)".format(
+                                            resolution
+                                        ),
+                                        "value": resolution,
+                                    }
+                                    for resolution in sorted(
+                                        data.density_by_resolution, reverse=True
+                                    )
+                                ],
+                                value="points",
+                                labelStyle={
+                                    "display": "inline-block",
+                                    "padding": "0 1%",
+                                },
+                                style={"width": "100%", "text-align": "center"},
+                            ),
+                            dcc.Dropdown(
+                                id="map-ethnicity",
+                                options=[
+                                    {"label": ethnicity, "value": ethnicity}
+                                    for ethnicity in data.choropleth_measures
+                                ],
+                                value="Black",
+                                clearable=False,
+                            ),
+                            html.Div(
+                                [
+                                    dcc.Graph(
+                                        id="ethnicity-map",
+                                        figure=data.ethnicity_map,
+                                        config={"displayModeBar": False},
+                                    ),
+                                    dcc.Interval(
+                                        id="map-stream",
+                                        interval=250,
+                                        max_intervals=1,
+                                        disabled=data.map_stream_chunks == 0,
+                                    ),
+                                    dcc.Store(id="map-stream-sent", data=0),
+                                    dcc.Store(id="artifact-version", data=data.version),
+                                ]
+                            ),
+                            html.H3(
+                                "Searches per Month by Ethnicity",
+                                style={"width": "100%", "text-align": "center"},
+                            ),
+                            html.P(
+                                "Searches per 1,000 people in each ethnic group living in the area.",
+                                style={"width": "100%", "text-align": "center"},
+                            ),
+                            dcc.Dropdown(
+                                id="trend-area",
+                                options=[
+                                    {"label": area, "value": area}
+                                    for area in data.trends_by_area
+                                ],
+                                value="National",
+                                clearable=False,
+                            ),
+                            html.Div(
+                                [
+                                    dcc.Graph(
+                                        id="trend-graph",
+                                        config={"displayModeBar": False},
+                                    ),
+                                ]
+                            ),
+                        ],
+                    ),
+                    dcc.Tab(
+                        label="Department of Justice",
+                        children=[
+                            html.Div(
+                                [
+                                    dcc.Markdown(
+                                        """
+                            ## Sentence Length by Ethnicity
+                            #### Data for England and Wales only
+                            *Hover over the graph for more information*""",
+                                        style={"width": "100%", "text-align": "center"},
+                                    ),
+                                ]
+                            ),
+                            html.Div(
+                                [
+                                    dcc.Graph(
+                                        id="justice-graph",
+                                        config={"displayModeBar": False},
+                                    ),
+                                ]
+                            ),
+                            dcc.Slider(
+                                id="year-slider-justice",
+                                min=min(data.sunburst_by_year),
+                                max=max(data.sunburst_by_year),
+                                value=min(data.sunburst_by_year),
+                                marks={
+                                    str(year): str(year)
+                                    for year in data.sunburst_by_year
+                                },
+                                step=None,
+                            ),
+                            html.Div(
+                                [
+                                    dcc.Dropdown(
+                                        id="justice-"
+                                        + dimension.lower().replace(" ", "-"),
+                                        options=[
+                                            {
+                                                "label": "{}: {}".format(
+                                                    dimension, value
+                                                ),
+                                                "value": value,
+                                            }
+                                            for value in ["All"]
+                                            + sorted(
+                                                set(data.df_justice_cube[dimension])
+                                                - {"All"}
+                                            )
+                                        ],
+                                        value="All",
+                                        clearable=False,
+                                        style={"width": "100%"},
+                                    )
+                                    for dimension in DashBLM.justice_dimensions
+                                ],
+                                style={
+                                    "display": "grid",
+                                    "grid-template-columns": "repeat(4, 1fr)",
+                                    "gap": "1%",
+                                    "padding": "1% 0",
+                                },
+                            ),
+                        ],
+                    ),
+                    dcc.Tab(
+                        label="Take Action",
+                        children=[
+                            html.H1(
+                                "What You Can Do",
+                                style={
+                                    "width": "100%",
+                                    "text-align": "center",
+                                    "padding-top": "5%",
+                                },
+                            ),
+                            html.Div(
                                 dcc.Markdown(
                                     """
-                        ## Sentence Length by Ethnicity
-                        #### Data for England and Wales only
-                        *Hover over the graph for more information*""",
-                                    style={"width": "100%", "text-align": "center"},
-                                ),
-                            ]
-                        ),
-                        html.Div(
-                            [
-                                dcc.Graph(
-                                    id="justice-graph", config={"displayModeBar": False}
+                    You can add your signature to existing petitions [here.](https://petition.parliament.uk/petitions?state=open&topic=race-and-equality)
+
+                    You can write to your MP. Find them [here.](https://members.parliament.uk/members/Commons)
+
+                    Sign the [petition](https://www.change.org/p/govia-thameslink-justice-for-belly-mujinga?recruiter=false&utm_source=share_petition&utm_medium=twitter&utm_campaign=psf_combo_share_initial&utm_term=psf_combo_share_initial&recruited_by_id=ffad40c0-a0c4-11ea-ac15-4118e05249bd) 
+                    to get justice for Belly Mujinga, who likely died after being spat at by an individual with COVID-19.
+
+                    [Donate](https://greenandblackcross.org/get-involved/donate/) to give legal support to protesters.
+
+                    [Support](https://supportgrenfell.co.uk/) the justice for grenfell movement.
+
+                    Keep learning and [read more!](https://blackinbritain.uk/resources)
+                    """
                                 ),
-                            ]
-                        ),
-                        dcc.Slider(
-                            id="year-slider-justice",
-                            min=df_sunburst["Year"].min(),
-                            max=df_sunburst["Year"].max(),
-                            value=df_sunburst["Year"].min(),
-                            marks={
-                                str(year): str(year)
-                                for year in df_sunburst["Year"].unique()
-                            },
-                            step=None,
-                        ),
-                    ],
-                ),
-                dcc.Tab(
-                    label="Take Action",
-                    children=[
-                        html.H1(
-                            "What You Can Do",
-                            style={
-                                "width": "100%",
-                                "text-align": "center",
-                                "padding-top": "5%",
-                            },
-                        ),
-                        html.Div(
-                            dcc.Markdown(
-                                """
-                You can add your signature to existing petitions [here.](https://petition.parliament.uk/petitions?state=open&topic=race-and-equality)
-                
-                You can write to your MP. Find them [here.](https://members.parliament.uk/members/Commons)
-                
-                Sign the [petition](https://www.change.org/p/govia-thameslink-justice-for-belly-mujinga?recruiter=false&utm_source=share_petition&utm_medium=twitter&utm_campaign=psf_combo_share_initial&utm_term=psf_combo_share_initial&recruited_by_id=ffad40c0-a0c4-11ea-ac15-4118e05249bd) 
-                to get justice for Belly Mujinga, who likely died after being spat at by an individual with COVID-19.
-                
-                [Donate](https://greenandblackcross.org/get-involved/donate/) to give legal support to protesters.
-                
-                [Support](https://supportgrenfell.co.uk/) the justice for grenfell movement.
-                
-                Keep learning and [read more!](https://blackinbritain.uk/resources)
-                """
+                                style={
+                                    "width": "100%",
+                                    "text-align": "center",
+                                    "padding-top": "5%",
+                                },
                             ),
-                            style={
-                                "width": "100%",
-                                "text-align": "center",
-                                "padding-top": "5%",
-                            },
-                        ),
-                    ],
-                ),
-            ]
-        )
-    ]
-)
+                        ],
+                    ),
+                ]
+            )
+        ]
+    )
+
+
+# ----------------------------------------------------------------------------#
+# Load artifacts
+# ----------------------------------------------------------------------------#
+
+artifacts = load_artifacts(path, artifact_files, phase=startup.phase)
+app.layout = artifacts.page
+
+# The bundle being served and the one before it, by version. The map is built up in the browser over several
+# callbacks, so those look up the version the page was loaded with to keep adding to it from the same data
+
+artifact_buffers = {artifacts.version: artifacts}
+
+
+def artifacts_for(version):
+    return artifact_buffers.get(version, artifacts)
+
 
 # ----------------------------------------------------------------------------#
 # Callbacks for interactive graph components
@@ -315,10 +727,16 @@ def update_figure(selected_year):
     :return: a plotly express graph object.
     """
 
-    # Add year slider and prep data
+    import plotly.express as px
+
+    # Look up the pre-sorted data for the selected year. A page loaded before the data was last updated can ask for
+    # a year that's no longer there
 
-    df_temp = filtered_df[~filtered_df.Ethnicity.str.contains("White")]
-    df_temp = df_temp[df_temp["Year"] == selected_year]
+    minority_arrests_by_year = artifacts.minority_arrests_by_year
+    if selected_year not in minority_arrests_by_year:
+        return dash.no_update
+
+    df_temp = minority_arrests_by_year[selected_year]
 
     # Draw figure. There was a glitch with the x axis title so I removed it here before drawing it on later
 
@@ -348,66 +766,23 @@ def update_figure(selected_year):
         hovermode="x",
     )
 
-    # Add annotations to show offset compared to white arrests
-
-    fig.add_annotation(
-        x=df_temp["Arrests"].iloc[0],
-        y="Asian Actual",
-        text="{}{}%".format(
-            "+"
-            if (
-                (df_temp["Arrests"].iloc[0] - df_temp["Arrests"].iloc[1])
-                / df_temp["Arrests"].iloc[0]
-                * 100
-            )
-            > 0
-            else "",
-            int(
-                round(
-                    (df_temp["Arrests"].iloc[0] - df_temp["Arrests"].iloc[1])
-                    / df_temp["Arrests"].iloc[1],
-                    2,
-                )
-                * 100
-            ),
-        ),
-        font=dict(color="white", size=12),
-        arrowcolor="#ffffff",
-    )
-    fig.add_annotation(
-        x=df_temp["Arrests"].iloc[2],
-        y="Black Actual",
-        text="{}{}%".format(
-            "+",
-            int(
-                round(
-                    (df_temp["Arrests"].iloc[2] - df_temp["Arrests"].iloc[3])
-                    / df_temp["Arrests"].iloc[3],
-                    2,
-                )
-                * 100
-            ),
-        ),
-        font=dict(color="white", size=12,),
-        arrowcolor="#ffffff",
-    )
-    fig.add_annotation(
-        x=(df_temp["Arrests"].iloc[4]),
-        y="Mixed Actual",
-        text="{}{}%".format(
-            "+",
-            int(
-                round(
-                    (df_temp["Arrests"].iloc[4] - df_temp["Arrests"].iloc[5])
-                    / df_temp["Arrests"].iloc[5],
-                    2,
-                )
-                * 100
-            ),
-        ),
-        font=dict(color="white", size=12,),
-        arrowcolor="#ffffff",
-    )
+    # Add annotations to show offset compared to white arrests, one for every group with an adjusted equivalent
+
+    for group in df_temp.index[df_temp.index.str.endswith(" Actual")]:
+        adjusted = group.replace(" Actual", " Adjusted")
+        if adjusted not in df_temp.index:
+            continue
+        actual_arrests = df_temp.at[group, "Arrests"]
+        adjusted_arrests = df_temp.at[adjusted, "Arrests"]
+        offset = (actual_arrests - adjusted_arrests) / adjusted_arrests
+        fig.add_annotation(
+            x=actual_arrests,
+            y=group,
+            text="{}{}%".format("+" if offset > 0 else "", int(round(offset, 2) * 100)),
+            font=dict(color="white", size=12),
+            arrowcolor="#ffffff",
+        )
+
     fig.update_annotations(
         dict(xref="x", yref="y", showarrow=True, arrowhead=7, ax=-100, ay=0,)
     )
@@ -424,15 +799,55 @@ def update_figure(selected_year):
 
 
 @app.callback(
-    Output("justice-graph", "figure"), [Input("year-slider-justice", "value")]
+    Output("justice-graph", "figure"),
+    [Input("year-slider-justice", "value")]
+    + [
+        Input("justice-" + dimension.lower().replace(" ", "-"), "value")
+        for dimension in DashBLM.justice_dimensions
+    ],
 )
-def update_justice_figure(selected_justice_year):
+def update_justice_figure(
+    selected_justice_year,
+    selected_sex="All",
+    selected_age_group="All",
+    selected_offence_group="All",
+    selected_area="All",
+):
     """
-    Updates the justice graph based on user input for the year.
+    Updates the justice graph based on user input for the year and how to break the data down.
     :param selected_year: int or float, user input.
+    :param selected_sex: string, user input, or "All".
+    :param selected_age_group: string, user input, or "All".
+    :param selected_offence_group: string, user input, or "All".
+    :param selected_area: string, the police force area picked by the user, or "All".
     :return: a plotly express graph object.
     """
-    df_sunburst_graph = df_sunburst[df_sunburst["Year"] == selected_justice_year]
+
+    import plotly.express as px
+
+    df_sunburst_graph = artifacts.justice_by_selection.get(
+        (
+            int(selected_justice_year),
+            selected_sex,
+            selected_age_group,
+            selected_offence_group,
+            selected_area,
+        )
+    )
+
+    # The sources only break the data down one way at a time, e.g. by sex or by offence group but not both
+
+    if df_sunburst_graph is None:
+        justice_graph = go.Figure()
+        justice_graph.add_annotation(
+            text="No figures are published for this combination, try setting one of them back to All",
+            showarrow=False,
+        )
+        justice_graph.update_layout(
+            xaxis_visible=False, yaxis_visible=False, paper_bgcolor="whitesmoke",
+        )
+        return justice_graph
+
     justice_graph = px.sunburst(
         df_sunburst_graph,
         path=["Ethnicity", "Sentence Length"],
@@ -475,6 +890,229 @@ def update_justice_figure(selected_justice_year):
     return justice_graph
 
 
+# Switch the stop and search map between individual searches and heatmaps
+
+
+def choropleth_for(data, selected_ethnicity):
+    """
+    Gets the choropleth trace coloured by an ethnicity's population share.
+    :param data: the bundle of artifacts to draw it from.
+    :param selected_ethnicity: string, one of the keys of choropleth_measures.
+    :return: a plotly graph object trace.
+    """
+
+    if selected_ethnicity == "Black":
+        return data.choro
+
+    return go.Choroplethmapbox(
+        data.choro,
+        z=data.choropleth_measures[selected_ethnicity],
+        hovertemplate=data.choropleth_hovertemplate.format(selected_ethnicity),
+    )
+
+
+def update_map(selected_mode, selected_ethnicity="Black", version=None):
+    """
+    Updates the stop and search map based on user input for how to show the searches.
+    :param selected_mode: 'points' for one marker per search, otherwise the cell size in degrees of the heatmap.
+    :param selected_ethnicity: string, the ethnicity the choropleth is coloured by.
+    :param version: string, version of the artifacts the page was loaded with.
+    :return: a plotly graph object.
+    """
+
+    data = artifacts_for(version)
+
+    if selected_mode == "points" and selected_ethnicity == "Black":
+        return data.ethnicity_map
+
+    if selected_mode == "points":
+        return go.Figure(
+            data=[choropleth_for(data, selected_ethnicity), data.scatt],
+            layout=data.ethnicity_map.layout,
+        )
+
+    # Draw searches per cell rather than per search so the browser only has to render one value per cell
+
+    df_cells = data.density_by_resolution[selected_mode]
+    density = go.Densitymapbox(
+        lat=df_cells["lat"],
+        lon=df_cells["lon"],
+        z=df_cells["Count"],
+        text=df_cells["text"],
+        radius=max(4, int(selected_mode * 80)),
+        colorscale="Icefire",
+        showscale=False,
+        hovertemplate="%{text} <extra></extra>",
+    )
+
+    density_map = go.Figure(
+        data=[choropleth_for(data, selected_ethnicity), density], layout=data.layout
+    )
+    density_map.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
+    density_map["layout"]["titlefont"] = {"family": "Roboto", "size": 14}
+    density_map.layout.font.family = "Roboto"
+
+    return density_map
+
+
+@app.callback(
+    [
+        Output("ethnicity-map", "figure"),
+        Output("map-stream", "n_intervals"),
+        Output("map-stream", "max_intervals"),
+        Output("map-stream-sent", "data"),
+        Output("map-stream", "disabled"),
+    ],
+    [Input("map-mode", "value")],
+    [State("map-ethnicity", "value"), State("artifact-version", "data")],
+    prevent_initial_call=True,
+)
+def switch_map_mode(selected_mode, selected_ethnicity="Black", version=None):
+    """
+    Redraws the stop and search map for a new way of showing the searches. Going back to individual searches
+    starts streaming them in again from the sample; the new figure and the restart arrive together so no chunk is
+    added to the old figure.
+    :param selected_mode: 'points' for one marker per search, otherwise the cell size in degrees of the heatmap.
+    :param selected_ethnicity: string, the ethnicity the choropleth is coloured by.
+    :param version: string, version of the artifacts the page was loaded with.
+    :return: the map figure, the streaming interval's count and limit, the last chunk sent and whether streaming
+    is paused.
+    """
+
+    return (
+        update_map(selected_mode, selected_ethnicity, version),
+        0,
+        1,
+        0,
+        selected_mode != "points" or artifacts_for(version).map_stream_chunks == 0,
+    )
+
+
+# Stream the rest of the searches into the map a chunk at a time. Each chunk is added to the end of the searches the
+# browser already has with a dash.Patch, so the stored figure stays whole if the tab is left and come back to.
+# The interval stops after each tick until the chunk it asked for comes back and raises its limit, and which chunk to
+# send next comes from the last one the browser applied, so a slow chunk can't be overtaken or sent twice
+
+
+@app.callback(
+    [
+        Output("ethnicity-map", "figure", allow_duplicate=True),
+        Output("map-stream-sent", "data", allow_duplicate=True),
+        Output("map-stream", "max_intervals", allow_duplicate=True),
+        Output("map-stream", "disabled", allow_duplicate=True),
+    ],
+    [Input("map-stream", "n_intervals")],
+    [
+        State("map-stream-sent", "data"),
+        State("map-mode", "value"),
+        State("artifact-version", "data"),
+    ],
+    prevent_initial_call=True,
+)
+def stream_map_points(n_intervals, sent=0, selected_mode="points", version=None):
+    """
+    Sends the next chunk of searches to the stop and search map.
+    :param n_intervals: int, how many times the interval has ticked since the map was last drawn.
+    :param sent: int, the last chunk the map has had.
+    :param selected_mode: the map's current mode; chunks are only sent while it shows individual searches.
+    :param version: string, version of the artifacts the page was loaded with. Chunks are only sent to pages loaded
+    with a version that's still held, since they're added to the searches the page already has.
+    :return: a dash.Patch extending the searches, the chunk sent, the interval's new limit and whether streaming is
+    finished.
+    """
+
+    if not n_intervals:
+        return dash.no_update, dash.no_update, dash.no_update, dash.no_update
+
+    data = artifact_buffers.get(version)
+    chunk_number = (sent or 0) + 1
+
+    if (
+        data is None
+        or selected_mode != "points"
+        or chunk_number > data.map_stream_chunks
+    ):
+        return dash.no_update, dash.no_update, dash.no_update, True
+
+    start = data.map_stream_sample + (chunk_number - 1) * data.map_stream_chunk
+    points = map_points_chunk(
+        data.map_points, slice(start, start + data.map_stream_chunk)
+    )
+
+    patch = dash.Patch()
+    trace = patch["data"][1]
+    trace["lat"].extend(points["lat"])
+    trace["lon"].extend(points["lon"])
+    trace["text"].extend(points["text"])
+    trace["marker"]["size"].extend(points["size"])
+    trace["marker"]["color"].extend(points["color"])
+
+    return (
+        patch,
+        chunk_number,
+        n_intervals + 1,
+        chunk_number == data.map_stream_chunks,
+    )
+
+
+# Recolour the choropleth by another ethnicity. Only the new values and hover text are sent; the browser keeps the
+# boundaries and the searches it already has
+
+
+@app.callback(
+    Output("ethnicity-map", "figure", allow_duplicate=True),
+    [Input("map-ethnicity", "value")],
+    [State("artifact-version", "data")],
+    prevent_initial_call=True,
+)
+def update_map_ethnicity(selected_ethnicity, version=None):
+    """
+    Updates the choropleth on the stop and search map based on user input for the ethnicity.
+    :param selected_ethnicity: string, one of the keys of choropleth_measures.
+    :param version: string, version of the artifacts the page was loaded with. Pages loaded with a version that
+    isn't held any more aren't updated, since the new values might not line up with the districts they have.
+    :return: a dash.Patch of the choropleth's z values and hover template.
+    """
+
+    data = artifact_buffers.get(version)
+    if data is None:
+        return dash.no_update
+
+    patch = dash.Patch()
+    patch["data"][0]["z"] = data.choropleth_measures[selected_ethnicity]
+    patch["data"][0]["hovertemplate"] = data.choropleth_hovertemplate.format(
+        selected_ethnicity
+    )
+
+    return patch
+
+
+# Create stop and search trends graph
+
+
+@app.callback(Output("trend-graph", "figure"), [Input("trend-area", "value")])
+def update_trend_figure(selected_area):
+    """
+    Updates the stop and search trends graph based on user input for the area.
+    :param selected_area: string, national or the name of a local area district.
+    :return: a plotly express graph object.
+    """
+
+    import plotly.express as px
+
+    df_area = artifacts.trends_by_area.get(selected_area, pd.DataFrame())
+
+    trend_graph = px.line(df_area, labels={"value": "Searches per 1k", "Month": ""})
+    trend_graph.update_layout(legend_title_text="Ethnicity", hovermode="x")
+
+    # Make all fonts in graph Roboto
+
+    trend_graph["layout"]["titlefont"] = {"family": "Roboto", "size": 14}
+    trend_graph.layout.font.family = "Roboto"
+
+    return trend_graph
+
+
 # Update markdown stats too
 
 
@@ -482,40 +1120,70 @@ def update_justice_figure(selected_justice_year):
 def update_text(selected_year):
     """
     This updates a text box below the graph that says how many times more likely black people are to be arrested.
+    The ratios and their confidence intervals are all worked out by processing.py, so this only looks them up.
     :param selected_year: int or float, user input.
     :return: string.
     """
 
-    filtered_df.sort_values(by=["Year", "Ethnicity"], inplace=True)
-    df_markdown = filtered_df[filtered_df["Year"] == selected_year]
-    text = """
-    This year Black, Asian, and Mixed people were respectively **{}**, **{}** and **{}** times as likely as white 
-    people to be arrested.""".format(
-        round(
-            (
-                df_markdown["Arrests per 1k"].iloc[2]
-                / df_markdown["Arrests per 1k"].iloc[6]
-            ),
-            1,
-        ),
-        round(
-            (
-                df_markdown["Arrests per 1k"].iloc[0]
-                / df_markdown["Arrests per 1k"].iloc[6]
-            ),
-            1,
-        ),
-        round(
-            (
-                df_markdown["Arrests per 1k"].iloc[4]
-                / df_markdown["Arrests per 1k"].iloc[6]
-            ),
-            1,
-        ),
+    disparities_by_selection = artifacts.disparities_by_selection
+
+    key = ("Arrests", "National", int(selected_year))
+    if key not in disparities_by_selection:
+        return ""
+
+    return DashBLM.describe_disparities(
+        disparities_by_selection[key], "This year", "arrested"
     )
 
-    return text
 
+# The layout only changes when new artifacts are swapped in, so it's encoded once, on the first page load after that,
+# and those bytes are served until the next swap
+
+layout_cache = LayoutCache()
+layout_cache.install(app)
+
+# ----------------------------------------------------------------------------#
+# Reload artifacts
+# ----------------------------------------------------------------------------#
+
+# When processing.py writes new data files a background thread loads them into a second bundle while the current one
+# carries on being served, then swaps it in with a single assignment. Requests already running finish with the bundle
+# they started with. Set DASH_BLM_RELOAD_INTERVAL to how often in seconds to check the files, or 0 to never check
+
+
+def reload_artifacts(manifest):
+    """
+    Loads a new version of the data files and starts serving it.
+    :param manifest: dict of the content hash of each data file when the watcher saw them change. The files are
+    hashed again as they're loaded, in case they've changed since.
+    :return: dict, the manifest of the files that were loaded.
+    """
+
+    global artifacts, artifact_buffers
+
+    bundle = load_artifacts(path, artifact_files)
+    artifact_buffers = {artifacts.version: artifacts, bundle.version: bundle}
+    artifacts = bundle
+    app.layout = bundle.page
+
+    # The cached layout has the old figures and version in it
+
+    layout_cache.clear()
+
+    return bundle.manifest
+
+
+watcher = ArtifactWatcher(
+    path,
+    artifact_files,
+    reload_artifacts,
+    manifest=artifacts.manifest,
+    interval=float(os.environ.get("DASH_BLM_RELOAD_INTERVAL", 5)),
+)
+if watcher.interval > 0:
+    watcher.start()
+
+startup.finish()
 
 # ----------------------------------------------------------------------------#
 # Launch
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import logging
+import pathlib
+import threading
+
+
+def artifact_manifest(directory, filenames):
+    """
+    Hashes the contents of each data file the app is built from, so two sets of files can be told apart by what's in
+    them rather than by when they were written.
+    :param directory: string or path, the data directory.
+    :param filenames: list of file names in it. Files that aren't there are left out.
+    :return: dict of file name to sha256 hex digest.
+    """
+
+    manifest = {}
+
+    for filename in filenames:
+        file = pathlib.Path(directory) / filename
+        if not file.exists():
+            continue
+        digest = hashlib.sha256()
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        manifest[filename] = digest.hexdigest()
+
+    return manifest
+
+
+def read_artifacts(directory, filenames):
+    """
+    Reads each data file the app is built from into memory and hashes the bytes that were read, so the manifest
+    always describes the data that's loaded even if a file is replaced while it's being read.
+    :param directory: string or path, the data directory.
+    :param filenames: list of file names in it. Files that aren't there are left out.
+    :return: tuple of a dict of file name to its contents as bytes, and the manifest of them.
+    """
+
+    contents = {}
+
+    for filename in filenames:
+        try:
+            contents[filename] = (pathlib.Path(directory) / filename).read_bytes()
+        except FileNotFoundError:
+            continue
+
+    manifest = {
+        filename: hashlib.sha256(content).hexdigest()
+        for filename, content in contents.items()
+    }
+
+    return contents, manifest
+
+
+def manifest_version(manifest):
+    """
+    A short name for a set of data files that changes whenever any of them does.
+    :param manifest: dict of file name to content hash.
+    :return: string.
+    """
+
+    return hashlib.sha1(
+        json.dumps(manifest, sort_keys=True).encode("utf-8")
+    ).hexdigest()[:12]
+
+
+class ArtifactWatcher:
+    """
+    Checks a set of data files every so often from a background thread and calls back with a new manifest when
+    their contents change. Checking only looks at file sizes and modified times; the files are hashed once they've
+    stopped changing between two checks in a row, so a set of files that's still being written or copied in isn't
+    picked up half way. Files rewritten with the same contents don't trigger a reload.
+    The reload function can return the manifest of the files it actually loaded, which is kept in place of the one it
+    was called with in case a file changed again in between.
+    If loading the new files fails the old ones carry on being served until the files change again.
+    """
+
+    def __init__(self, directory, filenames, reload, manifest=None, interval=5.0):
+        self.directory = pathlib.Path(directory)
+        self.filenames = list(filenames)
+        self.reload = reload
+        self.interval = interval
+        self.manifest = (
+            manifest
+            if manifest is not None
+            else artifact_manifest(self.directory, self.filenames)
+        )
+        self.signature = self.stat()
+        self.pending = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def stat(self):
+        signature = []
+        for filename in self.filenames:
+            file = self.directory / filename
+            if file.exists():
+                stat = file.stat()
+                signature.append((filename, stat.st_size, stat.st_mtime_ns))
+
+        return tuple(signature)
+
+    def check(self):
+        """
+        Checks the files once, reloading them if they've changed and settled.
+        :return: bool, whether new files were loaded.
+        """
+
+        signature = self.stat()
+
+        if signature == self.signature:
+            self.pending = None
+            return False
+
+        if signature != self.pending:
+            self.pending = signature
+            return False
+
+        self.signature, self.pending = signature, None
+        manifest = artifact_manifest(self.directory, self.filenames)
+        if manifest == self.manifest:
+            return False
+
+        try:
+            loaded = self.reload(manifest)
+        except Exception:
+            logging.exception(
+                "[*] Couldn't load the new data files, keeping the old ones"
+            )
+            return False
+
+        self.manifest = loaded or manifest
+        logging.info(
+            "[*] Now serving data version {}".format(manifest_version(self.manifest))
+        )
+
+        return True
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+
+        return None
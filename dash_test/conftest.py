@@ -1,7 +1,100 @@
+import importlib
+import importlib.util
+import json
+import os
+import pathlib
+import sys
+
+import pytest
 from selenium.webdriver.chrome.options import Options
 
 
+# The tests load new data into the app themselves rather than leaving it to a background thread
+
+os.environ.setdefault("DASH_BLM_RELOAD_INTERVAL", "0")
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--bench-rows",
+        type=int,
+        default=20000,
+        help="Number of synthetic stop and searches to benchmark with, e.g. 1000000 for national multi-year data.",
+    )
+
+
 def pytest_setup_options():
     options = Options()
     options.add_argument("--disable-gpu")
     return options
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    """
+    Imports app.py from a scratch working directory so the tests don't need a real mapbox token or the full LAD
+    geojson file, and so any files the app writes out on startup don't end up in the repository.
+    :return: the imported app module.
+    """
+
+    repo = pathlib.Path(__file__).resolve().parent.parent
+    workdir = tmp_path_factory.mktemp("dash-blm")
+    (workdir / "data").mkdir()
+
+    for source in (repo / "data").iterdir():
+        (workdir / "data" / source.name).symlink_to(source)
+
+    with open(workdir / "data" / "formatted_UK_LAD.geojson", "w") as f:
+        json.dump({"type": "FeatureCollection", "features": []}, f)
+    with open(workdir / ".mapbox_token", "w") as f:
+        f.write("test-token")
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        sys.modules.pop("app", None)
+        module = importlib.import_module("app")
+    finally:
+        os.chdir(cwd)
+
+    return module
+
+
+@pytest.fixture
+def workdir(tmp_path):
+    """
+    A scratch working directory laid out like the repository root with the real data files linked in, for the
+    processing steps that read from data/ and write their output to the working directory.
+    """
+
+    repo = pathlib.Path(__file__).resolve().parent.parent
+    (tmp_path / "data").mkdir()
+    for source in (repo / "data").iterdir():
+        (tmp_path / "data" / source.name).symlink_to(source)
+
+    cwd = os.getcwd()
+    os.chdir(tmp_path)
+    yield tmp_path
+    os.chdir(cwd)
+
+
+@pytest.fixture(scope="session")
+def stopsearch_script():
+    """
+    Loads get-stopsearch-data.py, which can't be imported by name because of the hyphens in its filename.
+    :return: the loaded module.
+    """
+
+    repo = pathlib.Path(__file__).resolve().parent.parent
+    spec = importlib.util.spec_from_file_location(
+        "get_stopsearch_data", repo / "get-stopsearch-data.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+@pytest.fixture(scope="session")
+def police_api(stopsearch_script):
+    return stopsearch_script.PoliceAPI
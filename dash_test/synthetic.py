@@ -0,0 +1,102 @@
+import pathlib
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from processing import DashBLM
+
+REPO = pathlib.Path(__file__).resolve().parent.parent
+
+
+def make_scatter_dataframe(rows, seed=0):
+    """
+    Scales the real scattermapbox data up (or down) to any number of rows by resampling it and jittering the
+    co-ordinates, so the benchmarks can see how the app behaves with national, multi-year data.
+    :param rows: int, number of searches to generate.
+    :param seed: int, so the same data comes out every run.
+    :return: dataframe in the same format as df_scatter.csv.
+    """
+
+    rng = np.random.default_rng(seed)
+    df = DashBLM.read_scatter_dataframe(REPO / "data" / "df_scatter.csv")
+    df = df.iloc[rng.integers(0, len(df), rows)].reset_index(drop=True)
+    df["lats"] += rng.normal(0, 0.01, rows).astype("float32")
+    df["longs"] += rng.normal(0, 0.01, rows).astype("float32")
+
+    return df
+
+
+def make_stopsearch_results(rows, months=12, seed=0):
+    """
+    Builds merged police API output like the --merge argument of get-stopsearch-data.py writes, from the synthetic
+    scattermapbox data.
+    :param rows: int, total number of searches across all months.
+    :param months: int, number of months starting from January 2019 to spread them over.
+    :param seed: int, so the same data comes out every run.
+    :return: dict with the searches for each month under the 'results' key.
+    """
+
+    df = make_scatter_dataframe(rows, seed=seed)
+    fields = df["text"].str.extract(
+        r"Reason: (.*)<br>Ethnicity: (.*)<br>Age: (.*)<br>Gender: (.*)"
+    )
+    fields = fields.where(fields != "None", None)
+    month_names = (
+        pd.date_range("2019-01", periods=months, freq="MS").strftime("%Y-%m").tolist()
+    )
+
+    results = {month: [] for month in month_names}
+
+    for i, (lat, lon, reason, ethnicity, age, gender) in enumerate(
+        zip(df["lats"], df["longs"], fields[0], fields[1], fields[2], fields[3])
+    ):
+        results[month_names[i % months]].append(
+            {
+                "datetime": month_names[i % months] + "-01T12:00:00+00:00",
+                "location": {"latitude": str(lat), "longitude": str(lon)},
+                "object_of_search": reason,
+                "self_defined_ethnicity": ethnicity,
+                "age_range": age,
+                "gender": gender,
+            }
+        )
+
+    return {"results": results}
+
+
+def make_stopsearch_archive(filename, rows, months=12, seed=0):
+    """
+    Writes the synthetic searches out as a bulk download zip file like the ones at https://data.police.uk/data/,
+    with a folder per month holding one force's csv.
+    :param filename: path of the zip file to write.
+    :param rows: int, total number of searches across all months.
+    :param months: int, number of months starting from January 2019 to spread them over.
+    :param seed: int, so the same data comes out every run.
+    :return: None.
+    """
+
+    results = make_stopsearch_results(rows, months=months, seed=seed)["results"]
+
+    with zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED) as archive:
+        for month, stopsearches in results.items():
+            df = pd.DataFrame(
+                {
+                    "Type": "Person search",
+                    "Date": [x["datetime"] for x in stopsearches],
+                    "Latitude": [x["location"]["latitude"] for x in stopsearches],
+                    "Longitude": [x["location"]["longitude"] for x in stopsearches],
+                    "Gender": [x["gender"] for x in stopsearches],
+                    "Age range": [x["age_range"] for x in stopsearches],
+                    "Self-defined ethnicity": [
+                        x["self_defined_ethnicity"] for x in stopsearches
+                    ],
+                    "Object of search": [x["object_of_search"] for x in stopsearches],
+                }
+            )
+            archive.writestr(
+                "{0}/{0}-synthetic-stop-and-search.csv".format(month),
+                df.to_csv(index=False),
+            )
+
+    return None
@@ -0,0 +1,127 @@
+import importlib
+import json
+import os
+import pathlib
+import shutil
+import sys
+
+import dash
+import pandas as pd
+
+from artifact_watcher import ArtifactWatcher, artifact_manifest, read_artifacts
+
+REPO = pathlib.Path(__file__).resolve().parent.parent
+
+
+def test_changed_files_are_reloaded_once_settled(tmp_path):
+    (tmp_path / "a.csv").write_text("x\n1\n")
+    reloads = []
+    watcher = ArtifactWatcher(tmp_path, ["a.csv", "b.csv"], reloads.append)
+
+    assert not watcher.check()
+
+    # New files are only loaded once they've stopped changing between two checks
+
+    (tmp_path / "a.csv").write_text("x\n2\n")
+    (tmp_path / "b.csv").write_text("y\n")
+    assert not watcher.check()
+    assert watcher.check()
+    assert reloads == [artifact_manifest(tmp_path, ["a.csv", "b.csv"])]
+
+    # Writing the same contents again isn't a change
+
+    (tmp_path / "a.csv").write_text("x\n2\n")
+    os.utime(tmp_path / "a.csv", ns=(0, 0))
+    assert not watcher.check() and not watcher.check()
+    assert len(reloads) == 1
+
+
+def test_files_that_fail_to_load_are_skipped(tmp_path):
+    (tmp_path / "a.csv").write_text("x\n1\n")
+
+    def reload(manifest):
+        raise ValueError("half written")
+
+    watcher = ArtifactWatcher(tmp_path, ["a.csv"], reload)
+    manifest = watcher.manifest
+
+    (tmp_path / "a.csv").write_text("x\n")
+    assert not watcher.check() and not watcher.check()
+    assert watcher.manifest == manifest
+
+
+def test_watcher_keeps_the_manifest_that_was_loaded(tmp_path):
+    (tmp_path / "a.csv").write_text("x\n1\n")
+
+    def reload(manifest):
+        # The file is replaced again while the first change is being loaded
+
+        (tmp_path / "a.csv").write_text("x\n3\n")
+        contents, loaded = read_artifacts(tmp_path, ["a.csv", "b.csv"])
+        assert contents == {"a.csv": b"x\n3\n"}
+        return loaded
+
+    watcher = ArtifactWatcher(tmp_path, ["a.csv", "b.csv"], reload)
+
+    (tmp_path / "a.csv").write_text("x\n2\n")
+    assert not watcher.check()
+    assert watcher.check()
+    assert watcher.manifest == artifact_manifest(tmp_path, ["a.csv", "b.csv"])
+    assert not watcher.check() and not watcher.check()
+
+
+def test_app_swaps_in_new_data_without_restarting(tmp_path):
+    """
+    Starts a copy of the app on its own data, rewrites one of the files and checks the app starts serving it, while
+    a page loaded before the swap can still carry on streaming its map from the data it was loaded with.
+    """
+
+    (tmp_path / "data").mkdir()
+    for source in (REPO / "data").iterdir():
+        shutil.copy(source, tmp_path / "data" / source.name)
+    with open(tmp_path / "data" / "formatted_UK_LAD.geojson", "w") as f:
+        json.dump({"type": "FeatureCollection", "features": []}, f)
+
+    cwd = os.getcwd()
+    os.chdir(tmp_path)
+    try:
+        sys.modules.pop("app", None)
+        app_module = importlib.import_module("app")
+    finally:
+        os.chdir(cwd)
+        sys.modules.pop("app", None)
+
+    old = app_module.artifacts
+    first_year = min(old.arrests_by_year)
+
+    with app_module.app.server.test_client() as client:
+        before = client.get("/_dash-layout")
+
+        filtered_df = pd.read_csv(tmp_path / "data" / "filtered_df.csv")
+        filtered_df[filtered_df["Year"] != first_year].to_csv(
+            tmp_path / "data" / "filtered_df.csv", index=False
+        )
+        assert not app_module.watcher.check()
+        assert app_module.watcher.check()
+
+        after = client.get("/_dash-layout")
+        manifest = client.get("/artifacts").get_json()
+
+    new = app_module.artifacts
+    assert new is not old and new.version != old.version
+    assert new.manifest == artifact_manifest(
+        tmp_path / "data", app_module.artifact_files
+    )
+    assert not hasattr(app_module, "ethnicity_map")
+    assert manifest == {"version": new.version, "files": new.manifest}
+    assert before.headers["ETag"] != after.headers["ETag"]
+    assert old.version in before.get_data(as_text=True)
+    assert new.version in after.get_data(as_text=True)
+    assert min(new.arrests_by_year) > first_year
+    assert app_module.update_figure(first_year) is dash.no_update
+
+    # Pages from before the swap keep drawing their map from the old data, new pages from the new
+
+    assert app_module.update_map("points", version=old.version) is old.ethnicity_map
+    assert app_module.update_map("points", version=new.version) is new.ethnicity_map
+    assert app_module.update_map("points", version="gone") is new.ethnicity_map
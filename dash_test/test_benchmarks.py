@@ -0,0 +1,227 @@
+"""
+Benchmarks for the processing pipeline and the Dash app. Run these with
+
+    python -m pytest dash_test/test_benchmarks.py --benchmark-autosave
+
+to time them and save the results under .benchmarks/ against the current commit. Comparing with an earlier run, e.g.
+
+    python -m pytest dash_test/test_benchmarks.py --benchmark-compare --benchmark-compare-fail=mean:10%
+
+shows (and fails on) regressions. Use --bench-rows 1000000 to scale the stop and search data up to national size.
+"""
+
+import importlib
+import json
+import pathlib
+import sys
+
+import pandas as pd
+import plotly.graph_objects as go
+import pytest
+
+from processing import DashBLM
+from result_store import ResultWriter
+from dash_test.synthetic import (
+    make_scatter_dataframe,
+    make_stopsearch_archive,
+    make_stopsearch_results,
+)
+
+pytest.importorskip("pytest_benchmark")
+
+REPO = pathlib.Path(__file__).resolve().parent.parent
+ARRESTS_YEARS = sorted(
+    int(x) for x in pd.read_csv(REPO / "data" / "filtered_df.csv")["Year"].unique()
+)
+JUSTICE_YEARS = sorted(
+    int(x) for x in pd.read_csv(REPO / "data" / "df_sunburst.csv")["Year"].unique()
+)
+ROUNDS = 5
+
+
+@pytest.fixture
+def rows(request):
+    return request.config.getoption("--bench-rows")
+
+
+@pytest.fixture
+def app_workdir(workdir):
+    """
+    A scratch working directory with a stand-in mapbox token and geojson file so the app can start.
+    """
+
+    with open(workdir / "data" / "formatted_UK_LAD.geojson", "w") as f:
+        json.dump({"type": "FeatureCollection", "features": []}, f)
+    with open(workdir / ".mapbox_token", "w") as f:
+        f.write("benchmark-token")
+
+    return workdir
+
+
+def write_stopsearch_results(stopsearchdata):
+    """
+    Writes merged API output the way the --merge argument of get-stopsearch-data.py does.
+    """
+
+    with ResultWriter(DashBLM.stopsearch_filename) as writer:
+        for month, records in stopsearchdata["results"].items():
+            writer.write_many(dict(record, month=month) for record in records)
+
+
+def replace_scatter(workdir, rows):
+    """
+    Swaps the linked in df_scatter.csv for synthetic data of the requested size.
+    """
+
+    scatter = workdir / "data" / "df_scatter.csv"
+    scatter.unlink()  # only removes the link, not the real file
+    make_scatter_dataframe(rows).to_csv(scatter)
+
+
+# ----------------------------------------------------------------------------#
+# Processing pipeline
+# ----------------------------------------------------------------------------#
+
+
+def test_make_arrests_dataframe(benchmark, workdir):
+    benchmark.pedantic(DashBLM.make_arrests_dataframe, rounds=ROUNDS)
+
+
+def test_make_denominators(benchmark, workdir):
+    benchmark.pedantic(DashBLM.make_denominators, rounds=ROUNDS)
+
+
+def test_make_arrests_store(benchmark, workdir):
+    benchmark.pedantic(DashBLM.make_arrests_store, rounds=ROUNDS)
+
+
+def test_make_disparities(benchmark, workdir):
+    benchmark.pedantic(DashBLM.make_disparities, rounds=ROUNDS)
+
+
+def test_make_choropleth_inputs(benchmark, app_workdir):
+    benchmark.pedantic(DashBLM.make_choropleth_inputs, rounds=ROUNDS)
+
+
+def test_make_scattermapbox_inputs(benchmark, workdir, rows):
+    write_stopsearch_results(make_stopsearch_results(rows))
+
+    benchmark.pedantic(DashBLM().make_scattermapbox_inputs, rounds=ROUNDS)
+    benchmark.extra_info["rows"] = rows
+
+
+def test_make_density_inputs(benchmark, workdir, rows):
+    replace_scatter(workdir, rows)
+
+    benchmark.pedantic(DashBLM.make_density_inputs, rounds=ROUNDS)
+    benchmark.extra_info["rows"] = rows
+
+
+def test_make_stopsearch_store_and_trends(benchmark, workdir, rows):
+    write_stopsearch_results(make_stopsearch_results(rows))
+
+    def build():
+        DashBLM.make_stopsearch_store()
+        DashBLM.make_stopsearch_trends()
+
+    benchmark.pedantic(build, rounds=ROUNDS)
+    benchmark.extra_info["rows"] = rows
+
+
+def test_ingest_stopsearch_archive(benchmark, workdir, rows):
+    make_stopsearch_archive(workdir / "bulk.zip", rows)
+
+    benchmark.pedantic(
+        DashBLM.ingest_stopsearch_archive, args=(workdir / "bulk.zip",), rounds=ROUNDS
+    )
+    benchmark.extra_info["rows"] = rows
+
+
+def test_make_sunburst_input(benchmark, workdir):
+    benchmark.pedantic(DashBLM.make_sunburst_input, rounds=ROUNDS)
+
+
+# ----------------------------------------------------------------------------#
+# App startup and figures
+# ----------------------------------------------------------------------------#
+
+
+def test_app_startup(benchmark, app_workdir):
+    def start():
+        sys.modules.pop("app", None)
+        importlib.import_module("app")
+
+    benchmark.pedantic(start, rounds=ROUNDS)
+    sys.modules.pop("app", None)
+
+
+@pytest.mark.parametrize("year", ARRESTS_YEARS)
+def test_arrests_figure(benchmark, app_module, year):
+    payload = benchmark.pedantic(
+        lambda: app_module.update_figure(year).to_json(), rounds=ROUNDS
+    )
+    benchmark.extra_info["payload_bytes"] = len(payload)
+
+
+@pytest.mark.parametrize("year", JUSTICE_YEARS)
+def test_justice_figure(benchmark, app_module, year):
+    payload = benchmark.pedantic(
+        lambda: app_module.update_justice_figure(year).to_json(), rounds=ROUNDS
+    )
+    benchmark.extra_info["payload_bytes"] = len(payload)
+
+
+@pytest.mark.parametrize("mode", ["points", 0.5, 0.1, 0.02])
+def test_map_figure(benchmark, app_module, mode):
+    payload = benchmark.pedantic(
+        lambda: app_module.update_map(mode).to_json(), rounds=ROUNDS
+    )
+    benchmark.extra_info["payload_bytes"] = len(payload)
+
+
+def test_scaled_map_figure(benchmark, app_module, rows):
+    df_scatter = make_scatter_dataframe(rows)
+
+    def build():
+        scatt = go.Scattermapbox(
+            lat=df_scatter.lats,
+            lon=df_scatter.longs,
+            mode="markers",
+            text=df_scatter["text"],
+            marker={"size": df_scatter["size"], "color": df_scatter["color"]},
+        )
+        return go.Figure(
+            data=[app_module.artifacts.choro, scatt], layout=app_module.artifacts.layout
+        ).to_json()
+
+    payload = benchmark.pedantic(build, rounds=ROUNDS)
+    benchmark.extra_info["rows"] = rows
+    benchmark.extra_info["payload_bytes"] = len(payload)
+
+
+def test_scaled_map_first_load(benchmark, app_module, rows):
+    """
+    The map's first load only carries the sample, so its size shouldn't grow with the number of searches.
+    """
+
+    df_scatter = make_scatter_dataframe(rows)
+
+    def build():
+        order = DashBLM.spatial_stream_order(
+            df_scatter.lats.to_numpy(), df_scatter.longs.to_numpy()
+        )
+        sample = df_scatter.iloc[order[: app_module.artifacts.map_stream_sample]]
+        scatt = go.Scattermapbox(
+            lat=sample.lats,
+            lon=sample.longs,
+            mode="markers",
+            text=sample["text"],
+            marker={"size": sample["size"], "color": sample["color"]},
+        )
+        return go.Figure(
+            data=[app_module.artifacts.choro, scatt], layout=app_module.artifacts.layout
+        ).to_json()
+
+    payload = benchmark.pedantic(build, rounds=ROUNDS)
+    benchmark.extra_info["rows"] = rows
+    benchmark.extra_info["payload_bytes"] = len(payload)
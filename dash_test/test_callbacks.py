@@ -0,0 +1,463 @@
+import json
+import pathlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+from processing import DashBLM
+
+# Other inputs of the callbacks driven by a slider, at their starting values, which the browser always sends too
+
+SLIDER_COMPANIONS = {
+    "year-slider-justice": [
+        {"id": "justice-" + x.lower().replace(" ", "-"), "value": "All"}
+        for x in DashBLM.justice_dimensions
+    ]
+}
+
+
+def dispatch(client, output_id, input_id, value):
+    """
+    Posts a callback request to the dash server in the same format the browser uses.
+    :param client: flask test client.
+    :param output_id: string, id of the component being updated.
+    :param input_id: string, id of the slider driving the update.
+    :param value: the slider value.
+    :return: the parsed json response.
+    """
+
+    prop = "figure" if output_id.endswith("graph") else "children"
+    payload = {
+        "output": "{}.{}".format(output_id, prop),
+        "outputs": {"id": output_id, "property": prop},
+        "inputs": [{"id": input_id, "property": "value", "value": value}]
+        + [
+            dict(companion, property="value")
+            for companion in SLIDER_COMPANIONS.get(input_id, [])
+        ],
+        "changedPropIds": ["{}.value".format(input_id)],
+    }
+    response = client.post("/_dash-update-component", json=payload)
+    assert response.status_code == 200
+
+    return json.loads(response.data)
+
+
+def test_callbacks_are_thread_safe(app_module):
+    """
+    Hammers the slider callbacks from many threads at once and checks every response matches the one produced
+    serially, and that the shared dataframes are left untouched.
+    """
+
+    snapshot = app_module.artifacts.filtered_df.copy()
+    server = app_module.app.server
+    years = list(app_module.artifacts.arrests_by_year)
+    targets = [
+        ("arrests-graph", "year-slider"),
+        ("times-more-likely", "year-slider"),
+        ("justice-graph", "year-slider-justice"),
+    ]
+    jobs = [
+        (output_id, input_id, year)
+        for output_id, input_id in targets
+        for year in (
+            years
+            if input_id == "year-slider"
+            else app_module.artifacts.df_sunburst["Year"].unique().tolist()
+        )
+    ]
+
+    with server.test_client() as client:
+        expected = {job: dispatch(client, *job) for job in jobs}
+
+    def run(job):
+        with server.test_client() as client:
+            return job, dispatch(client, *job)
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(run, jobs * 4))
+
+    for job, result in results:
+        assert result == expected[job]
+
+    assert app_module.artifacts.filtered_df.equals(snapshot)
+
+
+def test_arrests_views_are_presorted(app_module):
+    for year, view in app_module.artifacts.arrests_by_year.items():
+        assert (view["Year"] == year).all()
+        assert view["Ethnicity"].tolist() == sorted(view["Ethnicity"])
+
+
+def test_shared_views_cant_be_edited_in_place(app_module):
+    artifacts = app_module.artifacts
+    for views in [
+        artifacts.arrests_by_year,
+        artifacts.sunburst_by_year,
+        artifacts.justice_by_selection,
+        artifacts.disparities_by_selection,
+    ]:
+        view = next(iter(views.values()))
+        with pytest.raises(ValueError):
+            view.iloc[0, 0] = view.iloc[-1, 0]
+
+        # A copy is the callback's own to change
+
+        copy = view.copy()
+        copy.iloc[0, 0] = view.iloc[-1, 0]
+        assert copy.iloc[0, 0] == view.iloc[-1, 0]
+
+
+def test_slider_callbacks_look_rows_up_by_label(app_module, monkeypatch):
+    """
+    Adds a new ethnic group to one year's data and checks both arrests callbacks pick it up without relying on the
+    position of any row.
+    """
+
+    extra = pd.DataFrame(
+        {
+            "Ethnicity": ["Chinese Actual", "Chinese Adjusted"],
+            "Arrests": [500.0, 400.0],
+            "Year": [2010, 2010],
+            "Arrests per 1k": [39.4, 19.7],
+        }
+    )
+    df = pd.concat([app_module.artifacts.filtered_df, extra])
+    monkeypatch.setattr(
+        app_module.artifacts,
+        "arrests_by_year",
+        DashBLM.make_year_views(df, sort_by=["Year", "Ethnicity"], index="Ethnicity"),
+    )
+    monkeypatch.setattr(
+        app_module.artifacts,
+        "minority_arrests_by_year",
+        DashBLM.make_year_views(
+            df[df["Ethnicity"] != "White"],
+            sort_by=["Year", "Ethnicity"],
+            index="Ethnicity",
+        ),
+    )
+
+    chinese = pd.DataFrame(
+        {
+            "Dataset": ["Arrests"],
+            "Year": [2010],
+            "Area": ["National"],
+            "Ethnicity": ["Chinese"],
+            "Ratio": [1.82],
+            "Lower": [1.71],
+            "Upper": [1.94],
+        }
+    )
+    df = pd.concat([app_module.artifacts.df_disparities, chinese])
+    df["Rank"] = df.groupby(["Dataset", "Year", "Area"])["Ratio"].rank(ascending=False)
+    monkeypatch.setattr(
+        app_module.artifacts,
+        "disparities_by_selection",
+        DashBLM.make_selection_views(
+            df, by=["Dataset", "Area", "Year"], sort_by=["Rank"], index="Ethnicity"
+        ),
+    )
+
+    text = app_module.update_text(2010)
+    assert "Black, Chinese, Mixed, and Asian people" in text
+    assert "**2.8**, **1.8**, **1.5** and **0.9**" in text
+    assert "2.80 to 2.83, 1.71 to 1.94, 1.51 to 1.54 and 0.85 to 0.86" in text
+
+    annotations = {
+        annotation.y: annotation.text
+        for annotation in app_module.update_figure(2010).layout.annotations
+    }
+    assert annotations == {
+        "Asian Actual": "-14%",
+        "Black Actual": "+182%",
+        "Chinese Actual": "+25%",
+        "Mixed Actual": "+52%",
+    }
+
+
+def test_heatmap_scales_with_cells_not_searches(app_module):
+    searches = len(app_module.artifacts.map_points["lat"])
+
+    for resolution, df_cells in app_module.artifacts.density_by_resolution.items():
+        density = app_module.update_map(resolution).data[1]
+        assert density.type == "densitymapbox"
+        assert len(density.z) == len(df_cells) < searches
+        assert sum(density.z) == searches
+
+    assert app_module.update_map("points") is app_module.artifacts.ethnicity_map
+
+
+def test_geojson_is_served_separately_from_the_map(app_module):
+    geojson = app_module.artifacts.ethnicity_map.data[0].geojson
+    assert geojson.startswith("/geojson/formatted_UK_LAD.geojson?v=")
+
+    with app_module.app.server.test_client() as client:
+        response = client.get(geojson)
+        assert client.get("/geojson/df_scatter.csv").status_code == 404
+
+    assert response.status_code == 200
+    assert json.loads(response.data)["type"] == "FeatureCollection"
+    assert "max-age" in response.headers["Cache-Control"]
+
+    # Starting the app shouldn't write anything out
+
+    workdir = pathlib.Path(app_module.path).parent
+    assert not (workdir / "df_blackpops.csv").exists()
+    assert not (workdir / "df_ids.csv").exists()
+
+
+def switch_map_mode(client, mode, ethnicity="Black", version=None):
+    """
+    Posts the callback request the browser sends when the stop and search map's mode is changed.
+    :param client: flask test client.
+    :param mode: 'points' or a heatmap cell size.
+    :param ethnicity: the ethnicity the choropleth is coloured by.
+    :param version: version of the artifacts the page was loaded with.
+    :return: the response.
+    """
+
+    outputs = [
+        ("ethnicity-map", "figure"),
+        ("map-stream", "n_intervals"),
+        ("map-stream", "max_intervals"),
+        ("map-stream-sent", "data"),
+        ("map-stream", "disabled"),
+    ]
+    return client.post(
+        "/_dash-update-component",
+        json={
+            "output": "..{}..".format(
+                "...".join("{}.{}".format(*output) for output in outputs)
+            ),
+            "outputs": [{"id": x, "property": y} for x, y in outputs],
+            "inputs": [{"id": "map-mode", "property": "value", "value": mode}],
+            "state": [
+                {"id": "map-ethnicity", "property": "value", "value": ethnicity},
+                {"id": "artifact-version", "property": "data", "value": version},
+            ],
+            "changedPropIds": ["map-mode.value"],
+        },
+    )
+
+
+def test_switching_choropleth_ethnicity_only_sends_new_values(app_module):
+    output = next(
+        key
+        for key in app_module.app.callback_map
+        if key.startswith("ethnicity-map.figure@")
+    )
+    payload = {
+        "output": output,
+        "outputs": {"id": "ethnicity-map", "property": output.split(".", 1)[1]},
+        "inputs": [{"id": "map-ethnicity", "property": "value", "value": "Asian"}],
+        "state": [
+            {
+                "id": "artifact-version",
+                "property": "data",
+                "value": app_module.artifacts.version,
+            }
+        ],
+        "changedPropIds": ["map-ethnicity.value"],
+    }
+
+    with app_module.app.server.test_client() as client:
+        response = client.post("/_dash-update-component", json=payload)
+        full_map = switch_map_mode(client, "points", "Asian")
+
+        # A page loaded with data that isn't held any more is left as it is
+
+        payload["state"][0]["value"] = "gone"
+        stale = client.post("/_dash-update-component", json=payload)
+
+    patch = json.loads(response.data)["response"]["ethnicity-map"]["figure"]
+    operations = {
+        tuple(x["location"]): x["params"]["value"] for x in patch["operations"]
+    }
+    choropleth = json.loads(full_map.data)["response"]["ethnicity-map"]["figure"][
+        "data"
+    ][0]
+
+    assert set(operations) == {("data", 0, "z"), ("data", 0, "hovertemplate")}
+    assert operations[("data", 0, "z")] == choropleth["z"]
+    assert choropleth["hovertemplate"].startswith("Asian Population")
+    assert len(operations[("data", 0, "z")]) == len(app_module.artifacts.df_ids)
+    assert len(response.data) * 10 < len(full_map.data)
+    assert stale.status_code == 204
+
+
+def test_justice_breakdowns_are_looked_up(app_module):
+    for year, view in app_module.artifacts.sunburst_by_year.items():
+        selected = app_module.artifacts.justice_by_selection[
+            (year, "All", "All", "All", "All")
+        ]
+        pd.testing.assert_frame_equal(
+            selected[view.columns[1:]], view[view.columns[1:]], check_dtype=False,
+        )
+
+    by_area = app_module.update_justice_figure(2012, "All", "All", "All", "Kent")
+    unpublished = app_module.update_justice_figure(
+        2012, "Male", "All", "Robbery", "All"
+    )
+
+    assert by_area.data[0].type == "sunburst"
+    assert by_area.to_json() != app_module.update_justice_figure(2012).to_json()
+    assert not unpublished.data
+    assert "No figures" in unpublished.layout.annotations[0].text
+
+
+def test_disparity_text_is_looked_up_not_worked_out(app_module, monkeypatch):
+    """
+    The ratios and intervals come straight out of the table processing.py writes, so the callback never works
+    out a rate itself.
+    """
+
+    def fail(*args, **kwargs):
+        raise AssertionError("disparities worked out on request")
+
+    monkeypatch.setattr(DashBLM, "disparity_table", fail)
+
+    assert "**3.4**, **1.9** and **1.1**" in app_module.update_text(2018)
+    assert app_module.update_text(1990) == ""
+
+
+def stream_chunk(client, output, n_intervals, sent, version):
+    """
+    Posts the callback request the browser sends when the map's streaming interval ticks.
+    :return: the response.
+    """
+
+    outputs = [
+        ("ethnicity-map", "figure"),
+        ("map-stream-sent", "data"),
+        ("map-stream", "max_intervals"),
+        ("map-stream", "disabled"),
+    ]
+    return client.post(
+        "/_dash-update-component",
+        json={
+            "output": output,
+            "outputs": [{"id": x, "property": y} for x, y in outputs],
+            "inputs": [
+                {"id": "map-stream", "property": "n_intervals", "value": n_intervals}
+            ],
+            "state": [
+                {"id": "map-stream-sent", "property": "data", "value": sent},
+                {"id": "map-mode", "property": "value", "value": "points"},
+                {"id": "artifact-version", "property": "data", "value": version},
+            ],
+            "changedPropIds": ["map-stream.n_intervals"],
+        },
+    )
+
+
+def test_map_points_are_streamed_after_a_sample(app_module):
+    """
+    The map opens with a sample of searches from every part of the country and the rest follow in chunks, so
+    that between them every search is sent exactly once.
+    """
+
+    output = next(
+        key
+        for key in app_module.app.callback_map
+        if key.startswith("..ethnicity-map.figure@")
+    )
+    version = app_module.artifacts.version
+    sample = app_module.artifacts.ethnicity_map.data[1]
+    lats, lons = list(sample.lat), list(sample.lon)
+    finished = []
+
+    with app_module.app.server.test_client() as client:
+        sent = 0
+        for n_intervals in range(1, app_module.artifacts.map_stream_chunks + 1):
+            response = stream_chunk(client, output, n_intervals, sent, version)
+            result = json.loads(response.data)["response"]
+            operations = {
+                tuple(x["location"]): x["params"]["value"]
+                for x in result["ethnicity-map"]["figure"]["operations"]
+            }
+            assert len(operations[("data", 1, "text")]) == len(
+                operations[("data", 1, "marker", "color")]
+            )
+            assert result["map-stream"]["max_intervals"] == n_intervals + 1
+            lats.extend(operations[("data", 1, "lat")])
+            lons.extend(operations[("data", 1, "lon")])
+            finished.append(result["map-stream"]["disabled"])
+            sent = result["map-stream-sent"]["data"]
+
+        # The chunk sent follows on from the last one the page has, however many times the interval has ticked
+
+        first = stream_chunk(client, output, 1, 0, version)
+        late = stream_chunk(client, output, 5, 0, version)
+        stale = stream_chunk(client, output, 1, 0, "gone")
+
+        reset = json.loads(switch_map_mode(client, "points").data)["response"]
+
+    assert (
+        json.loads(first.data)["response"]["ethnicity-map"]
+        == json.loads(late.data)["response"]["ethnicity-map"]
+    )
+    assert json.loads(stale.data)["response"] == {"map-stream": {"disabled": True}}
+
+    df_scatter = DashBLM.read_scatter_dataframe(app_module.path + "df_scatter.csv")
+    assert len(sample.lat) == app_module.artifacts.map_stream_sample < len(df_scatter)
+    assert finished[-1] and not any(finished[:-1])
+    assert sorted(zip(lats, lons)) == sorted(
+        zip(
+            df_scatter.lats.astype("float64").round(6),
+            df_scatter.longs.astype("float64").round(6),
+        )
+    )
+    assert reset["map-stream"] == {
+        "n_intervals": 0,
+        "max_intervals": 1,
+        "disabled": False,
+    }
+    assert reset["map-stream-sent"] == {"data": 0}
+
+    # The searches waiting to be sent stay in the compact types they were read in with
+
+    map_points = app_module.artifacts.map_points
+    assert map_points["lat"].dtype == map_points["lon"].dtype == "float32"
+    assert map_points["text"].dtype == "category"
+    assert map_points["size"].dtype == map_points["color"].dtype == "int8"
+
+    # Every cell with a search in it has one in the sample
+
+    cells = {(int(x // 0.1), int(y // 0.1)) for x, y in zip(lats, lons)}
+    assert {
+        (int(x // 0.1), int(y // 0.1)) for x, y in zip(sample.lat, sample.lon)
+    } == cells
+
+
+def test_choropleth_measures_are_on_the_same_scale(app_module):
+    """
+    Every group's share of its national population adds up to 100% over the districts, the default included.
+    """
+
+    measures = app_module.artifacts.choropleth_measures
+
+    assert list(measures)[0] == "Black"
+    for ethnicity, values in measures.items():
+        assert abs(values.sum() - 100) < 1, ethnicity
+    assert list(app_module.artifacts.choro.z) == list(measures["Black"])
+
+
+def test_choropleth_measures_follow_the_district_ids(app_module, tmp_path):
+    """
+    Shares written out in a different order from the district ids still colour the districts they belong to.
+    """
+
+    data = tmp_path / "data"
+    data.mkdir()
+    for source in pathlib.Path(app_module.path).iterdir():
+        (data / source.name).symlink_to(source.resolve())
+    (data / "df_ethnic_shares.csv").unlink()
+    df_shares = pd.read_csv(pathlib.Path(app_module.path) / "df_ethnic_shares.csv")
+    df_shares.iloc[::-1].to_csv(data / "df_ethnic_shares.csv", index=False)
+
+    bundle = app_module.load_artifacts(str(data) + "/", app_module.artifact_files)
+
+    for ethnicity, values in app_module.artifacts.choropleth_measures.items():
+        assert list(bundle.choropleth_measures[ethnicity]) == list(values)
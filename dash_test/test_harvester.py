@@ -0,0 +1,332 @@
+import json
+import time
+
+import numpy as np
+import pytest
+import requests
+import tenacity
+
+from police_api_replay import ReplayServer
+from result_store import ResultWriter, read_results
+
+POLY = "52.2,0.5:52.8,0.2:52.1,0.88"
+
+
+@pytest.fixture
+def harvester(stopsearch_script, monkeypatch):
+    """
+    The PoliceAPI class with no wait between calls or retries and a fresh circuit breaker, for pointing at a
+    replay server.
+    """
+
+    police_api = stopsearch_script.PoliceAPI
+    monkeypatch.setattr(police_api, "request_delay", (0, 0))
+    monkeypatch.setattr(police_api, "backoff", 0)
+    monkeypatch.setattr(police_api, "breaker", stopsearch_script.CircuitBreaker())
+    monkeypatch.setattr(police_api, "poly_cache", {})
+    return police_api
+
+
+def test_replays_recorded_responses(harvester, monkeypatch, tmp_path):
+    with ReplayServer(tmp_path) as server:
+        server.fixtures.save(POLY, "2019-01", 200, json.dumps([{"type": "Person"}]))
+        monkeypatch.setattr(harvester, "api_endpoint", server.url)
+
+        output = harvester.get_stop_search_data(poly=POLY, date="2019-01")
+        missing = requests.post(server.url, data={"poly": POLY, "date": "2019-02"})
+
+    assert json.loads(output) == [{"type": "Person"}]
+    assert missing.status_code == 404
+    assert server.statuses == {200: 1, 404: 1}
+
+
+def test_injected_errors_are_reproducible(tmp_path):
+    runs = []
+    for _ in range(2):
+        with ReplayServer(
+            tmp_path, error_rate=0.5, error_statuses=(429, 503), retry_after=3, seed=7
+        ) as server:
+            responses = [
+                requests.post(server.url, data={"poly": POLY, "date": "2019-01"})
+                for _ in range(20)
+            ]
+        runs.append([x.status_code for x in responses])
+
+        for response in responses:
+            if response.status_code == 429:
+                assert response.headers["Retry-After"] == "3"
+
+    assert runs[0] == runs[1]
+    assert {429, 503, 404} <= set(runs[0])
+
+
+def test_records_through_to_upstream(harvester, monkeypatch, tmp_path):
+    upstream = ReplayServer(tmp_path / "upstream").start()
+    upstream.fixtures.save(POLY, "2019-01", 200, "[]")
+
+    with ReplayServer(tmp_path / "recorded", upstream=upstream.url) as recorder:
+        monkeypatch.setattr(harvester, "api_endpoint", recorder.url)
+        assert harvester.get_stop_search_data(poly=POLY, date="2019-01") == "[]"
+    upstream.stop()
+
+    with ReplayServer(tmp_path / "recorded") as server:
+        monkeypatch.setattr(harvester, "api_endpoint", server.url)
+        assert harvester.get_stop_search_data(poly=POLY, date="2019-01") == "[]"
+
+
+def test_retries_only_rate_limits_and_server_errors(
+    harvester, stopsearch_script, monkeypatch, tmp_path
+):
+    with ReplayServer(
+        tmp_path, error_rate=0.5, error_statuses=(429, 503), retry_after=0.1, seed=3
+    ) as server:
+        server.fixtures.save(POLY, "2019-01", 200, "[]")
+        monkeypatch.setattr(harvester, "api_endpoint", server.url)
+
+        start = time.perf_counter()
+        assert harvester.get_stop_search_data(poly=POLY, date="2019-01") == "[]"
+        elapsed = time.perf_counter() - start
+
+        # A 404 isn't going to change by asking again
+
+        server.error_rate = 0
+        with pytest.raises(stopsearch_script.PoliceAPIError) as error:
+            harvester.get_stop_search_data(poly=POLY, date="2019-02")
+
+    assert error.value.status == 404
+    assert server.statuses[200] == 1 and server.statuses[404] == 1
+    assert server.statuses[429] + server.statuses[503] >= 1
+    assert elapsed >= 0.1 * server.statuses[429]
+
+
+def test_retry_after_is_capped(harvester, stopsearch_script):
+    for retry_after, wait in [(3600, harvester.max_backoff), (3, 3)]:
+        error = stopsearch_script.PoliceAPIError(429, retry_after=retry_after)
+        retry_state = tenacity.RetryCallState(None, None, (), {})
+        retry_state.set_exception((type(error), error, None))
+        assert stopsearch_script.wait_for_api(retry_state) == wait
+
+
+def test_circuit_breaker_stops_calls(
+    harvester, stopsearch_script, monkeypatch, tmp_path
+):
+    monkeypatch.setattr(
+        harvester, "breaker", stopsearch_script.CircuitBreaker(threshold=3, cooldown=60)
+    )
+
+    with ReplayServer(tmp_path, error_rate=1, error_statuses=(503,)) as server:
+        monkeypatch.setattr(harvester, "api_endpoint", server.url)
+        with pytest.raises(stopsearch_script.CircuitOpenError):
+            harvester.get_stop_search_data(poly=POLY, date="2019-01")
+        with pytest.raises(stopsearch_script.CircuitOpenError):
+            harvester.get_stop_search_data(poly=POLY, date="2019-02")
+
+    assert server.statuses == {503: 3}
+
+
+def make_feature(lad, lon):
+    return {
+        "id": lad,
+        "geometry": {"coordinates": [[[lon, 51.1], [-1.4, 51.2], [-1.3, 51.1]]]},
+    }
+
+
+def test_harvest_reports_failed_calls(harvester, monkeypatch, tmp_path):
+    leeds = harvester.format_ring_for_api(
+        harvester.outer_rings(make_feature("Leeds", -1.5)["geometry"]["coordinates"])[0]
+    )
+
+    with ReplayServer(tmp_path / "fixtures") as server:
+        server.fixtures.save(leeds, "2019-01", 200, json.dumps([{"type": "Person"}]))
+        monkeypatch.setattr(harvester, "api_endpoint", server.url)
+        with ResultWriter(tmp_path / "stopsearch-2019-01.ndjson.gz") as writer:
+            failures = harvester.harvest_month(
+                [make_feature("Leeds", -1.5), make_feature("York", -1.6)],
+                "2019-01",
+                writer,
+            )
+    results = [x for _, x in read_results(tmp_path / "stopsearch-2019-01.ndjson.gz")]
+
+    harvester.write_failures(failures, tmp_path / "failed-requests.json")
+    with open(tmp_path / "failed-requests.json") as f:
+        report = json.load(f)
+
+    assert results == [{"type": "Person", "lad": "Leeds", "month": "2019-01"}]
+    assert [(x["lad"], x["date"], x["status"]) for x in report] == [
+        ("York", "2019-01", 404)
+    ]
+
+
+def test_harvest_stops_when_the_breaker_opens(
+    harvester, stopsearch_script, monkeypatch, tmp_path
+):
+    monkeypatch.setattr(
+        harvester, "breaker", stopsearch_script.CircuitBreaker(threshold=3, cooldown=60)
+    )
+    features = [make_feature(lad, -1.5) for lad in ("Leeds", "York", "Hull")]
+
+    with ReplayServer(
+        tmp_path / "fixtures", error_rate=1, error_statuses=(500,)
+    ) as server:
+        monkeypatch.setattr(harvester, "api_endpoint", server.url)
+        with ResultWriter(tmp_path / "stopsearch-2019-01.ndjson.gz") as writer:
+            with pytest.raises(stopsearch_script.HarvestPaused) as paused:
+                harvester.harvest_month(features, "2019-01", writer)
+
+    # Nothing is marked failed without the API being called; the LADs it didn't get to are left for --refetch
+
+    assert server.statuses == {500: 3}
+    assert [(x["lad"], x["status"]) for x in paused.value.failures] == [
+        ("Leeds", "pending"),
+        ("York", "pending"),
+        ("Hull", "pending"),
+    ]
+
+
+def test_boundaries_are_split_into_pieces_and_simplified(harvester):
+    angles = np.linspace(0, 2 * np.pi, 1000)
+    circle = np.column_stack([np.cos(angles), np.sin(angles)]).tolist()
+    island = [[3, 0], [4, 0], [4, 1], [3, 0]]
+
+    rings = harvester.outer_rings([[circle, [[0, 0], [0.1, 0], [0, 0.1]]], [island]])
+    simplified = harvester.simplify_ring(rings[0], 50)
+
+    assert [len(x) for x in rings] == [1000, 4]
+    assert 3 <= len(simplified) <= 50
+    assert np.abs(np.hypot(simplified[:, 0], simplified[:, 1]) - 1).max() < 1e-9
+    assert harvester.format_ring_for_api(harvester.simplify_ring(rings[1], 50)) == (
+        "0.0,3.0:0.0,4.0:1.0,4.0"
+    )
+
+
+def test_polys_are_reused_across_dates(harvester, monkeypatch, tmp_path):
+    simplified = []
+    simplify_ring = harvester.simplify_ring
+    monkeypatch.setattr(
+        harvester,
+        "simplify_ring",
+        lambda ring, max_vertices: simplified.append(1)
+        or simplify_ring(ring, max_vertices),
+    )
+
+    with ReplayServer(tmp_path) as server:
+        monkeypatch.setattr(harvester, "api_endpoint", server.url)
+        for date in ("2019-01", "2019-02", "2019-03"):
+            with ResultWriter(
+                tmp_path / "stopsearch-{}.ndjson.gz".format(date)
+            ) as writer:
+                harvester.harvest_month([make_feature("Leeds", -1.5)], date, writer)
+
+    assert len(simplified) == 1
+    assert server.statuses == {404: 3}
+
+
+def test_tiles_are_merged_without_double_counting(harvester):
+    on_the_line = {"id": 1}
+    twins = [{"id": 2}, {"id": 2}]
+
+    merged = harvester.merge_tiles([[on_the_line] + twins, [on_the_line], [{"id": 3}]])
+
+    assert sorted(x["id"] for x in merged) == [1, 2, 2, 3]
+
+
+class BusyArea(ReplayServer):
+    """
+    Answers with whichever of a set of searches fall inside the poly it is sent, or a 503 if there are more than
+    the API's result cap.
+    """
+
+    def __init__(self, directory, points, cap):
+        super().__init__(directory)
+        self.points = points
+        self.cap = cap
+
+    def respond(self, poly, date):
+        ring = np.array([x.split(",") for x in poly.split(":")], dtype=float)[:, ::-1]
+        x, y = self.points[:, 0], self.points[:, 1]
+        inside = np.zeros(len(self.points), dtype=bool)
+        for (x1, y1), (x2, y2) in zip(ring, np.roll(ring, -1, axis=0)):
+            if y1 != y2:
+                crosses = (y1 > y) != (y2 > y)
+                inside ^= crosses & (x < x1 + (y - y1) * (x2 - x1) / (y2 - y1))
+
+        if inside.sum() > self.cap:
+            return self.count(503, "", {})
+
+        return self.count(
+            200, json.dumps([{"id": int(i)} for i in np.flatnonzero(inside)]), {}
+        )
+
+
+def test_busy_areas_are_split_until_under_the_cap(harvester, monkeypatch, tmp_path):
+    points = np.random.default_rng(0).random((300, 2))
+    monkeypatch.setattr(harvester, "result_cap", 100)
+
+    with BusyArea(tmp_path, points, cap=100) as server:
+        monkeypatch.setattr(harvester, "api_endpoint", server.url)
+        records = harvester.fetch_lad(
+            [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]], "2019-01"
+        )
+
+    assert sorted(x["id"] for x in records) == list(range(300))
+    assert server.statuses[503] >= 1
+    assert harvester.breaker.failures == 0
+
+
+def test_splitting_busy_areas_doesnt_open_the_breaker(harvester, monkeypatch, tmp_path):
+    points = np.random.default_rng(0).random((300, 2))
+    monkeypatch.setattr(harvester, "result_cap", 40)
+
+    with BusyArea(tmp_path, points, cap=40) as server:
+        monkeypatch.setattr(harvester, "api_endpoint", server.url)
+        records = harvester.fetch_lad(
+            [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]], "2019-01"
+        )
+
+    assert sorted(x["id"] for x in records) == list(range(300))
+    assert server.statuses[503] > harvester.breaker.threshold
+    assert harvester.breaker.opened_at is None
+
+
+class BriefOutage(ReplayServer):
+    """
+    Answers the first few requests with a 503 and replays recorded responses after that, keeping every poly it
+    was sent.
+    """
+
+    def __init__(self, directory, outage):
+        super().__init__(directory)
+        self.outage = outage
+        self.polys = []
+
+    def respond(self, poly, date):
+        self.polys.append(poly)
+        if len(self.polys) <= self.outage:
+            return self.count(503, "", {})
+
+        return super().respond(poly, date)
+
+
+def test_a_503_is_retried_before_splitting(
+    harvester, stopsearch_script, monkeypatch, tmp_path
+):
+    square = [[[0, 0], [0.1, 0], [0.1, 0.1], [0, 0.1], [0, 0]]]
+    poly = harvester.prepare_lad(square)[0][1]
+
+    with BriefOutage(tmp_path, outage=1) as server:
+        server.fixtures.save(poly, "2019-01", 200, json.dumps([{"type": "Person"}]))
+        monkeypatch.setattr(harvester, "api_endpoint", server.url)
+        records = harvester.fetch_lad(square, "2019-01")
+
+    assert records == [{"type": "Person"}]
+    assert server.polys == [poly, poly]
+    assert harvester.breaker.failures == 0
+
+    # When the API stays down the repeated 503s open the breaker after a few splits
+
+    with ReplayServer(tmp_path, error_rate=1, error_statuses=(503,)) as server:
+        monkeypatch.setattr(harvester, "api_endpoint", server.url)
+        with pytest.raises(stopsearch_script.CircuitOpenError):
+            harvester.fetch_lad(square, "2019-01")
+
+    assert server.statuses == {503: 2 * harvester.breaker.threshold}
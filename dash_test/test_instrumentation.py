@@ -0,0 +1,90 @@
+import pytest
+
+from dash_test.test_callbacks import dispatch
+from instrumentation import StartupProfiler
+
+
+def test_metrics_endpoint_reports_every_callback(app_module):
+    with app_module.app.server.test_client() as client:
+        dispatch(client, "arrests-graph", "year-slider", 2010)
+        dispatch(client, "times-more-likely", "year-slider", 2010)
+        response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+
+    text = response.get_data(as_text=True)
+    for name in app_module.metrics.histograms:
+        assert "# TYPE {} histogram".format(name) in text
+        assert '{}_count{{callback="arrests-graph.figure"}}'.format(name) in text
+        assert '{}_count{{callback="times-more-likely.children"}}'.format(name) in text
+
+    # Buckets are cumulative so the +Inf bucket always matches the count
+
+    for line in text.splitlines():
+        if 'le="+Inf"' in line:
+            name = line.split("_bucket")[0]
+            label = line.split("{")[1].split(",le")[0]
+            count = "{}_count{{{}}}".format(name, label)
+            assert count + " " + line.split()[-1] in text
+
+
+def test_made_up_and_failed_callbacks_are_not_recorded(app_module):
+    def recorded():
+        return {key: list(counts) for key, counts in app_module.metrics.counts.items()}
+
+    before = recorded()
+
+    with app_module.app.server.test_client() as client:
+        for output in ("made-up.figure", "arrests-graph.figure"):
+            response = client.post(
+                "/_dash-update-component",
+                json={
+                    "output": output,
+                    "outputs": {"id": output.split(".")[0], "property": "figure"},
+                    "inputs": [],
+                    "changedPropIds": [],
+                },
+            )
+            assert response.status_code != 200
+
+    assert recorded() == before
+    assert not any(label == "made-up.figure" for _, label in before)
+
+
+def test_profile_header_dumps_a_profile(app_module, tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module.metrics, "profile_dir", str(tmp_path))
+
+    with app_module.app.server.test_client() as client:
+        client.environ_base["HTTP_X_DASH_PROFILE"] = "1"
+        dispatch(client, "justice-graph", "year-slider-justice", 2012)
+        assert not tmp_path.exists() or not list(tmp_path.iterdir())
+
+        monkeypatch.setattr(app_module.metrics, "allow_profiling", True)
+        dispatch(client, "justice-graph", "year-slider-justice", 2012)
+
+    assert [
+        x.name.endswith("justice_graph_figure.prof") for x in tmp_path.iterdir()
+    ] == [True]
+
+
+def test_startup_profiler_reports_each_phase_and_enforces_budget():
+    profiler = StartupProfiler(enabled=True, budget=0.0)
+    profiler.phase("imports")
+    profiler.phase("data load")
+
+    with pytest.raises(RuntimeError):
+        profiler.finish()
+
+    assert [phase["phase"] for phase in profiler.phases] == ["imports", "data load"]
+    assert all(phase["seconds"] >= 0 for phase in profiler.phases)
+
+
+def test_startup_profiler_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("DASH_BLM_PROFILE_STARTUP", raising=False)
+    monkeypatch.delenv("DASH_BLM_STARTUP_BUDGET", raising=False)
+
+    profiler = StartupProfiler.from_environment()
+    profiler.phase("imports")
+
+    assert profiler.finish() == []
@@ -0,0 +1,541 @@
+import json
+import pathlib
+import zipfile
+
+import pandas as pd
+import pytest
+
+from processing import DashBLM
+from result_store import RecordIndex, ResultWriter, read_results
+
+REPO = pathlib.Path(__file__).resolve().parent.parent
+
+
+def make_stopsearch(lat, ethnicity, lad=None):
+    stopsearch = {
+        "datetime": "2019-01-01T10:00:00+00:00",
+        "location": {"latitude": str(lat), "longitude": "-1.5"},
+        "self_defined_ethnicity": ethnicity,
+        "age_range": "18-24",
+        "gender": "Male",
+        "object_of_search": "Controlled drugs",
+    }
+    if lad:
+        stopsearch["lad"] = lad
+    return stopsearch
+
+
+def test_merge_keeps_every_month(police_api, tmp_path):
+    for month, lat in [("2019-01", 51.1), ("2019-02", 51.2), ("2020-01", 51.3)]:
+        with ResultWriter(tmp_path / "stopsearch-{}.ndjson.gz".format(month)) as writer:
+            writer.write(dict(make_stopsearch(lat, None), month=month))
+
+    # Monthly files from before the results were written one per line still merge
+
+    with open(tmp_path / "stopsearch-2019-01-retry.json", "w") as f:
+        json.dump({"results": {"2019-01": [make_stopsearch(51.4, None)]}}, f)
+
+    with ResultWriter(tmp_path / "2019stopsearchresults.ndjson.gz") as writer:
+        count = police_api.merge_results(
+            [str(x) for x in tmp_path.glob("stopsearch-*")], "2019", writer
+        )
+    merged = list(read_results(tmp_path / "2019stopsearchresults.ndjson.gz"))
+
+    assert count == 3
+    assert [month for month, record in merged] == ["2019-01", "2019-01", "2019-02"]
+    assert {x["location"]["latitude"] for _, x in merged[:2]} == {"51.1", "51.4"}
+
+
+def test_duplicate_searches_are_kept_once(workdir):
+    black = "Black/African/Caribbean/Black British - African"
+    twins = [make_stopsearch(51.5, black, "Hackney")] * 2
+    border = make_stopsearch(51.6, "Asian/Asian British - Indian", "Hackney")
+
+    with ResultWriter("2019stopsearchresults.ndjson.gz") as writer:
+        for stopsearch in twins + [border]:
+            writer.write(dict(stopsearch, month="2019-01"))
+        for stopsearch in twins[:1] + [border]:
+            writer.write(dict(stopsearch, lad="Islington", month="2019-01"))
+    with ResultWriter("2019-refetchstopsearchresults.ndjson.gz") as writer:
+        writer.write(dict(border, lad="Islington", month="2019-01"))
+
+    # Building the store twice gives the same result
+
+    for _ in range(2):
+        DashBLM.make_stopsearch_store(chunksize=2)
+        df = pd.read_csv(workdir / "data" / "stopsearch" / "2019-01.csv")
+
+        assert sorted(df["Ethnic group"]) == ["Asian", "Black", "Black"]
+        assert len(df[df["LAD"] == "Islington"]) == 1
+
+    DashBLM().make_scattermapbox_inputs()
+
+    assert len(pd.read_csv("df_scatter.csv")) == 3
+
+
+def test_heatmap_is_built_from_the_searches_just_processed(workdir):
+    black = "Black/African/Caribbean/Black British - African"
+    with ResultWriter("2019stopsearchresults.ndjson.gz") as writer:
+        for lat in (51.5, 51.6, 53.4):
+            writer.write(dict(make_stopsearch(lat, black, "Hackney"), month="2019-01"))
+
+    df_scatter = DashBLM().make_scattermapbox_inputs()
+    DashBLM.make_density_inputs(df_scatter)
+
+    df_density = pd.read_csv("df_density.csv")
+    totals = df_density.groupby("Resolution")["Count"].sum()
+    assert len(df_scatter) == 3
+    assert totals.to_dict() == {
+        resolution: 3 for resolution in DashBLM.density_resolutions
+    }
+    assert (df_density["Black"] == df_density["Count"]).all()
+    assert "Ethnicity" not in df_scatter.columns
+
+
+def test_result_store_round_trip(tmp_path):
+    records = [
+        dict(make_stopsearch(51.0 + i / 1000, None, "Leeds"), month="2019-01")
+        for i in range(2500)
+    ]
+
+    with ResultWriter(tmp_path / "results.ndjson.gz", batch_size=1000) as writer:
+        writer.write_many(records[:2000])
+        with open(tmp_path / "results.ndjson.gz", "rb") as f:
+            assert f.read()
+    with ResultWriter(tmp_path / "results.ndjson.gz", mode="a") as writer:
+        writer.write_many(records[2000:])
+    with open(tmp_path / "results.json", "w") as f:
+        json.dump({"results": {"2019-01": records}}, f)
+
+    assert [x for _, x in read_results(tmp_path / "results.ndjson.gz")] == records
+    assert (tmp_path / "results.ndjson.gz").stat().st_size * 5 < (
+        tmp_path / "results.json"
+    ).stat().st_size
+
+
+def test_stopsearch_store_and_trends(workdir):
+    results = {
+        "2018": {
+            "2018-12": [
+                make_stopsearch(
+                    51.5, "Black/African/Caribbean/Black British - African", "Hackney"
+                ),
+                make_stopsearch(51.5, "White - Any other White background", "Hackney"),
+            ]
+        },
+        "2019": {
+            "2019-01": [
+                make_stopsearch(
+                    51.5, "Black/African/Caribbean/Black British - African", "Hackney"
+                ),
+                make_stopsearch(53.4, "Asian/Asian British - Indian", "Leeds"),
+                make_stopsearch(53.4, None, "Leeds"),
+            ]
+        },
+    }
+    for year, months in results.items():
+        with open("{}stopsearchresults.json".format(year), "w") as f:
+            json.dump({"results": months}, f)
+
+    DashBLM.make_stopsearch_store()
+
+    store = sorted(x.name for x in (workdir / "data" / "stopsearch").glob("*.csv"))
+    assert store == ["2018-12.csv", "2019-01.csv"]
+
+    DashBLM.make_stopsearch_trends()
+
+    df_trends = pd.read_csv("df_trends.csv")
+    national = df_trends[df_trends["Area"] == "National"].set_index(
+        ["Month", "Ethnicity"]
+    )
+    assert national.loc[("2019-01", "Black"), "Searches"] == 1
+    assert national.loc[("2019-01", "Asian"), "Searches"] == 1
+    assert ("2019-01", "White") not in national.index
+    assert (df_trends["Searches per 1k"] > 0).all()
+
+    views = DashBLM.make_trend_views(df_trends)
+    assert set(views) == {"National", "Hackney", "Leeds"}
+    assert views["Hackney"].loc["2019-01", "White"] == 0
+    assert list(views["National"].index) == ["2018-12", "2019-01"]
+
+    # Searches per year go into the disparities too, for every district with white people searched that year
+
+    DashBLM.make_disparities()
+    df = pd.read_csv("df_disparities.csv")
+    searches = df[df["Dataset"] == "Stop and search"]
+    assert searches[["Year", "Area", "Ethnicity"]].values.tolist() == [
+        [2018, "Hackney", "Black"],
+        [2018, "National", "Black"],
+    ]
+
+
+def test_scatter_dataframe_is_compact():
+    filename = REPO / "data" / "df_scatter.csv"
+    df = DashBLM.read_scatter_dataframe(filename)
+    df_default = pd.read_csv(filename, usecols=list(DashBLM.scatter_dtypes))
+
+    assert df.dtypes.astype(str).to_dict() == DashBLM.scatter_dtypes
+    assert (df["text"].astype(str) == df_default["text"]).all()
+    assert (df["lats"] - df_default["lats"]).abs().max() < 1e-5
+    assert (
+        df.memory_usage(deep=True).sum() * 5 < df_default.memory_usage(deep=True).sum()
+    )
+
+
+ARCHIVE_HEADER = (
+    "Type,Date,Part of a policing operation,Policing operation,Latitude,Longitude,Gender,Age range,"
+    "Self-defined ethnicity,Officer-defined ethnicity,Legislation,Object of search,Outcome,"
+    "Outcome linked to object of search,Removal of more than just outer clothing\n"
+)
+
+
+def make_archive_rows(month, rows):
+    return "".join(
+        "Person search,{}-0{}T10:00:00+00:00,False,,{},-1.5,Male,18-24,{},Black,"
+        "Misuse of Drugs Act 1971 (section 23),Controlled drugs,Arrest,True,False\n".format(
+            month, i % 9 + 1, lat, ethnicity
+        )
+        for i, (lat, ethnicity) in enumerate(rows)
+    )
+
+
+def test_ingest_bulk_archive(workdir):
+    black = "Black/African/Caribbean/Black British - Any other Black background"
+    white = "White - English/Welsh/Scottish/Northern Irish/British"
+    forces = {
+        "2019-01/2019-01-leicestershire-stop-and-search.csv": make_archive_rows(
+            "2019-01", [(52.6, black), (52.6, white), ("", white)]
+        ),
+        "2019-01/2019-01-west-yorkshire-stop-and-search.csv": make_archive_rows(
+            "2019-01", [(53.8, black), (53.8, "")]
+        ),
+        "2019-02/2019-02-leicestershire-stop-and-search.csv": make_archive_rows(
+            "2019-02", [(52.6, white)]
+        ),
+        "2019-02/2019-02-leicestershire-street.csv": "not stop and search\n",
+    }
+    with zipfile.ZipFile(workdir / "bulk.zip", "w") as archive:
+        for name, rows in forces.items():
+            archive.writestr(name, ARCHIVE_HEADER + rows)
+
+    months = DashBLM.ingest_stopsearch_archive(workdir / "bulk.zip", chunksize=2)
+
+    store = workdir / "data" / "stopsearch"
+    january = pd.read_csv(store / "2019-01.csv")
+    assert months == ["2019-01", "2019-02"]
+    assert list(january.columns) == [
+        "Month",
+        "Datetime",
+        "Latitude",
+        "Longitude",
+        "LAD",
+        "Ethnicity",
+        "Age range",
+        "Gender",
+        "Object of search",
+        "Ethnic group",
+    ]
+    assert january["Ethnic group"].fillna("").tolist() == [
+        "Black",
+        "White",
+        "Black",
+        "",
+    ]
+
+    # Unzipped folders load the same way and don't add the searches already in the store again
+
+    (workdir / "bulk").mkdir()
+    with zipfile.ZipFile(workdir / "bulk.zip") as archive:
+        archive.extractall(workdir / "bulk")
+    DashBLM.ingest_stopsearch_archive(str(workdir / "bulk"))
+
+    pd.testing.assert_frame_equal(pd.read_csv(store / "2019-01.csv"), january)
+
+    DashBLM.make_stopsearch_trends()
+
+    df_trends = pd.read_csv("df_trends.csv").set_index(["Month", "Ethnicity"])
+    assert df_trends.loc[("2019-01", "Black"), "Searches"] == 2
+    assert df_trends.loc[("2019-02", "White"), "Searches"] == 1
+
+
+def test_harvests_and_bulk_downloads_add_to_the_store(workdir):
+    black = "Black/African/Caribbean/Black British - African"
+    with ResultWriter("2019stopsearchresults.ndjson.gz") as writer:
+        writer.write(dict(make_stopsearch(51.5, black, "Hackney"), month="2019-01"))
+        writer.write(dict(make_stopsearch(51.6, black, "Hackney"), month="2019-02"))
+    with zipfile.ZipFile(workdir / "bulk.zip", "w") as archive:
+        archive.writestr(
+            "2019-01/2019-01-leicestershire-stop-and-search.csv",
+            ARCHIVE_HEADER + make_archive_rows("2019-01", [(52.6, black)]),
+        )
+
+    store = workdir / "data" / "stopsearch"
+    DashBLM.make_stopsearch_store()
+    DashBLM.ingest_stopsearch_archive(workdir / "bulk.zip")
+    january = pd.read_csv(store / "2019-01.csv")
+
+    assert january["Latitude"].tolist() == [51.5, 52.6]
+
+    # Running either again, or without the index, leaves the store as it was
+
+    DashBLM.make_stopsearch_store()
+    (store / DashBLM.stopsearch_index).unlink()
+    DashBLM.ingest_stopsearch_archive(workdir / "bulk.zip")
+    DashBLM.make_stopsearch_store()
+
+    pd.testing.assert_frame_equal(pd.read_csv(store / "2019-01.csv"), january)
+    assert len(pd.read_csv(store / "2019-02.csv")) == 1
+
+
+def test_record_index_keys_dont_depend_on_the_library_version(tmp_path):
+    search = {
+        "Datetime": "2019-01-01T10:00:00+00:00",
+        "Latitude": "51.5",
+        "Longitude": "-1.5",
+        "Ethnicity": "Black",
+        "Age range": "18-24",
+        "Gender": "Male",
+        "Object of search": "Controlled drugs",
+        "Month": "2019-01",
+    }
+    df = pd.DataFrame([search, dict(search, Ethnicity=None)])
+
+    assert RecordIndex.hash_records(df).tolist() == [
+        -3199914416745444235,
+        1972840849840406747,
+    ]
+
+    # An index written with another hash scheme is emptied, so the store's months are read back into it
+
+    index = RecordIndex(tmp_path / "index.sqlite")
+    index.keep_new(df, ["Hackney", "Hackney"])
+    index.connection.execute("PRAGMA user_version = 0")
+    index.connection.close()
+
+    assert not RecordIndex(tmp_path / "index.sqlite").has_month("2019-01")
+    assert RecordIndex(tmp_path / "index.sqlite").connection.execute(
+        "PRAGMA user_version"
+    ).fetchone() == (RecordIndex.hash_scheme,)
+
+
+def test_filtered_csv_reads_only_matching_rows():
+    filename = REPO / "data" / "prosecutions-and-convictions.csv"
+    filters = {"Sex": ["All"], "Police Force Area": ["All", "Kent"]}
+
+    df = DashBLM.read_filtered_csv(
+        filename, ["Time", "Sex", "Police Force Area", "Value"], filters, chunksize=100
+    )
+
+    expected = pd.read_csv(
+        filename, usecols=["Time", "Sex", "Police Force Area", "Value"]
+    )
+    expected = expected[
+        (expected["Sex"] == "All") & expected["Police Force Area"].isin(["All", "Kent"])
+    ]
+    assert len(df) == len(expected) > 0
+    assert df["Value"].sum() == pytest.approx(expected["Value"].sum())
+    assert list(df["Police Force Area"].cat.categories) == ["All", "Kent"]
+
+    # Rows without a value can be dropped as they're read too, with or without any filters
+
+    df = DashBLM.read_filtered_csv(
+        filename, ["Time", "Value"], {}, required=["Value"], chunksize=100
+    )
+
+    expected = pd.read_csv(filename, usecols=["Time", "Value"]).dropna()
+    assert len(df) == len(expected) > 0
+    assert df["Value"].sum() == pytest.approx(expected["Value"].sum())
+
+
+def test_justice_and_choropleth_inputs_are_unchanged(workdir):
+    DashBLM.make_choropleth_inputs()
+    DashBLM.make_sunburst_input()
+
+    for filename in [
+        "df_ids.csv",
+        "df_sunburst.csv",
+        "df_ethnic_shares.csv",
+        "df_justice_cube.csv",
+    ]:
+        pd.testing.assert_frame_equal(
+            pd.read_csv(filename), pd.read_csv(REPO / "data" / filename)
+        )
+
+
+def test_justice_cube_covers_every_published_breakdown(workdir):
+    DashBLM.make_sunburst_input()
+    df_cube = pd.read_csv("df_justice_cube.csv").set_index(
+        ["Year", "Ethnicity"] + DashBLM.justice_dimensions
+    )
+
+    totals = df_cube.loc[(2015, "Black", "All", "All", "All", "All")]
+    kent = df_cube.loc[(2015, "Black", "All", "All", "All", "Kent")]
+    misc = df_cube.loc[
+        (2015, "Black", "All", "All", "Miscellaneous crimes against society", "All")
+    ]
+    women = df_cube.loc[(2015, "Black", "Female", "All", "All", "All")]
+
+    # Custody rates and sentence lengths aren't broken down by area so areas get the national ones
+
+    assert kent["Custody Rate"] == totals["Custody Rate"]
+    assert kent["Sentence Length"] == totals["Sentence Length"]
+    assert kent["Conviction Rate"] != totals["Conviction Rate"]
+    assert misc["Custody Rate"] != totals["Custody Rate"]
+    assert women["Sentence Length"] != totals["Sentence Length"]
+    assert not df_cube.isna().any().any()
+
+
+def test_arrests_store_agrees_across_tables(workdir):
+    DashBLM.make_arrests_store()
+    df = DashBLM.read_arrests_store("df_arrests.csv")
+
+    dimensions = ["Police Force Area", "Sex", "Age group", "Offence group", "Ethnicity"]
+    totals = df[(df[dimensions] == "All").all(axis=1) & (df["Year"] == 2018)]
+    forces = df[(df["Table"] == "A_08") & (df["Year"] == 2018)]
+
+    assert set(df["Table"]) == set(DashBLM.arrests_tables)
+    assert df["Arrests"].dtype == "int64" and df["Sex"].dtype == "category"
+    assert set(totals["Table"]) == set(DashBLM.arrests_tables)
+    assert (totals["Arrests"] == 671126).all()
+    assert forces["Police Force Area"].nunique() == 43
+    assert "Lancashire" not in set(forces["Police Force Area"])
+    assert not forces["Police Force Area"].str.endswith("Region").any()
+    assert forces.loc[
+        (forces["Police Force Area"] == "Kent") & (forces["Ethnicity"] == "Black"),
+        "Arrests",
+    ].tolist() == [1026]
+
+
+def test_arrests_tables_are_found_by_their_headers(workdir):
+    sheet = pd.read_excel(
+        "data/" + DashBLM.arrests_filename,
+        sheet_name="A_01c",
+        engine="odf",
+        header=None,
+    )
+    moved = pd.concat(
+        [sheet.iloc[:3], pd.DataFrame([[None] * sheet.shape[1]] * 2), sheet.iloc[3:]],
+        ignore_index=True,
+    )
+
+    title, table = DashBLM.read_arrests_table(sheet)
+    _, moved_table = DashBLM.read_arrests_table(moved)
+
+    assert title.startswith("A_01c")
+    pd.testing.assert_frame_equal(table, moved_table)
+    assert table.loc[("", "2018/19"), ("Persons", "Total")] == 671126
+    assert len(table) == 13
+
+
+def test_denominators_follow_each_countrys_population(workdir):
+    df = DashBLM.make_denominator_table().set_index(["Year", "Area", "Ethnicity"])
+
+    def growth(area):
+        return (
+            df.loc[(2018, area, "All"), "Population"]
+            / df.loc[(2011, area, "All"), "Population"]
+        )
+
+    assert df.loc[(2011, "National", "All"), "Population"] == 56075912
+    assert df.loc[(2011, "National", "Black"), "Population"] == 1864890
+    assert growth("Cardiff") == pytest.approx(growth("Swansea"), rel=1e-4)
+    assert growth("Leeds") == pytest.approx(growth("Hackney"), rel=1e-4)
+    assert growth("Leeds") != pytest.approx(growth("Cardiff"), rel=1e-4)
+    assert not df.index.duplicated().any()
+
+    rows = pd.DataFrame(
+        {
+            "Year": [2011, 2030, 2011],
+            "Area": ["National", "National", "Nowhere"],
+            "Ethnicity": ["Black", "Black", "Black"],
+        }
+    )
+    joined = DashBLM.join_denominators(rows, df.reset_index())
+
+    assert joined["Population"].iloc[0] == 1864890
+    assert joined["Population"].iloc[1] == df.loc[(2018, "National", "Black")].iloc[0]
+    assert pd.isna(joined["Population"].iloc[2])
+
+
+def test_denominators_can_be_shared_between_steps(workdir, monkeypatch):
+    denominators = DashBLM.make_denominator_table()
+    DashBLM.make_arrests_dataframe()
+    DashBLM.make_disparities()
+    expected = [pd.read_csv(x) for x in ("filtered_df.csv", "df_disparities.csv")]
+
+    def fail():
+        raise AssertionError("denominators worked out again")
+
+    monkeypatch.setattr(DashBLM, "make_denominator_table", fail)
+    DashBLM.make_denominators(denominators)
+    DashBLM.make_arrests_dataframe(denominators)
+    DashBLM.make_stopsearch_trends(denominators)
+    DashBLM.make_disparities(denominators=denominators)
+
+    pd.testing.assert_frame_equal(pd.read_csv("filtered_df.csv"), expected[0])
+    pd.testing.assert_frame_equal(pd.read_csv("df_disparities.csv"), expected[1])
+    assert len(pd.read_csv("df_denominators.csv")) == len(denominators)
+
+
+def test_arrest_rates_use_each_years_population(workdir):
+    DashBLM.make_arrests_dataframe()
+    filtered_df = pd.read_csv("filtered_df.csv").set_index(["Ethnicity", "Year"])
+    denominators = DashBLM.make_denominator_table().set_index(
+        ["Year", "Area", "Ethnicity"]
+    )
+
+    black = denominators.loc[(2015, "National", "Black"), "Population"]
+    white_rate = filtered_df.loc[("White", 2015), "Arrests per 1k"]
+
+    assert filtered_df.loc[("Black Actual", 2015), "Arrests"] == 81669
+    assert filtered_df.loc[("Black Actual", 2015), "Arrests per 1k"] == round(
+        81669 / black * 1000, 1
+    )
+    assert filtered_df.loc[("Black Adjusted", 2015), "Arrests per 1k"] == white_rate
+    assert filtered_df.loc[("Black Adjusted", 2015), "Arrests"] == pytest.approx(
+        white_rate / 1000 * black, rel=1e-2
+    )
+
+
+def test_disparity_intervals_are_worked_out_together():
+    df = pd.DataFrame(
+        {
+            "Dataset": ["Arrests"] * 3 + ["Stop and search"] * 2,
+            "Year": [2018] * 5,
+            "Area": ["National"] * 3 + ["Leeds"] * 2,
+            "Ethnicity": ["White", "Black", "Asian", "White", "Black"],
+            "Count": [1000, 300, 50, 20, 0],
+            "Population": [100000, 10000, 10000, 5000, 1000],
+        }
+    )
+
+    poisson = DashBLM.disparity_table(df).set_index(["Dataset", "Ethnicity"])
+    bootstrap = DashBLM.disparity_table(df, method="bootstrap").set_index(
+        ["Dataset", "Ethnicity"]
+    )
+
+    assert poisson.loc[("Arrests", "Black"), "Ratio"] == pytest.approx(3)
+    assert poisson.loc[("Arrests", "Asian"), "Ratio"] == pytest.approx(0.5)
+    assert poisson.loc["Arrests", "Rank"].tolist() == [1, 2]
+    assert (poisson["Lower"].iloc[:2] < poisson["Ratio"].iloc[:2]).all()
+    assert (poisson["Upper"].iloc[:2] > poisson["Ratio"].iloc[:2]).all()
+    assert bootstrap.loc["Arrests", ["Lower", "Upper"]].to_numpy() == pytest.approx(
+        poisson.loc["Arrests", ["Lower", "Upper"]].to_numpy(), rel=0.05
+    )
+
+    # No searches at all gives a ratio of nothing, not an error
+
+    assert poisson.loc[("Stop and search", "Black"), "Ratio"] == 0
+
+
+def test_disparities_cover_every_year(workdir):
+    DashBLM.make_disparities()
+    df = pd.read_csv("df_disparities.csv").set_index(["Dataset", "Year", "Ethnicity"])
+
+    assert set(df.loc["Arrests"].index.get_level_values("Year")) == set(
+        range(2006, 2019)
+    )
+    assert df.loc[("Arrests", 2018, "Black"), "Count"] == 60116
+    assert df.loc[("Arrests", 2018, "Black"), "Ratio"] == pytest.approx(3.44, abs=0.01)
+    assert df.loc[("Arrests", 2018, "Black"), "Rank"] == 1
+    assert "White" not in df.index.get_level_values("Ethnicity")
@@ -0,0 +1,42 @@
+import json
+
+import plotly.io as pio
+import pytest
+from plotly.io.json import to_json_plotly
+
+import serialization
+
+
+def test_layout_is_encoded_once_and_matches_dash(app_module, monkeypatch):
+    app_module.layout_cache.clear()
+    encoded = []
+    monkeypatch.setattr(
+        serialization,
+        "to_json_plotly",
+        lambda value: encoded.append(value) or to_json_plotly(value),
+    )
+
+    with app_module.app.server.test_client() as client:
+        first = client.get("/_dash-layout")
+        second = client.get("/_dash-layout")
+        cached = client.get(
+            "/_dash-layout", headers={"If-None-Match": first.headers["ETag"]}
+        )
+
+    assert len(encoded) == 1
+    assert first.status_code == second.status_code == 200
+    assert first.data == second.data
+    assert json.loads(first.data) == json.loads(to_json_plotly(app_module.app.layout))
+    assert cached.status_code == 304
+
+
+def test_fast_json_encodes_figures_the_same(app_module):
+    pytest.importorskip("orjson")
+    figure = app_module.update_map(0.1)
+    expected = json.loads(to_json_plotly(figure, engine="json"))
+
+    try:
+        assert serialization.enable_fast_json()
+        assert json.loads(to_json_plotly(figure)) == expected
+    finally:
+        pio.json.config.default_engine = "auto"
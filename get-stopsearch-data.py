@@ -1,105 +1,621 @@
 import requests
+import os
 import pathlib
 import glob
 import json
 import logging
 import time
 import random
+import email.utils
+from datetime import datetime, timezone
 from dataclasses import dataclass
 from argparse import ArgumentParser
+from collections import Counter
+import numpy as np
 import pandas as pd
 import tenacity
+from processing import DashBLM
+from result_store import ResultWriter, read_results
+
+
+class PoliceAPIError(Exception):
+    """
+    A call to the police API that didn't come back with a 200.
+    """
+
+    def __init__(self, status, reason="", retry_after=None):
+        super().__init__("{} {}".format(status, reason).strip())
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        # Only rate limiting and server errors are worth trying again; any other 4xx will fail the same way
+
+        return self.status == 429 or self.status >= 500
+
+
+class CircuitOpenError(PoliceAPIError):
+    """
+    Raised instead of calling the API while the circuit breaker is open.
+    """
+
+    def __init__(self, seconds_left):
+        super().__init__(
+            503, "API degraded, not calling it for another {:.0f}s".format(seconds_left)
+        )
+
+    @property
+    def retryable(self):
+        return False
+
+
+class HarvestPaused(Exception):
+    """
+    Raised when the circuit breaker opens part way through a harvest. Carries the calls of the month so far that
+    failed, along with every LAD that hadn't been fetched yet marked as pending, so the run can stop there and leave
+    the rest for the --refetch argument rather than failing each of them without calling the API.
+    """
+
+    def __init__(self, failures, reason):
+        super().__init__(reason)
+        self.failures = failures
+
+
+class CircuitBreaker:
+    """
+    Stops calling the API after too many failures in a row so a harvest doesn't spend an outage retrying every
+    LAD ten times. Once the cooldown is over one call is let through to see if the API has recovered; if that
+    fails too the breaker opens again.
+    """
+
+    def __init__(self, threshold=5, cooldown=60):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+
+    def check(self):
+        if self.opened_at is None:
+            return None
+
+        seconds_left = self.opened_at + self.cooldown - time.monotonic()
+        if seconds_left > 0:
+            raise CircuitOpenError(seconds_left)
+
+        return None
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            if self.opened_at is None:
+                logging.info(
+                    "[*] {} failed calls in a row, pausing calls for {}s".format(
+                        self.failures, self.cooldown
+                    )
+                )
+            self.opened_at = time.monotonic()
+
+
+def should_retry(error):
+    if isinstance(error, PoliceAPIError):
+        return error.retryable
+
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+def wait_for_api(retry_state):
+    """
+    Waits as long as the API asked for in its Retry-After header, up to the longest backoff, or otherwise backs off
+    exponentially with jitter so parallel harvests don't all come back at the same moment.
+    :param retry_state: tenacity.RetryCallState.
+    :return: float, seconds to wait.
+    """
+
+    # A Retry-After of hours (or a date far off) shouldn't stall the whole harvest, so it's capped like any other wait
+
+    error = retry_state.outcome.exception()
+    if getattr(error, "retry_after", None) is not None:
+        return min(error.retry_after, PoliceAPI.max_backoff)
+
+    return tenacity.wait_random_exponential(
+        multiplier=PoliceAPI.backoff, max=PoliceAPI.max_backoff
+    )(retry_state)
 
 
 @dataclass
 class PoliceAPI:
+
+    # Point POLICE_API_ENDPOINT at police_api_replay.py to harvest from recorded responses instead of the live API
+
+    api_endpoint: str = os.environ.get(
+        "POLICE_API_ENDPOINT", "https://data.police.uk/api/stops-street?"
+    )
+    request_delay: tuple = (1, 2)  # seconds between calls, to go easy on the API
+    request_timeout: float = 60
+    backoff: float = 1  # seconds before the first retry, doubling each time after
+    max_backoff: float = 120
+    breaker = CircuitBreaker()
+    max_vertices: int = 100  # boundaries are simplified down to this many points per poly
+    result_cap: int = 10000  # the API answers with a 503 when an area has more searches than this
+    min_tile_degrees: float = 0.005  # areas are never split smaller than this, roughly 500m across
+    poly_cache = {}
+
+    @staticmethod
+    def format_pairs(pairs):
+        """
+        Joins co-ordinate pairs into the poly format the API uses, with a single string format call.
+        :param pairs: (n, 2) array or flat list of lat/long values.
+        :return: string like 52.2,0.5:52.8,0.2:52.1,0.88.
+        """
+
+        flat = np.asarray(pairs, dtype=float).ravel().tolist()
+
+        return ":".join(["{},{}"] * (len(flat) // 2)).format(*flat)
+
     @staticmethod
-    def flatten(bad):
+    def outer_rings(coordinates):
         """
-        Flattenst a list no matter how many sublists.
-        :param bad: the bad list of sublists you want to flatten.
-        :return: flat list.
+        Gets the boundary of each separate piece of a LAD, whether its geometry is a Polygon or a MultiPolygon, so
+        islands and exclaves become polys of their own instead of being joined up with the mainland. Holes are
+        left out since the outer boundary already covers them.
+        :param coordinates: the geojson co-ordinates of a LAD.
+        :return: list of (n, 2) arrays of long/lat pairs.
         """
 
-        good = []
+        if isinstance(coordinates[0][0][0], (int, float)):
+            polygons = [coordinates]
+        else:
+            polygons = coordinates
 
-        while bad:
-            e = bad.pop()
-            if isinstance(e, list):
-                bad.extend(e)
+        return [np.asarray(polygon[0], dtype=float) for polygon in polygons]
+
+    @staticmethod
+    def douglas_peucker(points, tolerance):
+        """
+        Finds the points of a line to keep so no dropped point is further than the tolerance from the simplified line.
+        :param points: (n, 2) array.
+        :param tolerance: float, in degrees.
+        :return: boolean array of the points to keep.
+        """
+
+        keep = np.zeros(len(points), dtype=bool)
+        keep[[0, -1]] = True
+        stack = [(0, len(points) - 1)]
+
+        while stack:
+            start, end = stack.pop()
+            if end - start < 2:
+                continue
+            segment = points[end] - points[start]
+            offsets = points[start + 1 : end] - points[start]
+            length = np.hypot(*segment)
+            if length == 0:
+                distances = np.hypot(offsets[:, 0], offsets[:, 1])
             else:
-                good.append(e)
+                distances = (
+                    np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0])
+                    / length
+                )
+            furthest = start + 1 + distances.argmax()
+            if distances.max() > tolerance:
+                keep[furthest] = True
+                stack.extend([(start, furthest), (furthest, end)])
+
+        return keep
+
+    @staticmethod
+    def simplify_ring(ring, max_vertices):
+        """
+        Simplifies a boundary until it has no more than max_vertices points, loosening the tolerance each time.
+        :param ring: (n, 2) array of long/lat pairs; it can be closed or not.
+        :param max_vertices: int.
+        :return: (m, 2) array without the closing point.
+        """
+
+        ring = np.asarray(ring, dtype=float)
+        if len(ring) > 1 and np.array_equal(ring[0], ring[-1]):
+            ring = ring[:-1]
+        if len(ring) <= max_vertices:
+            return ring
+
+        closed = np.vstack([ring, ring[:1]])
+        tolerance = np.ptp(ring, axis=0).max() * 1e-5
+        keep = PoliceAPI.douglas_peucker(closed, tolerance)[:-1]
+        while keep.sum() > max_vertices:
+            tolerance *= 2
+            keep = PoliceAPI.douglas_peucker(closed, tolerance)[:-1]
+
+        if keep.sum() < 3:
+            return ring[np.linspace(0, len(ring) - 1, max_vertices).astype(int)]
+
+        return ring[keep]
+
+    @staticmethod
+    def format_ring_for_api(ring):
+        """
+        Turns a boundary into a poly string for the API; e.g. 52.2,0.5:52.8,0.2:52.1,0.88.
+        :param ring: (n, 2) array of long/lat pairs.
+        :return: string.
+        """
 
-        return good[::-1]
+        return PoliceAPI.format_pairs(np.round(ring[:, ::-1], 6))
 
     @staticmethod
-    def swap_pairs(poly):
+    def clip_ring(ring, axis, value, keep_below):
         """
-        Turns a list like this [1, 2, 3, 4] into [2, 1, 4, 3]
-        :param poly: list
-        :return: list
+        Cuts a boundary along a line of longitude (axis 0) or latitude (axis 1), keeping one side of it.
+        :param ring: (n, 2) array of long/lat pairs, not closed.
+        :param axis: int.
+        :param value: float, where to cut.
+        :param keep_below: bool, whether to keep the part below the line or above it.
+        :return: (m, 2) array.
         """
 
-        for i in range(0, len(poly) - 1, 2):
-            poly[i], poly[i + 1] = poly[i + 1], poly[i]
+        inside = ring[:, axis] <= value if keep_below else ring[:, axis] >= value
+        clipped = []
+
+        for i in range(len(ring)):
+            current, previous = ring[i], ring[i - 1]
+            if inside[i] != inside[i - 1]:
+                fraction = (value - previous[axis]) / (current[axis] - previous[axis])
+                clipped.append(previous + fraction * (current - previous))
+            if inside[i]:
+                clipped.append(current)
 
-        return poly
+        return np.array(clipped).reshape(-1, 2)
 
     @staticmethod
-    def format_geojson_for_api(poly=None):
+    def split_ring(ring):
         """
-        Turns geojson co-ordinates into the format requried by the UK police API; example format below:
-         https://data.police.uk/api/stops-street?poly=52.2,0.5:52.8,0.2:52.1,0.88&date=2018-06.
-        :param poly: list of sublists containing lat/long co-ordinate pairs.
-        :return: string in the right format for the API.
+        Cuts a boundary in half across its longest side.
+        :param ring: (n, 2) array of long/lat pairs, not closed.
+        :return: list of the halves that still have an area.
         """
 
-        poly = PoliceAPI.flatten(poly)
-        poly = PoliceAPI.swap_pairs(poly)
-        polys_formatted = [
-            str(x) + "," + str(y) + ":" for x, y in zip(poly[0::2], poly[1::2])
+        axis = int(np.ptp(ring, axis=0).argmax())
+        middle = (ring[:, axis].min() + ring[:, axis].max()) / 2
+        halves = [
+            PoliceAPI.clip_ring(ring, axis, middle, keep_below=True),
+            PoliceAPI.clip_ring(ring, axis, middle, keep_below=False),
         ]
-        polys_formatted[-1] = polys_formatted[-1].replace(":", "")
-        poly_as_string = "".join(x for x in polys_formatted)
 
-        return poly_as_string
+        return [half for half in halves if len(half) >= 3]
+
+    @staticmethod
+    def prepare_ring(ring):
+        """
+        Gets a boundary ready to send to the API.
+        :param ring: (n, 2) array or list of long/lat pairs.
+        :return: tuple of the boundary without its closing point and the simplified poly string for it.
+        """
+
+        ring = np.asarray(ring, dtype=float)
+        if len(ring) > 1 and np.array_equal(ring[0], ring[-1]):
+            ring = ring[:-1]
+        poly = PoliceAPI.format_ring_for_api(
+            PoliceAPI.simplify_ring(ring, PoliceAPI.max_vertices)
+        )
+
+        return ring, poly
+
+    @staticmethod
+    def prepare_lad(coordinates, lad=None):
+        """
+        Gets every piece of a LAD ready to send to the API. Given the name of the LAD the result is kept, so a run
+        over a range of dates only simplifies and formats each boundary once.
+        :param coordinates: the geojson co-ordinates of the LAD.
+        :param lad: string, the LAD's name, or None to not keep the result.
+        :return: list of tuples from prepare_ring.
+        """
+
+        key = (lad, PoliceAPI.max_vertices)
+        if lad is not None and key in PoliceAPI.poly_cache:
+            return PoliceAPI.poly_cache[key]
+
+        prepared = [
+            PoliceAPI.prepare_ring(ring) for ring in PoliceAPI.outer_rings(coordinates)
+        ]
+        if lad is not None:
+            PoliceAPI.poly_cache[key] = prepared
+
+        return prepared
+
+    @staticmethod
+    def fetch_area(ring, date, poly=None):
+        """
+        Gets the stop and searches inside a boundary, splitting it in half and trying each half on its own whenever
+        the API says an area has too many results.
+        :param ring: (n, 2) array of long/lat pairs.
+        :param date: string; YYYY-MM.
+        :param poly: string, the poly for the boundary from prepare_ring if it's already been made.
+        :return: list with a list of records for each area that was fetched.
+        """
+
+        if poly is None:
+            ring, poly = PoliceAPI.prepare_ring(ring)
+
+        if np.ptp(ring, axis=0).max() < PoliceAPI.min_tile_degrees:
+            return [json.loads(PoliceAPI.get_stop_search_data(poly=poly, date=date))]
+
+        # A 503 can mean the area is over the result cap or that the API is having trouble, so it's asked for once
+        # more before the area is taken to be too busy and split. Only the repeated 503 counts against the circuit
+        # breaker, so an outage opens it after a few splits instead of the LAD being split all the way down
+
+        get_unless_503 = PoliceAPI.get_stop_search_data.retry_with(
+            retry=tenacity.retry_if_exception(
+                lambda e: should_retry(e)
+                and not (isinstance(e, PoliceAPIError) and e.status == 503)
+            )
+        )
+        records = None
+        for attempt in range(2):
+            try:
+                records = json.loads(
+                    get_unless_503(poly=poly, date=date, maybe_over_cap=attempt == 0)
+                )
+                break
+            except CircuitOpenError:
+                raise
+            except PoliceAPIError as e:
+                if e.status != 503:
+                    raise
+                if attempt == 0:
+                    time.sleep(PoliceAPI.backoff)
+
+        if records is not None and len(records) < PoliceAPI.result_cap:
+            return [records]
+
+        logging.info("[*] Too many results for one call, splitting the area in two")
+        tiles = []
+        for half in PoliceAPI.split_ring(ring):
+            tiles.extend(PoliceAPI.fetch_area(half, date))
+
+        return tiles
+
+    @staticmethod
+    def merge_tiles(tiles):
+        """
+        Joins the records from neighbouring areas. Searches on the line between two areas come back in both, so
+        each distinct record is kept as many times as it appears in any one area, not in all of them.
+        :param tiles: list of lists of records.
+        :return: list of records.
+        """
+
+        counts = Counter()
+        records = {}
+
+        for tile in tiles:
+            tile_counts = Counter()
+            for record in tile:
+                key = json.dumps(record, sort_keys=True)
+                records.setdefault(key, record)
+                tile_counts[key] += 1
+            counts |= tile_counts
+
+        return [
+            dict(records[key]) for key, count in counts.items() for _ in range(count)
+        ]
+
+    @staticmethod
+    def fetch_lad(coordinates, date, lad=None):
+        """
+        Gets the stop and searches in a LAD, with one call per separate piece of it, or more if a piece is too
+        busy for one call.
+        :param coordinates: the geojson co-ordinates of the LAD.
+        :param date: string; YYYY-MM.
+        :param lad: string, the LAD's name, so its polys can be reused for other dates.
+        :return: list of records.
+        """
+
+        tiles = []
+        for ring, poly in PoliceAPI.prepare_lad(coordinates, lad):
+            tiles.extend(PoliceAPI.fetch_area(ring, date, poly))
+
+        return PoliceAPI.merge_tiles(tiles)
+
+    @staticmethod
+    def parse_retry_after(value):
+        """
+        Reads a Retry-After header, which can either be a number of seconds or a date.
+        :param value: string or None.
+        :return: float, seconds to wait, or None if there was no usable header.
+        """
+
+        if value is None:
+            return None
+
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
 
     @staticmethod
-    @tenacity.retry(stop=tenacity.stop_after_attempt(10))
-    def get_stop_search_data(poly, date):
+    @tenacity.retry(
+        stop=tenacity.stop_after_attempt(10),
+        wait=wait_for_api,
+        retry=tenacity.retry_if_exception(should_retry),
+        reraise=True,
+    )
+    def get_stop_search_data(poly, date, maybe_over_cap=False):
         """
-        Makes an API call to the UK Police API for stop search data.
+        Makes an API call to the UK Police API for stop search data. Rate limiting (429), server errors and
+        dropped connections are retried; any other failure is raised straight away. Only failures that will be
+        retried count towards opening the circuit breaker.
         :param poly: string; the area you want want to find stop and searches in
         :param date: string; you have to specify a year and a month
+        :param maybe_over_cap: bool, whether a 503 could just mean the area has too many results, in which case it
+        isn't counted against the circuit breaker.
         :return: the response as a string.
         """
 
-        api_endpoint = "https://data.police.uk/api/stops-street?"
+        PoliceAPI.breaker.check()
+
         data = {"poly": poly, "date": date}
-        response = requests.post(url=api_endpoint, data=data)
+        try:
+            response = requests.post(
+                url=PoliceAPI.api_endpoint, data=data, timeout=PoliceAPI.request_timeout
+            )
+        except (requests.ConnectionError, requests.Timeout):
+            PoliceAPI.breaker.record_failure()
+            raise
+        finally:
+            time.sleep(random.uniform(*PoliceAPI.request_delay))
+
         if response.status_code == 200:
             logging.info("[*] Successful API call, saving data...")
-        else:
+            PoliceAPI.breaker.record_success()
+            return response.text
+
+        logging.info(
+            "[*] API call failed - {}{}".format(response.status_code, response.reason)
+        )
+        error = PoliceAPIError(
+            response.status_code,
+            response.reason,
+            PoliceAPI.parse_retry_after(response.headers.get("Retry-After")),
+        )
+        if error.retryable and not (maybe_over_cap and error.status == 503):
+            PoliceAPI.breaker.record_failure()
+
+        raise error
+
+    @staticmethod
+    def harvest_month(features, date, writer):
+        """
+        Gets the stop and searches for every LAD on one date and writes them out as they come in. LADs that still
+        fail after retrying are skipped and returned so they can be fetched again later with the --refetch argument.
+        :param features: list of geojson features for the LADs.
+        :param date: string; YYYY-MM.
+        :param writer: result_store.ResultWriter to write each record to, tagged with its LAD and month.
+        :return: list of dicts describing the failed calls.
+        """
+
+        failures = []
+
+        for position, item in enumerate(features):
+            original_poly = item["geometry"]["coordinates"]
+            logging.info(
+                "Trying to get stop and search data for LAD {} on date {}.".format(
+                    item["id"], date
+                )
+            )
+            try:
+                records = PoliceAPI.fetch_lad(original_poly, date, lad=item["id"])
+            except CircuitOpenError as e:
+                logging.info("[*] Stopping the harvest on date {} - {}".format(date, e))
+                failures.extend(
+                    PoliceAPI.pending_requests(features[position:], date, str(e))
+                )
+                raise HarvestPaused(failures, str(e))
+            except (PoliceAPIError, requests.RequestException) as e:
+                logging.info(
+                    "[*] Giving up on LAD {} on date {} - {}".format(
+                        item["id"], date, e
+                    )
+                )
+                failures.append(
+                    {
+                        "lad": item["id"],
+                        "date": date,
+                        "status": getattr(e, "status", None),
+                        "error": str(e),
+                    }
+                )
+                continue
+
+            for record in records:
+                record["lad"] = item["id"]
+                record["month"] = date
+            writer.write_many(records)
+
+        return failures
+
+    @staticmethod
+    def pending_requests(features, date, reason):
+        """
+        Lists LADs that weren't fetched because the harvest was stopped, in the same format as failed calls.
+        :param features: list of geojson features for the LADs.
+        :param date: string; YYYY-MM.
+        :param reason: string, why the harvest stopped.
+        :return: list of dicts.
+        """
+
+        return [
+            {"lad": item["id"], "date": date, "status": "pending", "error": reason}
+            for item in features
+        ]
+
+    @staticmethod
+    def merge_results(filenames, target_year, writer):
+        """
+        Joins the monthly output files written by the --range, --date and --refetch arguments into one file of
+        results for a year, a record at a time. Months that show up in more than one file have their records
+        combined rather than overwritten.
+        :param filenames: list of paths to stopsearch-YYYY-MM.ndjson.gz files, or .json files from older runs.
+        :param target_year: string; only months in this year are kept.
+        :param writer: result_store.ResultWriter for the joined results.
+        :return: int, the number of records written.
+        """
+
+        count = 0
+
+        for filename in sorted(filenames):
+            for month, record in read_results(filename):
+                if month.startswith(target_year):
+                    record["month"] = month
+                    writer.write(record)
+                    count += 1
+
+        return count
+
+    @staticmethod
+    def write_failures(failures, filename="failed-requests.json"):
+        """
+        Writes the LAD and date of every call that failed, so the --refetch argument knows what to ask for again.
+        :param failures: list of dicts from harvest_month.
+        :param filename: string.
+        :return: None.
+        """
+
+        pending = sum(x["status"] == "pending" for x in failures)
+        if failures:
             logging.info(
-                "[*] API call failed - {}{}".format(
-                    response.status_code, response.reason
+                "[*] {} calls failed and {} weren't made, see {} and rerun with --refetch".format(
+                    len(failures) - pending, pending, filename
                 )
             )
-        time.sleep(random.uniform(1, 2))
+        with open(filename, "w") as f:
+            json.dump(failures, f, indent=1)
 
-        return response.text
+        return None
 
     @staticmethod
-    def write_results(result):
+    def write_results(records, filename):
         """
-        Writes the API response to a json file.
-        :param result: list of json dicts.
+        Adds records from the API to the end of a file of results, one per line.
+        :param records: list of json dicts.
+        :param filename: string.
         :return: None.
         """
 
         logging.info("[*] Writing data...")
-        with open("stopsearchresults.json", "a") as f:
-            json.dump(result, f)
+        with ResultWriter(filename, mode="a") as writer:
+            writer.write_many(records)
 
         return None
 
@@ -140,6 +656,17 @@ if __name__ == "__main__":
         help="""Join results from differen months together. Only works
                                                             with output from the --range argument.""",
     )
+    parser.add_argument(
+        "--archive",
+        action="store_true",
+        help="""Load stop and searches from a bulk download from https://data.police.uk/data/ instead of
+                                                            calling the API.""",
+    )
+    parser.add_argument(
+        "--refetch",
+        action="store_true",
+        help="Try the calls listed in failed-requests.json by an earlier run again.",
+    )
 
     args = parser.parse_args()
     PoliceAPI = PoliceAPI()
@@ -153,48 +680,46 @@ if __name__ == "__main__":
             "Enter the name of your target local area district. First letter must be capitalized."
         )
 
-        counter = 0
-        for LAD in geojson["features"]:
+        LAD = next((x for x in geojson["features"] if x["id"] == input_LAD), None)
 
-            counter += 1
-
-            if LAD["id"] == input_LAD:
-                original_poly = geojson["features"][0]["geometry"]["coordinates"]
-                formatted_poly = PoliceAPI.format_geojson_for_api(poly=original_poly)
-                output = PoliceAPI.get_stop_search_data(
-                    poly=formatted_poly, date=input_date
-                )
-                value_to_write = json.loads(output)
-                if output:
-                    result = {"results": value_to_write[0]}
-                    PoliceAPI.write_results(result=result)
-
-        if len(geojson["features"]) == counter:
+        if LAD is None:
             logging.info(
                 "This LAD is incorrect. Check the spelling/formatting and try again."
             )
+        else:
+            try:
+                records = PoliceAPI.fetch_lad(
+                    LAD["geometry"]["coordinates"], input_date, LAD["id"]
+                )
+            except (PoliceAPIError, requests.RequestException) as e:
+                logging.info(
+                    "[*] Giving up on LAD {} on date {} - {}".format(
+                        LAD["id"], input_date, e
+                    )
+                )
+            else:
+                for record in records:
+                    record["lad"] = LAD["id"]
+                    record["month"] = input_date
+
+                # Named so neither --merge nor processing.py mistake one LAD's results for a whole month's or year's
+
+                PoliceAPI.write_results(
+                    records, "lad-{}-{}.ndjson.gz".format(LAD["id"], input_date)
+                )
 
     if args.date:
 
         input_date = input("Enter your date here in a YYYY-MM format")
-        results = []
 
-        for LAD in geojson["features"]:
-            original_poly = LAD["geometry"]["coordinates"]
-            logging.info(
-                "Trying to get stop and search data for LAD {}.".format(LAD["id"])
-            )
-            formatted_poly = PoliceAPI.format_geojson_for_api(poly=original_poly)
-            output = PoliceAPI.get_stop_search_data(
-                poly=formatted_poly, date=input_date
-            )
-            value_to_write = json.loads(output)
-            if value_to_write:
-                results.append(value_to_write[0])
-
-        result = {"results": {input_date: results}}
-        with open("stopsearch-{}.json".format(input_date), "w") as f:
-            json.dump(result, f)
+        with ResultWriter("stopsearch-{}.ndjson.gz".format(input_date)) as writer:
+            try:
+                failures = PoliceAPI.harvest_month(
+                    geojson["features"], input_date, writer
+                )
+            except HarvestPaused as e:
+                failures = e.failures
+        PoliceAPI.write_failures(failures)
 
     if args.range:
 
@@ -206,50 +731,96 @@ if __name__ == "__main__":
         input_dates = input_dates[
             ::-1
         ]  # it's unclear when the police data begins so best to go through in reverse
-        results = []
-
-        for target_date in input_dates:
-            # Written the below to fix an error where original_poly a few lines below kept coming back as an empty list
-            with open(path + "formatted_UK_LAD.geojson", "r") as original_file:
-                geojson = json.load(original_file)
-            for item in geojson["features"]:
-                original_poly = item["geometry"]["coordinates"]
-                logging.info(
-                    "Trying to get stop and search data for LAD {} on date {}.".format(
-                        item["id"], target_date
+
+        failures = []
+
+        for position, target_date in enumerate(input_dates):
+
+            # One file per month so a failed run only has to repeat the months it didn't finish. If the API goes
+            # down the run stops and the months it didn't get to are left for --refetch
+
+            with ResultWriter("stopsearch-{}.ndjson.gz".format(target_date)) as writer:
+                try:
+                    failures.extend(
+                        PoliceAPI.harvest_month(
+                            geojson["features"], target_date, writer
+                        )
                     )
+                except HarvestPaused as e:
+                    paused = e
+                else:
+                    paused = None
+
+            if paused:
+                failures.extend(paused.failures)
+                for later_date in input_dates[position + 1 :]:
+                    failures.extend(
+                        PoliceAPI.pending_requests(
+                            geojson["features"], later_date, str(paused)
+                        )
+                    )
+                PoliceAPI.write_failures(failures)
+                break
+
+            PoliceAPI.write_failures(failures)
+
+    if args.refetch:
+
+        with open("failed-requests.json", "r") as f:
+            failed = json.load(f)
+
+        failures = []
+
+        paused = None
+
+        for target_date in sorted({x["date"] for x in failed}):
+            lads = {x["lad"] for x in failed if x["date"] == target_date}
+            features = [x for x in geojson["features"] if x["id"] in lads]
+
+            if paused:
+                failures.extend(
+                    PoliceAPI.pending_requests(features, target_date, paused)
                 )
-                formatted_poly = PoliceAPI.format_geojson_for_api(poly=original_poly)
-                output = PoliceAPI.get_stop_search_data(
-                    poly=formatted_poly, date=target_date
-                )
-                value_to_write = json.loads(output)
-                if value_to_write:
-                    results.append(value_to_write[0])
-
-            if target_date == input_dates[0]:
-                result = {"results": {target_date: results}}
-                with open("stopsearch-{}.json".format(target_date), "w") as f:
-                    json.dump(result, f)
-            else:
-                result["results"][target_date] = results
-                with open("stopsearch-{}.json".format(target_date), "w") as f:
-                    json.dump(result, f)
+                continue
 
-    if args.merge:
+            # --merge combines these with the records already in stopsearch-YYYY-MM.ndjson.gz
 
-        target_year = input("Which year are you merging different json data for?")
+            refetched = "stopsearch-{}-refetch-{}.ndjson.gz".format(
+                target_date, time.strftime("%Y%m%d%H%M%S")
+            )
+            with ResultWriter(refetched) as writer:
+                try:
+                    failures.extend(
+                        PoliceAPI.harvest_month(features, target_date, writer)
+                    )
+                except HarvestPaused as e:
+                    failures.extend(e.failures)
+                    paused = str(e)
 
-        root_path = str(pathlib.Path.cwd())
-        json_files = glob.glob(root_path + "/*.json")
+        PoliceAPI.write_failures(failures)
 
-        stopsearchdata = {"results": {}}
+    if args.archive:
 
-        for json_month in json_files:
+        archive_path = input(
+            "Enter the path to the bulk download zip file or the folder it unzips to."
+        )
+        months = DashBLM.ingest_stopsearch_archive(archive_path)
+        logging.info(
+            "[*] Loaded {} months of stop and searches into the store".format(
+                len(months)
+            )
+        )
 
-            with open(json_month.split(root_path)[1].replace("/", ""), "r") as f:
-                that_months_data = json.load(f)
-                stopsearchdata["results"] = that_months_data["results"]
+    if args.merge:
+
+        target_year = input("Which year are you merging different json data for?")
+
+        root_path = str(pathlib.Path.cwd())
+        filenames = glob.glob(root_path + "/stopsearch-*.ndjson.gz") + glob.glob(
+            root_path + "/stopsearch-*.json"
+        )
 
-        with open("{}stopsearchresults.json".format(target_year), "w") as f_to_write:
-            json.dump(stopsearchdata, f_to_write)
+        with ResultWriter(
+            "{}stopsearchresults.ndjson.gz".format(target_year)
+        ) as writer:
+            PoliceAPI.merge_results(filenames, target_year, writer)
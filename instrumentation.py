@@ -0,0 +1,299 @@
+import cProfile
+import functools
+import logging
+import os
+import pathlib
+import threading
+import resource
+import sys
+import time
+from collections import defaultdict
+
+import flask
+
+
+class CallbackMetrics:
+    """
+    Records how long every Dash callback takes and how big its response is, and serves the results as histograms
+    in the Prometheus text format on /metrics. For each callback request it records:
+    - wall time, from the request arriving to the response leaving the server
+    - figure construction time, i.e. time spent inside the callback function itself
+    - serialization time, from the callback returning to the response being ready
+    - response size in bytes
+    Only requests for callbacks the app has, that succeed, are recorded, so the number of histograms can't be grown
+    by posting made up outputs. When profiling is allowed, sending the X-Dash-Profile header with a callback request
+    also dumps a cProfile of that request to profile_dir. It's off by default as it writes files to the server.
+    """
+
+    seconds_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    bytes_buckets = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+    histograms = {
+        "dash_callback_wall_seconds": (
+            "Total time spent handling a callback request.",
+            seconds_buckets,
+        ),
+        "dash_callback_figure_seconds": (
+            "Time spent inside the callback function.",
+            seconds_buckets,
+        ),
+        "dash_callback_serialize_seconds": (
+            "Time spent encoding the callback response.",
+            seconds_buckets,
+        ),
+        "dash_callback_response_bytes": (
+            "Size of the callback response body.",
+            bytes_buckets,
+        ),
+    }
+    profile_header = "X-Dash-Profile"
+
+    def __init__(self, profile_dir="profiles", allow_profiling=False):
+        self.profile_dir = profile_dir
+        self.allow_profiling = allow_profiling
+        self.app = None
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.sums = defaultdict(float)
+
+    def instrument(self, app):
+        """
+        Hooks the metrics into a Dash app. This has to happen before any callbacks are defined, since only
+        callbacks registered afterwards are timed.
+        :param app: the dash.Dash app.
+        :return: None.
+        """
+
+        self.app = app
+        register = app.callback
+
+        def callback(*args, **kwargs):
+            decorator = register(*args, **kwargs)
+
+            def wrap(func):
+                decorator(self.time_callback(func))
+                return func
+
+            return wrap
+
+        app.callback = callback
+        app.server.before_request(self.before_request)
+        app.server.after_request(self.after_request)
+        app.server.add_url_rule("/metrics", "metrics", self.serve_metrics)
+
+        return None
+
+    @staticmethod
+    def time_callback(func):
+        """
+        Wraps a callback function so the time spent inside it is kept on the request for after_request.
+        :param func: the callback function.
+        :return: the wrapped function.
+        """
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if flask.has_request_context():
+                    flask.g.callback_returned = time.perf_counter()
+                    flask.g.figure_seconds = flask.g.callback_returned - start
+
+        return timed
+
+    def before_request(self):
+        flask.g.request_start = time.perf_counter()
+        if self.allow_profiling and self.profile_header in flask.request.headers:
+            flask.g.profile = cProfile.Profile()
+            flask.g.profile.enable()
+
+    def after_request(self, response):
+        finished = time.perf_counter()
+        profile = flask.g.pop("profile", None)
+        if profile:
+            profile.disable()
+
+        if (
+            not flask.request.path.endswith("_dash-update-component")
+            or response.status_code != 200
+        ):
+            return response
+
+        body = flask.request.get_json(silent=True) or {}
+        label = str(body.get("output"))
+        if label not in self.app.callback_map:
+            return response
+        returned = flask.g.get("callback_returned", finished)
+
+        self.observe(
+            "dash_callback_wall_seconds", label, finished - flask.g.request_start
+        )
+        self.observe(
+            "dash_callback_figure_seconds", label, flask.g.get("figure_seconds", 0.0)
+        )
+        self.observe("dash_callback_serialize_seconds", label, finished - returned)
+        self.observe("dash_callback_response_bytes", label, len(response.get_data()))
+
+        if profile:
+            pathlib.Path(self.profile_dir).mkdir(parents=True, exist_ok=True)
+            filename = "{}-{}.prof".format(
+                time.strftime("%Y%m%d-%H%M%S"),
+                "".join(x if x.isalnum() else "_" for x in label),
+            )
+            profile.dump_stats(str(pathlib.Path(self.profile_dir) / filename))
+
+        return response
+
+    def observe(self, name, label, value):
+        """
+        Adds a value to a histogram.
+        :param name: string, one of the names in histograms.
+        :param label: string, the callback the value is for.
+        :param value: float, seconds or bytes.
+        :return: None.
+        """
+
+        buckets = self.histograms[name][1]
+        with self.lock:
+            counts = self.counts.setdefault((name, label), [0] * (len(buckets) + 1))
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self.sums[(name, label)] += value
+
+        return None
+
+    def render(self):
+        """
+        Formats every histogram in the Prometheus text exposition format.
+        :return: string.
+        """
+
+        lines = []
+
+        with self.lock:
+            for name, (description, buckets) in self.histograms.items():
+                lines.append("# HELP {} {}".format(name, description))
+                lines.append("# TYPE {} histogram".format(name))
+                for (metric, label), counts in sorted(self.counts.items()):
+                    if metric != name:
+                        continue
+                    escaped = (
+                        label.replace("\\", "\\\\")
+                        .replace('"', '\\"')
+                        .replace("\n", "\\n")
+                    )
+                    for bound, count in zip(buckets + ("+Inf",), counts):
+                        lines.append(
+                            '{}_bucket{{callback="{}",le="{}"}} {}'.format(
+                                name, escaped, bound, count
+                            )
+                        )
+                    lines.append(
+                        '{}_sum{{callback="{}"}} {}'.format(
+                            name, escaped, self.sums[(metric, label)]
+                        )
+                    )
+                    lines.append(
+                        '{}_count{{callback="{}"}} {}'.format(name, escaped, counts[-1])
+                    )
+
+        return "\n".join(lines) + "\n"
+
+    def serve_metrics(self):
+        return flask.Response(self.render(), mimetype="text/plain; version=0.0.4")
+
+
+class StartupProfiler:
+    """
+    Times each phase of starting the app (imports, data load, figure build, layout build) and how much the peak
+    memory of the process grows during it, then logs a report once startup is finished. Turn it on by setting
+    DASH_BLM_PROFILE_STARTUP=1; set DASH_BLM_STARTUP_BUDGET to a number of seconds to make startup fail if it takes
+    longer than that.
+    Does nothing when it isn't turned on.
+    """
+
+    def __init__(self, enabled=False, budget=None):
+        self.enabled = enabled
+        self.budget = budget
+        self.phases = []
+        self.current = None
+
+    @classmethod
+    def from_environment(cls):
+        budget = os.environ.get("DASH_BLM_STARTUP_BUDGET")
+        return cls(
+            enabled=os.environ.get("DASH_BLM_PROFILE_STARTUP") == "1" or bool(budget),
+            budget=float(budget) if budget else None,
+        )
+
+    def phase(self, name):
+        """
+        Ends the current phase, if there is one, and starts timing the next.
+        :param name: string, name of the phase for the report.
+        :return: None.
+        """
+
+        if not self.enabled:
+            return None
+
+        self.end_phase()
+        self.current = (name, time.perf_counter(), self.peak_rss_mb())
+
+        return None
+
+    @staticmethod
+    def peak_rss_mb():
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+
+    def end_phase(self):
+        if self.current is None:
+            return None
+
+        name, start, memory = self.current
+        peak = self.peak_rss_mb()
+        self.phases.append(
+            {
+                "phase": name,
+                "seconds": time.perf_counter() - start,
+                "growth_mb": peak - memory,
+                "peak_mb": peak,
+            }
+        )
+        self.current = None
+
+        return None
+
+    def finish(self):
+        """
+        Ends the last phase, logs the report and checks the total against the budget.
+        :return: list of dicts, one per phase.
+        """
+
+        if not self.enabled:
+            return self.phases
+
+        self.end_phase()
+
+        total = sum(phase["seconds"] for phase in self.phases)
+        lines = ["[*] Startup profile:"]
+        for phase in self.phases:
+            lines.append(
+                "    {phase:<16}{seconds:8.3f}s{growth_mb:10.1f} MB growth{peak_mb:10.1f} MB peak".format(
+                    **phase
+                )
+            )
+        lines.append("    {:<16}{:8.3f}s".format("total", total))
+        logging.warning("\n".join(lines))
+
+        if self.budget is not None and total > self.budget:
+            raise RuntimeError(
+                "Startup took {:.3f}s which is over the budget of {:.3f}s".format(
+                    total, self.budget
+                )
+            )
+
+        return self.phases
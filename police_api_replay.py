@@ -0,0 +1,241 @@
+import hashlib
+import json
+import logging
+import pathlib
+import random
+import threading
+import time
+from argparse import ArgumentParser
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+
+class FixtureStore:
+    """
+    Recorded police API responses, one json file per (poly, date) request, named after a hash of the request so
+    the long poly strings don't end up in file names.
+    """
+
+    def __init__(self, directory):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(poly, date):
+        return hashlib.sha1("{}|{}".format(poly, date).encode("utf-8")).hexdigest()
+
+    def load(self, poly, date):
+        """
+        Looks up the recorded response for a request.
+        :param poly: string; the poly the harvester sent.
+        :param date: string; YYYY-MM.
+        :return: dict with the status and body of the response, or None if it was never recorded.
+        """
+
+        fixture = self.directory / "{}.json".format(self.key(poly, date))
+        if not fixture.exists():
+            return None
+
+        with open(fixture, "r") as f:
+            return json.load(f)
+
+    def save(self, poly, date, status, body):
+        """
+        Records a response. Writes to a temporary file first so a replay server reading the same directory
+        never sees half a fixture.
+        :param poly: string; the poly the harvester sent.
+        :param date: string; YYYY-MM.
+        :param status: int, HTTP status code.
+        :param body: string, the response text.
+        :return: None.
+        """
+
+        fixture = self.directory / "{}.json".format(self.key(poly, date))
+        temporary = fixture.with_suffix(".tmp")
+        with open(temporary, "w") as f:
+            json.dump({"poly": poly, "date": date, "status": status, "body": body}, f)
+        temporary.replace(fixture)
+
+        return None
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.reply(parse_qs(urlparse(self.path).query))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.reply(parse_qs(self.rfile.read(length).decode("utf-8")))
+
+    def reply(self, params):
+        poly = params.get("poly", [""])[0]
+        date = params.get("date", [""])[0]
+        status, body, headers = self.server.replay.respond(poly, date)
+
+        payload = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        logging.debug("[*] Replay server: " + format, *args)
+
+
+class ReplayServer:
+    """
+    A stand-in for the data.police.uk stops-street endpoint that serves recorded responses, so the harvester can
+    be run and benchmarked without a network. Requests for a (poly, date) that was never recorded get a 404,
+    unless an upstream url is given, in which case they are fetched from there and recorded for next time.
+
+    To make runs reproducible the server can also add latency to every response and fail a fraction of requests
+    with 429s and 5xxs, picked by a seeded random number generator. 429s come with a Retry-After header like the
+    real API sends when you go over its rate limit.
+    """
+
+    def __init__(
+        self,
+        directory,
+        latency=0.0,
+        error_rate=0.0,
+        error_statuses=(429, 500, 502, 503),
+        retry_after=1,
+        seed=0,
+        upstream=None,
+        host="127.0.0.1",
+        port=0,
+    ):
+        self.fixtures = FixtureStore(directory)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.retry_after = retry_after
+        self.upstream = upstream
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.statuses = Counter()
+        self.httpd = ThreadingHTTPServer((host, port), ReplayHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.replay = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://{}:{}/api/stops-street?".format(host, port)
+
+    def respond(self, poly, date):
+        """
+        Decides what to send back for a request.
+        :param poly: string; the poly the harvester sent.
+        :param date: string; YYYY-MM.
+        :return: tuple of the status code, the body and a dict of extra headers.
+        """
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self.lock:
+            injected = self.rng.random() < self.error_rate
+            if injected:
+                status = self.rng.choice(self.error_statuses)
+
+        if injected:
+            headers = {}
+            if status == 429 and self.retry_after is not None:
+                headers["Retry-After"] = str(self.retry_after)
+            return self.count(status, "", headers)
+
+        fixture = self.fixtures.load(poly, date)
+
+        if fixture is None and self.upstream:
+            response = requests.post(
+                url=self.upstream, data={"poly": poly, "date": date}
+            )
+            if response.status_code == 200:
+                self.fixtures.save(poly, date, response.status_code, response.text)
+            return self.count(response.status_code, response.text, {})
+
+        if fixture is None:
+            return self.count(404, "", {})
+
+        return self.count(fixture["status"], fixture["body"], {})
+
+    def count(self, status, body, headers):
+        with self.lock:
+            self.statuses[status] += 1
+
+        return status, body, headers
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread:
+            self.thread.join()
+
+        return None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+
+    logging.basicConfig(format="%(asctime)s-%(message)s", level=logging.INFO)
+
+    parser = ArgumentParser(
+        description="Serve recorded police API responses. Point the harvester at it with POLICE_API_ENDPOINT."
+    )
+    parser.add_argument(
+        "--fixtures", default="fixtures", help="Directory of recorded responses."
+    )
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds to add to every response."
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests to fail with a 429 or 5xx.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--record",
+        metavar="URL",
+        help="Fetch requests that haven't been recorded from this url and record them, "
+        "e.g. https://data.police.uk/api/stops-street",
+    )
+
+    args = parser.parse_args()
+    server = ReplayServer(
+        args.fixtures,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        seed=args.seed,
+        upstream=args.record,
+        port=args.port,
+    )
+    logging.info("[*] Serving recorded responses on {}".format(server.url))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        logging.info("[*] Responses sent: {}".format(dict(server.statuses)))
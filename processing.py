@@ -1,8 +1,12 @@
 import pandas as pd
 import numpy as np
-import json
+import glob
+import re
+import zipfile
 from dataclasses import dataclass
 import pathlib
+from types import MappingProxyType
+from result_store import RecordIndex, read_results
 
 
 @dataclass
@@ -12,13 +16,84 @@ class DashBLM:
     pop_filename: str = "ukpopulationestimates18382018.xlsx"
     geojson_filename: str = "formatted_UK_LAD.geojson"
     ethnic_pops_data: str = "ethnic-population-by-local-authority.csv"
-    stopsearch_filename: str = "2019stopsearchresults.json"
+    stopsearch_filename: str = "2019stopsearchresults.ndjson.gz"
+    stopsearch_store: str = "stopsearch"
+    stopsearch_index: str = "index.sqlite"  # kept in the store's folder
     sentence_length_filename: str = "acsl-by-ethnicity-and-sex-2009-2017.csv"
     custody_rate_filename: str = "custody-rate.csv"
     conviction_filename: str = "prosecutions-and-convictions.csv"
+    density_resolutions: tuple = (0.5, 0.1, 0.02)  # cell sizes in degrees
+
+    # Compact types for the scattermapbox data; float32 co-ordinates are accurate to well under a metre and the hover
+    # text only has a few hundred distinct values so it's stored once per value with a small code per search
+
+    scatter_dtypes = {
+        "lats": "float32",
+        "longs": "float32",
+        "text": "category",
+        "size": "int8",
+        "color": "int8",
+    }
+
+    # Columns of the monthly stop search store, which also gets an Ethnic group column worked out from Ethnicity
+
+    stopsearch_columns = [
+        "Month",
+        "Datetime",
+        "Latitude",
+        "Longitude",
+        "LAD",
+        "Ethnicity",
+        "Age range",
+        "Gender",
+        "Object of search",
+    ]
+
+    # The ways the justice data is broken down besides year and ethnicity, each with an "All" total
+
+    justice_dimensions = ["Sex", "Age group", "Offence group", "Police Force Area"]
+
+    # Tables of the ONS population estimates workbook with the total population of England and Wales and of each of
+    # them, keyed by the first letter of their LADs' codes
+
+    population_tables = {"National": "Table 7", "E": "Table 10", "W": "Table 12"}
+
+    # Tables of the arrests workbook to extract, by sheet. 'rows' is what the first column of the table holds,
+    # 'sections' what the headings between blocks of rows hold and 'columns' what each row of the column headers
+    # holds, from the top. A_01a is in thousands to three decimal places. A_04 only has proportions and rates of the
+    # A_01c numbers so it's left out
+
+    arrests_tables = {
+        "A_01a": {"rows": "Year", "columns": ["Sex"], "scale": 1000},
+        "A_01b": {"rows": "Year", "columns": ["Sex", "Age group"]},
+        "A_01c": {"rows": "Year", "columns": ["Sex", "Ethnicity"]},
+        "A_02": {"rows": "Year", "sections": "Sex", "columns": ["Offence group"]},
+        "A_03": {
+            "rows": "Offence group",
+            "sections": "Year",
+            "columns": ["Sex", "Age group"],
+        },
+        "A_05": {"rows": "Police Force Area", "columns": ["Sex", "Year"]},
+        "A_06": {"rows": "Police Force Area", "columns": ["Sex", "Age group"]},
+        "A_07": {"rows": "Police Force Area", "columns": ["Offence group"]},
+        "A_08": {"rows": "Police Force Area", "columns": ["Year", "Ethnicity"]},
+    }
+
+    # Columns of the tidy arrests store; a table that isn't broken down by one of these has "All" for it
+
+    arrests_dtypes = {
+        "Table": "category",
+        "Year": "int16",
+        "Police Force Area": "category",
+        "Sex": "category",
+        "Age group": "category",
+        "Offence group": "category",
+        "Ethnicity": "category",
+        "Arrests": "int64",
+    }
 
     @classmethod
-    def make_arrests_dataframe(cls):
+    def make_arrests_dataframe(cls, denominators=None):
         """
         Combines population data and arrests data for graphing in plotly.
         Also creates values for arrests per 1,000 people and adjusted values expressing how many people in different
@@ -27,28 +102,25 @@ class DashBLM:
         https://assets.publishing.service.gov.uk/government/uploads/system/uploads/attachment_data/file/841253/arrest-police-powers-procedures-mar19-hosb2519-tables.ods
         https://www.ons.gov.uk/file?uri=%2fpeoplepopulationandcommunity%2fpopulationandmigration%2fpopulationestimates%2fdatasets%2fpopulationestimatesforukenglandandwalesscotlandandnorthernireland%2fmid2001tomid2018detailedtimeseries/ukpopulationestimates18382018.xlsx
         Writes out correctly formatted dataframes to csv.
+        :param denominators: optional dataframe from make_denominator_table, which is built when it isn't given.
         """
 
-        # Import arrests data
+        # Import arrests data; the A_01c sheet is for overall arrests by ethnicity. Its headers are found in the sheet
+        # rather than relying on where they are
 
         path = str(pathlib.Path.cwd())
-        df = pd.read_excel(
+        sheet = pd.read_excel(
             path + "/data/" + cls.arrests_filename,
-            sheet_name=3,
-            engine="odf",  # this sheet is for overall arrests
+            sheet_name="A_01c",
+            engine="odf",
+            header=None,
         )
+        _, df = cls.read_arrests_table(sheet)
 
-        columns = ["Year"]
-
-        for x in range(1, len(df.columns)):
-            columns.append(df.iloc[3][x])
-
-        df.columns = columns
-
-        # This slices the table so we get just the relevant data
-
-        df_clean = df.loc[5:17]
+        df_clean = df.loc[""].droplevel(0, axis=1).reset_index()
+        df_clean.columns = ["Year"] + df_clean.columns[1:].tolist()
         df_clean["Year"] = df_clean["Year"].str.extract(r"^(\d{4})")
+        df_clean = df_clean.dropna(subset=["Year"])
 
         # Assign correct datatypes
 
@@ -56,167 +128,542 @@ class DashBLM:
         dtypes = {key: "int" for key in index[:]}
         df_clean = df_clean.astype(dtypes)
 
-        # Prepare dataframe from graphing in plotly
+        # Get the arrests of each ethnic group nationally along with how many people are in that group that year.
+        # Arrests are counted by financial year, which is matched with the population in the middle of its first year
 
-        rows = [[i for i in row] for row in df_clean.itertuples()]
-        rows_flat = [y for x in rows for y in x]
+        dff = cls.tidy_arrests_table("A_01c", sheet)
+        dff = dff[
+            (dff["Sex"] == "All")
+            & dff["Ethnicity"].isin(["White", "Black", "Asian", "Mixed"])
+        ]
+        dff = dff[["Ethnicity", "Arrests", "Year"]].astype(
+            {"Ethnicity": str, "Year": int}
+        )
+        dff["Area"] = "National"
+        if denominators is None:
+            denominators = cls.make_denominator_table()
+        dff = cls.join_denominators(dff, denominators)
+        dff["Arrests per 1k"] = (dff["Arrests"] / dff["Population"] * 1000).round(1)
 
-        arrests = [(x[2:6]) for x in rows]
-        arrests = [y for x in arrests for y in x]
+        # Now create the proportional equivalents
+        # i.e if everyone was arrested at the same rate as white people, how many arrests would there be?
 
-        dff = pd.DataFrame(
-            {
-                "Ethnicity": ["White", "Black Actual", "Asian Actual", "Mixed Actual"]
-                * 13,
-                "Arrests": arrests,
-                "Year": rows_flat[1::9] * 4,
-            }
+        white = dff[dff["Ethnicity"] == "White"].set_index("Year")
+        df_proportions = dff[dff["Ethnicity"] != "White"].copy()
+        df_proportions["Arrests"] = (
+            df_proportions["Year"].map(white["Arrests"] / white["Population"])
+            * df_proportions["Population"]
         )
+        df_proportions["Arrests per 1k"] = df_proportions["Year"].map(
+            white["Arrests per 1k"]
+        )
+        df_proportions["Ethnicity"] += " Adjusted"
 
-        # Import population data
+        minorities = dff["Ethnicity"] != "White"
+        dff.loc[minorities, "Ethnicity"] = dff.loc[minorities, "Ethnicity"] + " Actual"
 
-        path = str(pathlib.Path.cwd())
-        df_pop = pd.read_excel(
-            path + "/data/" + cls.pop_filename, sheet_name=3
-        )  # this gets population estimates sheet
-        df_pop = df_pop.iloc[
-            4:17, :2
-        ]  # filters out years for which there are no arrests data
-        df_pop.columns = ["Year", "Population"]
-        df_pop = df_pop.astype({"Year": "str", "Population": "int"})
+        # Now combine this all into one dataframe that we will use to graph in plotly
 
-        # Slightly restructure the population dataframe so it's usable for processing later
+        filtered_df = pd.concat([dff, df_proportions], ignore_index=True)
+        filtered_df = filtered_df[["Ethnicity", "Arrests", "Year", "Arrests per 1k"]]
+        filtered_df = filtered_df.astype({"Arrests": float})
+        filtered_df.sort_values(["Ethnicity", "Year"], inplace=True)
 
-        df_pop = df_pop.loc[np.repeat(df_pop.index.values, 3)]
-        df_pop.sort_values(by=["Year"], ascending=True, inplace=True)
+        # Write out dataframes to csv
 
-        # Now create the proportional equivalents
-        # i.e if everyone was arrested the same amount as white people, how many arrests would there be?
+        df_clean.to_csv("df_clean.csv")
+        filtered_df.to_csv("filtered_df.csv")
 
-        ethnic_breakdown = {
-            "Asian": 0.075,
-            "Black": 0.033,
-            "Mixed": 0.022,
-            "White": 0.86,
-        }
-        white_arrests = arrests[0::4]
-        arrests_proportions = []
-
-        for counter, x in enumerate(white_arrests):
-            whiteness = x / df_pop["Population"].iloc[counter]
-            black_proportion = whiteness * ethnic_breakdown["Black"]
-            asian_proportion = whiteness * ethnic_breakdown["Asian"]
-            mixed_proportion = whiteness * ethnic_breakdown["Mixed"]
-            black_value = black_proportion * df_pop["Population"].iloc[counter]
-            asian_value = asian_proportion * df_pop["Population"].iloc[counter]
-            mixed_value = mixed_proportion * df_pop["Population"].iloc[counter]
-            arrests_proportions.append(black_value)
-            arrests_proportions.append(asian_value)
-            arrests_proportions.append(mixed_value)
-
-        # Now work out arrests per 1k for the proportions data
-
-        arrests_per_1k = []
-        asian_arrests = arrests_proportions[1::3]
-        black_arrests = arrests_proportions[0::3]
-        mixed_arrests = arrests_proportions[2::3]
-        counter = -1
-
-        for x, y, z in zip(asian_arrests, black_arrests, mixed_arrests):
-            counter += 1
-            asian_per_1k = round(
-                (x / (ethnic_breakdown["Asian"] * df_pop["Population"].iloc[counter]))
-                * 1000,
-                1,
-            )
-            arrests_per_1k.append(asian_per_1k)
-            black_per_1k = round(
-                (y / (ethnic_breakdown["Black"] * df_pop["Population"].iloc[counter]))
-                * 1000,
-                1,
-            )
-            arrests_per_1k.append(black_per_1k)
-            mixed_per_1k = round(
-                (z / (ethnic_breakdown["Mixed"] * df_pop["Population"].iloc[counter]))
-                * 1000,
-                1,
-            )
-            arrests_per_1k.append(mixed_per_1k)
+        return None
 
-        # Make a dataframe capturing all this proportional data
+    @staticmethod
+    def read_population_table(df):
+        """
+        Reads the total population for each year from one of the tables of the ONS population estimates workbook,
+        filling in any years the table skips by interpolating between the years either side.
+        :param df: dataframe of the sheet, read without a header.
+        :return: series of the population indexed by year.
+        """
+
+        header = np.flatnonzero(df.iloc[:, 0].astype(str).str.strip() == "Year")[0]
+        persons = df.iloc[header].tolist().index("Persons")
+        years = df.iloc[header + 1 :, 0].astype(str).str.extract(r"^Mid-(\d{4})")[0]
+        rows = years.notna().to_numpy()
+
+        population = pd.Series(
+            pd.to_numeric(df.iloc[header + 1 :, persons][rows]).to_numpy(),
+            index=years[rows].astype(int).to_numpy(),
+        ).sort_index()
+
+        return population.reindex(
+            range(population.index.min(), population.index.max() + 1)
+        ).interpolate()
+
+    @classmethod
+    def make_denominator_table(cls):
+        """
+        Estimates how many people of each broad ethnic group lived in every LAD (Local Area District), and in England
+        and Wales as a whole, in every year the ONS has population estimates for. The census gives the number in each
+        group in each district in its year; for other years those are scaled by how much the population of England,
+        or Wales, or both together, had grown or shrunk since.
+        :return: dataframe with a row per Year, Area and Ethnicity and the Population. Area is the LAD name or
+        'National', Ethnicity is a broad ethnic group or 'All'.
+        """
+
+        path = str(pathlib.Path.cwd()) + "/data/"
 
-        ethnic_proportions = ["Black Adjusted", "Asian Adjusted", "Mixed Adjusted"] * 13
-        years = [element for element in rows_flat[1::9] for _ in range(3)]
-        df_proportions = pd.DataFrame(
+        # The number of people in each broad ethnic group per district at the census
+
+        df_census = cls.read_filtered_csv(
+            path + cls.ethnic_pops_data,
+            usecols=[
+                "Measure",
+                "Time",
+                "Geography_name",
+                "Geography_code",
+                "Ethnicity",
+                "Numerator",
+                "Denominator",
+            ],
+            filters={
+                "Measure": ["% of local population in this ethnic group"],
+                "Ethnicity": ["Asian", "Black", "Mixed", "White", "Other"],
+            },
+        )
+        df_census["Ethnicity"] = df_census["Ethnicity"].astype(str)
+        df_census["Country"] = df_census["Geography_code"].str[0]
+        df_everyone = df_census.drop_duplicates("Geography_name").assign(
+            Ethnicity="All", Numerator=lambda x: x["Denominator"]
+        )
+        df_census = pd.concat([df_census, df_everyone], ignore_index=True)
+        df_census = df_census.rename(
+            columns={"Geography_name": "Area", "Time": "Census", "Numerator": "Count"}
+        )[["Area", "Country", "Census", "Ethnicity", "Count"]]
+        df_national = df_census.groupby(["Census", "Ethnicity"], as_index=False)[
+            "Count"
+        ].sum()
+        df_national["Area"] = "National"
+        df_national["Country"] = "National"
+        df_census = pd.concat([df_census, df_national], ignore_index=True)
+
+        # How much each country's population had changed by each year relative to the census year
+
+        tables = pd.read_excel(
+            path + cls.pop_filename,
+            sheet_name=list(cls.population_tables.values()),
+            header=None,
+        )
+        df_growth = pd.concat(
+            [
+                cls.read_population_table(tables[table])
+                .rename_axis("Year")
+                .rename("Total")
+                .reset_index()
+                .assign(Country=country)
+                for country, table in cls.population_tables.items()
+            ],
+            ignore_index=True,
+        )
+        years = df_growth.groupby("Country")["Year"].agg(["min", "max"])
+        df_growth = df_growth[
+            df_growth["Year"].between(years["min"].max(), years["max"].min())
+        ]
+        df_denominators = pd.merge(df_census, df_growth, on="Country")
+        census_totals = df_growth.set_index(["Country", "Year"])["Total"]
+        df_denominators["Population"] = (
+            df_denominators["Count"]
+            * df_denominators["Total"]
+            / census_totals.reindex(
+                pd.MultiIndex.from_frame(df_denominators[["Country", "Census"]])
+            ).to_numpy()
+        ).round()
+
+        return (
+            df_denominators[["Year", "Area", "Ethnicity", "Population"]]
+            .astype({"Population": "int64"})
+            .sort_values(["Area", "Ethnicity", "Year"])
+            .reset_index(drop=True)
+        )
+
+    @classmethod
+    def make_denominators(cls, denominators=None):
+        """
+        Writes out the denominators table from make_denominator_table to csv, for working out rates by year, area and
+        ethnic group.
+        :param denominators: optional dataframe from make_denominator_table, which is built when it isn't given.
+        """
+
+        if denominators is None:
+            denominators = cls.make_denominator_table()
+        denominators.to_csv("df_denominators.csv", index=False)
+
+        return None
+
+    @staticmethod
+    def join_denominators(df, denominators):
+        """
+        Adds how many people there were of each row's ethnic group in its area and year, all in one merge. Years
+        outside the ones the denominators cover get the nearest year's population.
+        :param df: dataframe with Year, Area and Ethnicity columns.
+        :param denominators: dataframe from make_denominator_table.
+        :return: a copy of df with a Population column, which is missing for areas or groups with no denominators.
+        """
+
+        keys = df[["Year", "Area", "Ethnicity"]].astype({"Year": "int64"})
+        keys["Year"] = keys["Year"].clip(
+            denominators["Year"].min(), denominators["Year"].max()
+        )
+        population = pd.merge(keys, denominators, on=keys.columns.tolist(), how="left")
+
+        return df.assign(Population=population["Population"].to_numpy())
+
+    @staticmethod
+    def disparity_table(df, method="poisson", draws=2000, seed=0):
+        """
+        Works out how many times as likely each group is as white people to be arrested, searched etc. for every
+        row of a table of counts at once, with 95% confidence intervals. The intervals treat each count as a Poisson
+        variable and the populations as known; 'poisson' uses the usual log rate ratio interval and 'bootstrap' draws
+        every count again and again in one go and takes the quantiles of the ratios.
+        :param df: dataframe with Dataset, Year, Area, Ethnicity, Count and Population columns, with a White row
+        for each dataset, year and area.
+        :param method: string, 'poisson' or 'bootstrap'.
+        :param draws: int, number of bootstrap draws.
+        :param seed: int, seed for the bootstrap draws.
+        :return: dataframe of the non-white rows with Rate (per 1,000 people), Ratio, Lower, Upper and Rank (1 for
+        the group most disproportionately affected in each dataset, year and area) columns added.
+        """
+
+        keys = ["Dataset", "Year", "Area"]
+        white = df.loc[df["Ethnicity"] == "White", keys + ["Count", "Population"]]
+        df = pd.merge(
+            df[df["Ethnicity"] != "White"], white, on=keys, suffixes=("", " White"),
+        )
+        df = df.dropna(subset=["Population", "Population White"])
+
+        count, population = (
+            df["Count"].to_numpy(float),
+            df["Population"].to_numpy(float),
+        )
+        white_count = df["Count White"].to_numpy(float)
+        white_population = df["Population White"].to_numpy(float)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = (count / population) / (white_count / white_population)
+
+            if method == "bootstrap":
+                rng = np.random.default_rng(seed)
+                counts = rng.poisson(count[:, None], (len(df), draws))
+                white_counts = rng.poisson(white_count[:, None], (len(df), draws))
+                ratios = (counts / population[:, None]) / (
+                    white_counts / white_population[:, None]
+                )
+                lower, upper = np.nanquantile(ratios, [0.025, 0.975], axis=1)
+            else:
+                error = 1.959964 * np.sqrt(1 / count + 1 / white_count)
+                lower, upper = ratio * np.exp(-error), ratio * np.exp(error)
+
+        df = df.drop(columns=["Count White", "Population White"]).assign(
+            Rate=count / population * 1000, Ratio=ratio, Lower=lower, Upper=upper
+        )
+        df["Rank"] = (
+            df.groupby(keys)["Ratio"].rank(method="first", ascending=False).astype(int)
+        )
+
+        return df.sort_values(keys + ["Rank"]).reset_index(drop=True)
+
+    @classmethod
+    def make_disparities(cls, method="poisson", denominators=None):
+        """
+        Works out how many times as likely black, asian and mixed people are as white people to be arrested each
+        year, and to be stopped and searched each year in every LAD and nationally, with confidence intervals. The
+        app reads these straight out of the table rather than working any of them out when someone asks.
+        'Other' is left out as the arrests data counts chinese people as other while the census counts them as asian.
+        Writes out disparities dataframe to csv.
+        :param method: string, how to work out the confidence intervals, see disparity_table.
+        :param denominators: optional dataframe from make_denominator_table, which is built when it isn't given.
+        """
+
+        path = str(pathlib.Path.cwd()) + "/data/"
+        groups = ["White", "Black", "Asian", "Mixed"]
+
+        # Arrests per year nationally
+
+        sheet = pd.read_excel(
+            path + cls.arrests_filename, sheet_name="A_01c", engine="odf", header=None
+        )
+        df_arrests = cls.tidy_arrests_table("A_01c", sheet)
+        df_arrests = df_arrests[
+            (df_arrests["Sex"] == "All") & df_arrests["Ethnicity"].isin(groups)
+        ]
+        df_arrests = pd.DataFrame(
             {
-                "Ethnicity": ethnic_proportions,
-                "Arrests": arrests_proportions,
-                "Year": years,
-                "Arrests per 1k": arrests_per_1k,
+                "Dataset": "Arrests",
+                "Year": df_arrests["Year"].astype(int),
+                "Area": "National",
+                "Ethnicity": df_arrests["Ethnicity"].astype(str),
+                "Count": df_arrests["Arrests"],
             }
         )
 
-        # Now add values for arrests per 1,000 people in different ethnic groups
+        # Stop and searches per year nationally and per district
 
-        dff.sort_values(by=["Year", "Ethnicity"], inplace=True)
+        df_searches = cls.count_stopsearches()
+        df_searches = df_searches[df_searches["Ethnicity"].isin(groups)]
+        df_searches = (
+            df_searches.assign(Year=df_searches["Month"].str[:4].astype(int))
+            .groupby(["Year", "Area", "Ethnicity"], as_index=False)["Searches"]
+            .sum()
+            .rename(columns={"Searches": "Count"})
+            .assign(Dataset="Stop and search")
+        )
 
-        actual_arrests_per_1k = []
-        counter = -1
+        df_counts = pd.concat([df_arrests, df_searches], ignore_index=True)
+        if denominators is None:
+            denominators = cls.make_denominator_table()
+        df_counts = cls.join_denominators(df_counts, denominators)
+        df_disparities = cls.disparity_table(df_counts, method=method)
 
-        for index, group in dff.groupby(np.arange(len(dff)) // 4):
-            counter += 1
+        # Write out dataframe to csv
 
-            asian_per_1k = round(
-                (
-                    group["Arrests"].iloc[0]
-                    / (ethnic_breakdown["Asian"] * df_pop["Population"].iloc[counter])
-                )
-                * 1000,
-                1,
-            )
-            actual_arrests_per_1k.append(asian_per_1k)
-            black_per_1k = round(
-                (
-                    group["Arrests"].iloc[1]
-                    / (ethnic_breakdown["Black"] * df_pop["Population"].iloc[counter])
-                )
-                * 1000,
-                1,
-            )
-            actual_arrests_per_1k.append(black_per_1k)
-            mixed_per_1k = round(
-                (
-                    group["Arrests"].iloc[2]
-                    / (ethnic_breakdown["Mixed"] * df_pop["Population"].iloc[counter])
-                )
-                * 1000,
-                1,
-            )
-            actual_arrests_per_1k.append(mixed_per_1k)
-            white_per_1k = round(
-                (
-                    group["Arrests"].iloc[3]
-                    / (ethnic_breakdown["White"] * df_pop["Population"].iloc[counter])
-                )
-                * 1000,
-                1,
+        df_disparities.to_csv("df_disparities.csv", index=False)
+
+        return None
+
+    @staticmethod
+    def strip_footnote(label):
+        """
+        Strips the footnote numbers the arrests workbook puts on the end of labels, e.g. 'Lancashire2'.
+        :param label: a cell from the workbook.
+        :return: string.
+        """
+
+        return re.sub(r"(?<=[A-Za-z)])\d[\d, ]*$", "", str(label).strip())
+
+    @classmethod
+    def read_arrests_table(cls, df):
+        """
+        Reads one table from the arrests workbook, working out where its headers and rows are from the sheet itself.
+        Every sheet has a title, then a units line ending 'England and Wales', then one or more rows of column headers
+        and then the rows of the table, which can be split up by headings in the first column, and finally a source
+        line and notes.
+        :param df: dataframe of the sheet, read without a header.
+        :return: tuple of the table title and a dataframe with a row for each row of the table, indexed by the heading
+        above it ('' if there isn't one) and its label, and a column for each column of the table, labelled by each
+        row of the headers. Values the workbook doesn't have are missing; '-', meaning none, is 0.
+        """
+
+        df = df.apply(
+            lambda column: column.map(
+                lambda x: x.strip() or np.nan if isinstance(x, str) else x
             )
-            actual_arrests_per_1k.append(white_per_1k)
+        )
 
-        dff["Arrests per 1k"] = actual_arrests_per_1k
+        labels = df.iloc[:, 0]
+        cells = df.iloc[:, 1:]
+        filled = cells.notna().any(axis=1).to_numpy()
+        numeric = (
+            cells.applymap(lambda x: isinstance(x, (int, float))) & cells.notna()
+        ).any(axis=1)
+
+        # The headers sit between the units line and the first row of numbers, and the rows run until the source
+
+        units = np.flatnonzero(
+            df.applymap(lambda x: str(x).startswith("England and Wales")).any(axis=1)
+        )[0]
+        first = np.flatnonzero(numeric & (np.arange(len(df)) > units))[0]
+        headers = [
+            row for row in range(units + 1, first) if filled[row] and numeric[row] == 0
+        ]
+        end = next(
+            (
+                row
+                for row in range(first, len(df))
+                if str(labels.iloc[row]).startswith("Source")
+            ),
+            len(df),
+        )
 
-        # Now combine this all into one dataframe that we will use to graph in plotly
+        # Header cells are merged across the columns they cover, so each one is carried on to the right
 
-        filtered_df = pd.concat([dff, df_proportions])
-        filtered_df.sort_values(["Ethnicity", "Year"], inplace=True)
+        header = cells.iloc[headers].copy()
+        header.iloc[:-1] = header.iloc[:-1].ffill(axis=1)
+        columns = pd.MultiIndex.from_arrays(
+            [
+                [cls.strip_footnote(x) if pd.notna(x) else "" for x in level]
+                for level in header.to_numpy()
+            ]
+        )
 
-        # Write out dataframes to csv
+        # Rows with a label and nothing else are headings for the rows below them
 
-        df_clean.to_csv("df_clean.csv")
-        filtered_df.to_csv("filtered_df.csv")
+        index, rows, section = [], [], ""
+        for row in range(headers[-1] + 1, end):
+            if pd.isna(labels.iloc[row]):
+                continue
+            if not filled[row]:
+                section = cls.strip_footnote(labels.iloc[row])
+                continue
+            index.append((section, cls.strip_footnote(labels.iloc[row])))
+            rows.append(row)
+
+        table = cells.iloc[rows].replace("-", 0).apply(pd.to_numeric, errors="coerce")
+        table.columns = columns
+        table.index = pd.MultiIndex.from_tuples(index)
+
+        return str(labels.iloc[0]), table
+
+    @staticmethod
+    def arrests_label(dimension, label):
+        """
+        Turns a label from the arrests workbook into the value stored for it, so the same group is called the same
+        thing in every table.
+        :param dimension: string, one of the arrests store columns.
+        :param label: string, the label with any footnote stripped.
+        :return: the value, or None for a label that isn't one, e.g. a rate column, or a region.
+        """
+
+        if dimension == "Year":
+            year = re.match(r"^(\d{4})/\d{2}", label)
+            return int(year.group(1)) if year else None
+
+        if dimension == "Police Force Area":
+            if label.endswith("Region") or label in ("ENGLAND", "WALES", ""):
+                return None
+            return "All" if label == "ENGLAND AND WALES" else label
+
+        prefixes = {
+            "Sex": [("Males", "Male"), ("Females", "Female"), ("Persons", "All")],
+            "Age group": [
+                ("Under 10", "Under 10"),
+                ("Aged 10-17", "10-17"),
+                ("Aged 18-20", "18-20"),
+                ("Aged 21", "21 and over"),
+                ("Age unknown", "Unknown"),
+            ],
+            "Ethnicity": [
+                ("White", "White"),
+                ("Black", "Black"),
+                ("Asian", "Asian"),
+                ("Mixed", "Mixed"),
+                ("Chinese or Other", "Other"),
+                ("Not stated", "Not stated"),
+            ],
+            "Offence group": [("Misc", "Miscellaneous crimes against society")],
+        }[dimension]
+
+        if label.startswith("Total") or label == "All Persons":
+            return "All"
+        for prefix, value in prefixes:
+            if label.startswith(prefix):
+                return value
+
+        # Offence groups are called the same in every table apart from the last one
+
+        return label if dimension == "Offence group" and label else None
+
+    @classmethod
+    def tidy_arrests_table(cls, sheet, df):
+        """
+        Turns a table from the arrests workbook into the long format of the arrests store, with a row per number.
+        :param sheet: string, name of the sheet.
+        :param df: dataframe of the sheet, read without a header.
+        :return: dataframe with the arrests store columns.
+        """
+
+        spec = cls.arrests_tables[sheet]
+        title, table = cls.read_arrests_table(df)
+        levels = [spec.get("sections", "Section"), spec["rows"]] + spec["columns"]
+        table.index.names = levels[:2]
+        table.columns.names = levels[2:]
+
+        if table.columns.nlevels == 1:
+            table.columns = table.columns.get_level_values(0)
+        df = table.stack(levels[2:]).rename("Arrests")
+        df = df.dropna().reset_index()
+
+        # Turn the labels into values, dropping any row or column of the table that isn't arrests
+
+        keep = np.ones(len(df), dtype=bool)
+        for dimension in levels:
+            if dimension in cls.arrests_dtypes:
+                labels = df[dimension].map(lambda x: cls.arrests_label(dimension, x))
+                df[dimension] = labels
+                keep &= labels.notna().to_numpy()
+        df = df[keep]
+
+        # Tables for a single year only say which in their title
+
+        if "Year" not in levels:
+            df["Year"] = int(re.findall(r"(\d{4})/\d{2}", title)[-1])
+
+        df["Arrests"] = (df["Arrests"] * spec.get("scale", 1)).round()
+        df["Table"] = sheet
+        for column in cls.arrests_dtypes:
+            if column not in df:
+                df[column] = "All"
+
+        return df[list(cls.arrests_dtypes)].astype(cls.arrests_dtypes)
+
+    @classmethod
+    def make_arrests_store(cls):
+        """
+        Extracts every table of arrests by year, sex, age group, offence group, ethnicity and police force area from
+        the arrests workbook into one long table, so arrests by force can be graphed straight from it.
+        Writes out the arrests store to csv.
+        """
+
+        # The .ods reader parses the whole workbook whichever sheets are asked for, so they're all read in one go
+
+        sheets = pd.read_excel(
+            str(pathlib.Path.cwd()) + "/data/" + cls.arrests_filename,
+            sheet_name=list(cls.arrests_tables),
+            engine="odf",
+            header=None,
+        )
+        tables = [cls.tidy_arrests_table(sheet, df) for sheet, df in sheets.items()]
+
+        df_arrests = pd.concat(tables, ignore_index=True).astype(cls.arrests_dtypes)
+        df_arrests.to_csv("df_arrests.csv", index=False)
 
         return None
 
+    @classmethod
+    def read_arrests_store(cls, filename):
+        """
+        Reads the arrests store written out by make_arrests_store with its types.
+        :param filename: string, path to df_arrests.csv.
+        :return: dataframe.
+        """
+
+        return pd.read_csv(filename, dtype=cls.arrests_dtypes)
+
+    @staticmethod
+    def read_filtered_csv(filename, usecols, filters, required=(), chunksize=50000):
+        """
+        Reads only the rows of a csv file that match some filters, a chunk at a time, so the full file is never in
+        memory; this keeps working for ward or force level releases far bigger than the ones used here. The filter
+        columns are parsed straight into categories made of just the wanted values, which turns every other value
+        into a missing one that can be dropped without any string comparisons.
+        :param filename: string, path to the csv file.
+        :param usecols: list of the columns to keep, including the filter columns.
+        :param filters: dict of column name to a list of the values to keep.
+        :param required: list of columns that rows without a value in are dropped, e.g. the value being graphed.
+        :param chunksize: int, number of rows to read at a time.
+        :return: dataframe of the matching rows, with the filter columns as categoricals.
+        """
+
+        dtype = {
+            column: pd.CategoricalDtype(values) for column, values in filters.items()
+        }
+        chunks = [
+            chunk.dropna(subset=list(filters) + list(required))
+            for chunk in pd.read_csv(
+                filename, usecols=usecols, dtype=dtype, chunksize=chunksize
+            )
+        ]
+
+        return pd.concat(chunks, ignore_index=True)
+
     @classmethod
     def make_choropleth_inputs(cls):
         """
@@ -224,51 +671,77 @@ class DashBLM:
         (Local Area Districts) in England and Wales.
         Data source - https://github.com/martinjc/UK-GeoJSON. See format-geojson.py script for more info.
         Writes out black population dataframe to csv and local area ids dataframe to csv (i.e. the local area names).
-        :return: mapbox token, geojson data for districts in England and Wales.
+        Also writes out every ethnicity's share per district as a matrix with a row per district and a column per
+        ethnicity, so the app can switch which group the map is coloured by without any processing.
+        The app reads the mapbox token and geojson itself, see read_mapbox_token and geojson_url.
         """
 
-        # Get mapbox token
-
-        token = open(".mapbox_token").read()
-
-        # Get geojson
+        # Get ethnic population breakdowns; other measures are irrelevant
 
         path = str(pathlib.Path.cwd())
-        with open(path + "/data/" + cls.geojson_filename, "r") as f:
-            geojson = json.load(f)
 
-        # Get ethnic population breakdowns
-
-        df = pd.read_csv(
+        df = cls.read_filtered_csv(
             path + "/data/" + cls.ethnic_pops_data,
             usecols=["Measure", "Geography_name", "Ethnicity", "Value"],
+            filters={"Measure": ["% of national ethnic population in this LA area"]},
         )
-        df = df.astype({"Measure": "category", "Ethnicity": "category"})
-        df = df.loc[
-            df["Measure"] == "% of national ethnic population in this LA area"
-        ]  # other rows irrelevant
-        df = df.loc[
+        df["Ethnicity"] = df["Ethnicity"].astype(str)
+
+        # Get the total percentage of black people per district
+
+        df_black = df[
             df["Ethnicity"].isin(
                 ["Black", "Black African", "Black Caribbean", "Black Other"]
             )
         ]
-
-        # Get the total percentage of black people per district
-
-        df_blackpops = df.groupby("Geography_name")["Value"].sum()
+        df_blackpops = df_black.groupby("Geography_name")["Value"].sum()
 
         # Get all the districts
 
-        ethnic_local_authorities = df["Geography_name"].unique().tolist()
+        ethnic_local_authorities = df_black["Geography_name"].unique().tolist()
 
         df_ids = pd.DataFrame({"ids": sorted(ethnic_local_authorities)})
 
+        # Pivot every ethnicity out into a column, in the same district order as the ids
+
+        df_ethnic_shares = df.pivot_table(
+            index="Geography_name", columns="Ethnicity", values="Value", aggfunc="sum"
+        ).reindex(df_ids["ids"])
+        df_ethnic_shares.index.name = "Geography_name"
+        df_ethnic_shares.columns.name = None
+
         # Write out dataframes to csv
 
         df_blackpops.to_csv("df_blackpops.csv")
         df_ids.to_csv("df_ids.csv")
+        df_ethnic_shares.to_csv("df_ethnic_shares.csv")
+
+        return None
 
-        return token, geojson
+    @staticmethod
+    def read_mapbox_token(filename=".mapbox_token"):
+        """
+        Reads the mapbox token used to draw the map tiles.
+        :param filename: string, path to the file holding the token.
+        :return: the token as a string, or None if there isn't one.
+        """
+
+        try:
+            with open(filename, "r") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def geojson_url(cls, route="/geojson/"):
+        """
+        The geojson for the choropleth is served as its own file rather than embedded in the figure, so the browser
+        downloads the district boundaries once and caches them. Plotly accepts a url in place of the geojson itself.
+        :param route: string, the route the app serves files in the data directory from.
+        :return: url of the geojson file relative to the app.
+        """
+
+        return route + cls.geojson_filename
 
     def make_scattermapbox_inputs(cls):
         """
@@ -276,48 +749,29 @@ class DashBLM:
         on top of the choropleth map.
         Data source - https://data.police.uk/.
         Writes out scattermapbox dataframe to csv.
+        :return: the scattermapbox dataframe, so make_density_inputs can be built from the same searches.
         """
 
-        with open(cls.stopsearch_filename, "r") as f:
-            stopsearchdata = json.load(f)
-
-        # Create arrays of the values to graph
+        # Create arrays of the values to graph, reading the results a record at a time
 
-        lats = [
-            (date, stopsearch["location"]["latitude"])[1]
-            for date in stopsearchdata["results"]
-            for stopsearch in stopsearchdata["results"][date]
-        ]
-
-        longs = [
-            (date, stopsearch["location"]["longitude"])[1]
-            for date in stopsearchdata["results"]
-            for stopsearch in stopsearchdata["results"][date]
-        ]
-
-        reason = [
-            (date, stopsearch["object_of_search"])[1]
-            for date in stopsearchdata["results"]
-            for stopsearch in stopsearchdata["results"][date]
-        ]
+        df = pd.DataFrame(
+            [
+                cls.stopsearch_row(date, stopsearch)
+                for date, stopsearch in read_results(cls.stopsearch_filename)
+            ],
+            columns=cls.stopsearch_columns,
+        )
 
-        ethnicity = [
-            (date, stopsearch["self_defined_ethnicity"])[1]
-            for date in stopsearchdata["results"]
-            for stopsearch in stopsearchdata["results"][date]
-        ]
+        # The same search can come back for neighbouring LADs so only keep it once
 
-        age_range = [
-            (date, stopsearch["age_range"])[1]
-            for date in stopsearchdata["results"]
-            for stopsearch in stopsearchdata["results"][date]
-        ]
+        df = df[RecordIndex().keep_new(df, df["LAD"])]
 
-        gender = [
-            (date, stopsearch["gender"])[1]
-            for date in stopsearchdata["results"]
-            for stopsearch in stopsearchdata["results"][date]
-        ]
+        lats = df["Latitude"].tolist()
+        longs = df["Longitude"].tolist()
+        reason = df["Object of search"].tolist()
+        ethnicity = df["Ethnicity"].tolist()
+        age_range = df["Age range"].tolist()
+        gender = df["Gender"].tolist()
 
         # Assigning numeric values to different ethnicity categories so they show up in different sizes
         # Setting None values to 21 which is the White value since this is the largest group
@@ -379,35 +833,399 @@ class DashBLM:
             "size": size,
             "color": color,
         }
-        df = pd.DataFrame.from_dict(constructordict)
+        df = pd.DataFrame.from_dict(constructordict).astype(cls.scatter_dtypes)
 
         # Write out dataframe to csv
 
         df.to_csv("df_scatter.csv")
 
+        return df
+
+    @classmethod
+    def read_scatter_dataframe(cls, filename):
+        """
+        Reads the scattermapbox data written out by make_scattermapbox_inputs using compact types, which takes
+        about a tenth of the memory of the pandas defaults.
+        :param filename: string, path to df_scatter.csv.
+        :return: dataframe.
+        """
+
+        return pd.read_csv(
+            filename, usecols=list(cls.scatter_dtypes), dtype=cls.scatter_dtypes
+        )
+
+    @staticmethod
+    def spatial_stream_order(lats, longs, resolution=0.1, seed=0):
+        """
+        Orders map points so that the first few of them are spread over the whole map: one search from every cell of
+        a grid, busiest cells first, then a second from every cell that has one, and so on. Sending the points in this
+        order lets the map show a fair sample of everywhere straight away and fill in from there.
+        :param lats: array of latitudes.
+        :param longs: array of longitudes.
+        :param resolution: float, cell size in degrees.
+        :param seed: int, seed for picking which search in a cell goes first.
+        :return: int array of row positions in the order to send them.
+        """
+
+        shuffle = np.random.default_rng(seed).permutation(len(lats))
+        cells = pd.DataFrame(
+            {
+                "lat": np.floor(np.asarray(lats)[shuffle] / resolution),
+                "lon": np.floor(np.asarray(longs)[shuffle] / resolution),
+            }
+        )
+        grouped = cells.groupby(["lat", "lon"], sort=False)
+        turn = grouped.cumcount().to_numpy()
+        searches = grouped["lat"].transform("size").to_numpy()
+
+        return shuffle[np.lexsort((-searches, turn))]
+
+    @classmethod
+    def make_density_inputs(cls, df_scatter=None):
+        """
+        Bins the stop search points used by the scattermapbox into square cells at several sizes, counting the
+        searches in each cell by ethnicity. The app can draw these as a heatmap whose cost depends on the number of
+        cells rather than the number of searches.
+        Writes out density dataframe to csv.
+        :param df_scatter: optional dataframe from make_scattermapbox_inputs. When it isn't given the scattermapbox
+        data the app is serving, in the data directory, is binned instead.
+        """
+
+        if df_scatter is None:
+            path = str(pathlib.Path.cwd()) + "/data/"
+            df_scatter = cls.read_scatter_dataframe(path + "df_scatter.csv")
+
+        # The hover text holds the self defined ethnicity, the first word of which is the broad ethnic group
+
+        df = df_scatter.assign(
+            Ethnicity=df_scatter["text"]
+            .str.extract(r"Ethnicity: (\w+)", expand=False)
+            .replace("None", "Not stated")
+        )
+
+        # Snap every point to the centre of its cell and count searches per cell for each cell size
+
+        cells = []
+
+        for resolution in cls.density_resolutions:
+            lat = (np.floor(df["lats"] / resolution) + 0.5) * resolution
+            lon = (np.floor(df["longs"] / resolution) + 0.5) * resolution
+            counts = pd.crosstab(
+                [lat.round(5).rename("lat"), lon.round(5).rename("lon")],
+                df["Ethnicity"],
+            )
+            counts.insert(0, "Count", counts.sum(axis=1))
+            counts = counts.reset_index()
+            counts.insert(0, "Resolution", resolution)
+            cells.append(counts)
+
+        df_density = pd.concat(cells, ignore_index=True).fillna(0)
+        ethnicities = df_density.columns[4:]
+        df_density[ethnicities] = df_density[ethnicities].astype(int)
+
+        # Creating text for hover info
+
+        df_density["text"] = "Searches: " + df_density["Count"].astype(str)
+        for ethnicity in ethnicities:
+            df_density["text"] += (
+                "<br>" + ethnicity + ": " + df_density[ethnicity].astype(str)
+            )
+
+        # Write out dataframe to csv
+
+        df_density.to_csv("df_density.csv", index=False)
+
+        return None
+
+    @classmethod
+    def make_stopsearch_store(cls, chunksize=100000):
+        """
+        Moves stop search results from every merged year of API output (see the --merge argument in
+        get-stopsearch-data.py) into a store on disk with one csv file per month. Searches are added to the months
+        already in the store, leaving out any it has already, so the store can keep growing as more years are harvested
+        and re-running this or ingesting a bulk download for the same months doesn't lose or double anything.
+        Data source - https://data.police.uk/.
+        Writes out one csv per month to the stopsearch folder in the data directory.
+        :param chunksize: int, number of searches to hold in memory before writing them out.
+        """
+
+        path = str(pathlib.Path.cwd()) + "/data/" + cls.stopsearch_store + "/"
+        pathlib.Path(path).mkdir(parents=True, exist_ok=True)
+
+        filenames = glob.glob("*stopsearchresults.ndjson.gz") + glob.glob(
+            "*stopsearchresults.json"
+        )
+        index = RecordIndex(path + cls.stopsearch_index)
+        written = []
+        rows = []
+        sources = []
+
+        # Read the results a record at a time and write them out in chunks so a year never has to fit in memory
+
+        for filename in sorted(filenames):
+            for month, x in read_results(filename):
+                rows.append(cls.stopsearch_row(month, x))
+                sources.append(x.get("lad") or filename)
+                if len(rows) >= chunksize:
+                    df = pd.DataFrame(rows, columns=cls.stopsearch_columns)
+                    cls.write_stopsearch_partitions(df, path, written, index, sources)
+                    rows = []
+                    sources = []
+
+        if rows:
+            df = pd.DataFrame(rows, columns=cls.stopsearch_columns)
+            cls.write_stopsearch_partitions(df, path, written, index, sources)
+
+        index.close()
+
+        return None
+
+    @staticmethod
+    def stopsearch_row(month, stopsearch):
+        """
+        Picks the fields the store keeps out of a record from the police API.
+        :param month: string; YYYY-MM.
+        :param stopsearch: dict.
+        :return: tuple of values in the order of stopsearch_columns.
+        """
+
+        return (
+            month,
+            stopsearch.get("datetime"),
+            stopsearch["location"]["latitude"],
+            stopsearch["location"]["longitude"],
+            stopsearch.get("lad"),
+            stopsearch["self_defined_ethnicity"],
+            stopsearch["age_range"],
+            stopsearch["gender"],
+            stopsearch["object_of_search"],
+        )
+
+    @staticmethod
+    def write_stopsearch_partitions(df, path, written, index, sources):
+        """
+        Appends a chunk of stop searches to the store, leaving out any that are in it already. A month's file is only
+        created when the store doesn't have it yet; if the index doesn't know about a month that is in the store, e.g.
+        because index.sqlite was deleted, the month is read back into the index first.
+        :param df: dataframe with the stopsearch_columns.
+        :param path: string, the store's folder.
+        :param written: list of the months touched so far this run, which this adds to.
+        :param index: result_store.RecordIndex of the searches in the store.
+        :param sources: list naming where each search came from, e.g. its LAD.
+        :return: None.
+        """
+
+        # Self defined ethnicities look like 'Black/African/Caribbean/Black British - African' so the first
+        # word gives the same broad groups the population data uses
+
+        ethnicity = df["Ethnicity"].astype("category")
+        categories = ethnicity.cat.categories
+        df = df.assign(
+            **{
+                "Ethnic group": ethnicity.map(
+                    dict(zip(categories, categories.str.split(r"[/ ]").str[0]))
+                ).astype(object)
+            }
+        )
+
+        for month in sorted(df["Month"].unique()):
+            if month in written:
+                continue
+            filename = path + "{}.csv".format(month)
+            if not pathlib.Path(filename).exists():
+                index.clear_month(month)
+                df.iloc[:0].to_csv(filename, index=False)
+            elif not index.has_month(month):
+                index.add_stored(
+                    pd.read_csv(
+                        filename,
+                        usecols=["Month"] + RecordIndex.identity_columns,
+                        dtype=str,
+                        chunksize=100000,
+                    )
+                )
+            written.append(month)
+
+        df = df[index.keep_new(df, sources)]
+
+        for month, group in df.groupby("Month", sort=True):
+            group.to_csv(
+                path + "{}.csv".format(month), mode="a", header=False, index=False
+            )
+
         return None
 
+    @classmethod
+    def ingest_stopsearch_archive(cls, source, chunksize=100000):
+        """
+        Moves stop searches from the monthly bulk downloads at https://data.police.uk/data/ into the same store on
+        disk as make_stopsearch_store, instead of asking the API for them one LAD at a time. The download can be the
+        zip file itself or the folder it unzips to; each force's csv is read a chunk at a time so a year of national
+        data never has to fit in memory at once.
+        Searches without a location are left out since the API never returns those either. The bulk files don't say
+        which LAD a search was in, so these months only count towards the national trends.
+        :param source: string, path to the zip file or folder.
+        :param chunksize: int, number of rows to read at a time.
+        :return: list of the months written to the store.
+        """
+
+        path = str(pathlib.Path.cwd()) + "/data/" + cls.stopsearch_store + "/"
+        pathlib.Path(path).mkdir(parents=True, exist_ok=True)
+
+        columns = {
+            "Date": "Datetime",
+            "Latitude": "Latitude",
+            "Longitude": "Longitude",
+            "Self-defined ethnicity": "Ethnicity",
+            "Age range": "Age range",
+            "Gender": "Gender",
+            "Object of search": "Object of search",
+        }
+        if zipfile.is_zipfile(source):
+            archive = zipfile.ZipFile(source)
+            members = sorted(
+                x for x in archive.namelist() if x.endswith("-stop-and-search.csv")
+            )
+        else:
+            archive = None
+            members = sorted(
+                glob.glob(str(source) + "/**/*-stop-and-search.csv", recursive=True)
+            )
+
+        index = RecordIndex(path + cls.stopsearch_index)
+        written = []
+
+        for member in members:
+            handle = archive.open(member) if archive else open(member, "rb")
+            with handle:
+                for chunk in pd.read_csv(
+                    handle, usecols=list(columns), dtype=str, chunksize=chunksize
+                ):
+                    df = chunk.rename(columns=columns).dropna(
+                        subset=["Latitude", "Longitude"]
+                    )
+                    df["Month"] = df["Datetime"].str[:7]
+                    df["LAD"] = None
+                    cls.write_stopsearch_partitions(
+                        df[cls.stopsearch_columns],
+                        path,
+                        written,
+                        index,
+                        [member] * len(df),
+                    )
+
+        if archive:
+            archive.close()
+        index.close()
+
+        return sorted(written)
+
+    @classmethod
+    def count_stopsearches(cls):
+        """
+        Counts the searches in the monthly stop search store per month and broad ethnic group, both nationally and
+        for every LAD (Local Area District), reading a month of the store at a time.
+        :return: dataframe with Month, Area, Ethnicity and Searches columns.
+        """
+
+        path = str(pathlib.Path.cwd()) + "/data/"
+        counts = [pd.DataFrame(columns=["Month", "LAD", "Ethnic group", "Searches"])]
+
+        for filename in sorted(glob.glob(path + cls.stopsearch_store + "/*.csv")):
+            df = pd.read_csv(filename, usecols=["Month", "LAD", "Ethnic group"])
+            df = df.dropna(subset=["Ethnic group"])
+            national = df.groupby(["Month", "Ethnic group"]).size()
+            national = national.rename("Searches").reset_index()
+            national["LAD"] = "National"
+            local = df.groupby(["Month", "LAD", "Ethnic group"]).size()
+            counts.extend([national, local.rename("Searches").reset_index()])
+
+        df_counts = pd.concat(counts, ignore_index=True)
+        df_counts = df_counts.rename(
+            columns={"LAD": "Area", "Ethnic group": "Ethnicity"}
+        ).astype({"Searches": "int64"})
+
+        return df_counts
+
+    @classmethod
+    def make_stopsearch_trends(cls, denominators=None):
+        """
+        Rolls the monthly stop search store up into the number of searches per month for each broad ethnic group,
+        both nationally and for every LAD (Local Area District), along with the number of searches per 1,000 people
+        in that group living there. The app graphs these directly so it never has to scan the store itself.
+        Writes out trends dataframe to csv.
+        :param denominators: optional dataframe from make_denominator_table, which is built when it isn't given.
+        """
+
+        if denominators is None:
+            denominators = cls.make_denominator_table()
+        df_trends = cls.count_stopsearches()
+
+        # Join on the number of people in each broad ethnic group per district and nationally that year to get
+        # searches per 1,000 people
+
+        df_trends = cls.join_denominators(
+            df_trends.assign(Year=df_trends["Month"].str[:4].astype(int)), denominators,
+        )
+        df_trends["Searches per 1k"] = (
+            df_trends["Searches"] / df_trends["Population"] * 1000
+        )
+        df_trends = df_trends.drop(columns=["Year", "Population"]).sort_values(
+            ["Area", "Month", "Ethnicity"]
+        )
+
+        # Write out dataframe to csv
+
+        df_trends.to_csv("df_trends.csv", index=False)
+
+        return None
+
+    @staticmethod
+    def make_trend_views(df):
+        """
+        Pivots the stop search trends into one small table per area with a row per month and a column per ethnic
+        group, so the trends graph is a single lookup however many years of data there are.
+        :param df: trends dataframe written out by make_stopsearch_trends.
+        :return: read-only mapping of area name to dataframe of searches per 1,000 people.
+        """
+
+        views = {
+            area: group.pivot_table(
+                index="Month",
+                columns="Ethnicity",
+                values="Searches per 1k",
+                fill_value=0,
+            )
+            for area, group in df.groupby("Area", sort=True)
+        }
+
+        return MappingProxyType(views)
+
     @classmethod
     def make_sunburst_input(cls):
         """
         This reads in data from several different department of justice sources to form a dataframe of the proper
         format for the px.sunburst graph type.
         Data source: https://www.ethnicity-facts-figures.service.gov.uk/crime-justice-and-the-law.
-        Writes out sunburst dataframe to csv.
+        Writes out a cube of the sunburst data for every sex, age group, offence group and police force area the
+        sources are broken down by to csv, and the totals over all of them to the sunburst csv.
         """
 
         path = str(pathlib.Path.cwd()) + "/data/"
 
-        # Read in data from all three datasets
+        # Read in data from all three datasets. The rate files are read a chunk at a time, keeping only the rows
+        # that have a rate, since every breakdown in them is used
 
         df_sentence_length = pd.read_csv(
             path + cls.sentence_length_filename,
-            usecols=["Year", "Ethnicity", "ACSL (in months)"],
+            usecols=["Year", "Sex", "Ethnicity", "ACSL (in months)"],
         )
-        df_sentence_length.columns = ["Year", "Ethnicity", "Sentence Length"]
-        df_custody_rate = pd.read_csv(
+        df_sentence_length.columns = ["Year", "Sex", "Ethnicity", "Sentence Length"]
+        df_custody_rate = cls.read_filtered_csv(
             path + cls.custody_rate_filename,
             usecols=["Year", "Ethnicity", "Sex", "Age group", "Value", "Offence group"],
+            filters={},
+            required=["Value"],
         )
         df_custody_rate.columns = [
             "Year",
@@ -417,7 +1235,7 @@ class DashBLM:
             "Offence group",
             "Custody Rate",
         ]
-        df_conviction_rate = pd.read_csv(
+        df_conviction_rate = cls.read_filtered_csv(
             path + cls.conviction_filename,
             usecols=[
                 "Time",
@@ -428,66 +1246,204 @@ class DashBLM:
                 "Police Force Area",
                 "Value",
             ],
+            filters={},
+            required=["Value"],
         )
+        df_conviction_rate.columns = [
+            "Ethnicity",
+            "Year",
+            "Sex",
+            "Age group",
+            "Offence group",
+            "Police Force Area",
+            "Conviction Rate",
+        ]
 
-        # Redact to data which is the same across all three datasets; i.e. for all black people in 2009 rather than
-        # for black women in a particular police force area in 2009
+        # Sentence lengths are only given by sex, so the total over every sex is the mean of them
 
-        df_sentence_length = (
-            df_sentence_length.groupby(["Year", "Ethnicity"])["Sentence Length"]
-            .agg("mean")
-            .reset_index()
+        df_sentence_length = pd.concat(
+            [
+                df_sentence_length.groupby(["Year", "Ethnicity"])["Sentence Length"]
+                .agg("mean")
+                .reset_index()
+                .assign(Sex="All"),
+                df_sentence_length,
+            ]
         )
         df_sentence_length["Sentence Length"] = df_sentence_length[
             "Sentence Length"
         ].round(1)
 
-        df_custody_rate = df_custody_rate[
-            df_custody_rate["Sex"].str.contains("All")
-            & df_custody_rate["Age group"].str.contains("All")
-            & df_custody_rate["Offence group"].str.contains("All")
-        ]
-        df_custody_rate.drop(
-            columns=["Sex", "Age group", "Offence group"], axis=1, inplace=True
+        # The custody data cuts long offence group names short, so match them up with the names in the conviction data
+
+        offence_groups = df_conviction_rate["Offence group"].unique()
+        df_custody_rate["Offence group"] = df_custody_rate["Offence group"].map(
+            lambda x: next((y for y in offence_groups if y.startswith(x)), x)
         )
 
-        df_conviction_rate = df_conviction_rate[
-            df_conviction_rate["Sex"].str.contains("All")
-            & df_conviction_rate["Age group"].str.contains("All")
-            & df_conviction_rate["Offence group"].str.contains("All")
-            & df_conviction_rate["Police Force Area"].str.contains("All")
-        ]
-        df_conviction_rate.drop(
-            columns=["Sex", "Age group", "Offence group", "Police Force Area"],
-            inplace=True,
+        # Every breakdown that either rate is published for. Each dataset is joined on the dimensions it has, so one
+        # that isn't broken down by a dimension contributes its total over it, e.g. the national custody rate to
+        # each police force area
+
+        df_cube = pd.concat(
+            [
+                df_custody_rate.assign(**{"Police Force Area": "All"}),
+                df_conviction_rate,
+            ]
+        )[["Year", "Ethnicity"] + cls.justice_dimensions].drop_duplicates()
+
+        for df, dimensions in [
+            (df_sentence_length, ["Sex"]),
+            (df_custody_rate, ["Sex", "Age group", "Offence group"]),
+            (df_conviction_rate, cls.justice_dimensions),
+        ]:
+            df_cube = pd.merge(df_cube, df, on=["Year", "Ethnicity"] + dimensions)
+
+        df_cube["Ethnicity"] = np.where(
+            df_cube["Ethnicity"] != "Other inc Chinese", df_cube["Ethnicity"], "Other",
         )
-        df_conviction_rate.columns = ["Ethnicity", "Year", "Conviction Rate"]
+        df_cube = df_cube.sort_values(
+            by=cls.justice_dimensions + ["Year", "Ethnicity"]
+        ).reset_index(drop=True)
 
-        # Join the datasets together
+        # The totals over every breakdown; i.e. for all black people in 2009 rather than for black women in a
+        # particular police force area in 2009
 
-        df_combined = pd.merge(
-            df_sentence_length, df_custody_rate, on=["Year", "Ethnicity"]
-        )
-        df_sunburst = pd.merge(
-            df_combined, df_conviction_rate, on=["Year", "Ethnicity"]
-        )
+        totals = (df_cube[cls.justice_dimensions] == "All").all(axis=1)
+        df_sunburst = df_cube.loc[
+            totals,
+            ["Year", "Ethnicity", "Sentence Length", "Custody Rate", "Conviction Rate"],
+        ].reset_index(drop=True)
 
-        # Write out dataframe to csv
+        # Write out dataframes to csv
 
-        df_sunburst["Ethnicity"] = np.where(
-            df_sunburst["Ethnicity"] != "Other inc Chinese",
-            df_sunburst["Ethnicity"],
-            "Other",
-        )
+        df_cube.to_csv("df_justice_cube.csv", index=False)
         df_sunburst.to_csv("df_sunburst.csv")
 
         return None
 
+    @staticmethod
+    def make_read_only(df):
+        """
+        Copies a dataframe into columns whose values can't be changed in place, so editing a shared view with .loc,
+        .iloc or .at raises instead of changing it for every other callback. Adding or replacing whole columns still
+        changes the shared dataframe, so a callback that needs to do that must work on its own copy.
+        :param df: dataframe.
+        :return: dataframe with the same index, columns and dtypes.
+        """
+
+        columns = {}
+
+        for column, values in df.items():
+            if isinstance(values.dtype, np.dtype):
+                values = values.to_numpy(copy=True)
+                values.flags.writeable = False
+            else:
+                values = values.array
+            columns[column] = values
+
+        return pd.DataFrame(columns, index=df.index, copy=False)
+
+    @classmethod
+    def make_year_views(cls, df, sort_by, index=None):
+        """
+        Splits a dataframe into pre-sorted views keyed by year. The views are built once at startup and are only ever
+        read afterwards, so callbacks can share them between threads instead of filtering and sorting the same
+        dataframe on every request. Each view's values are read-only (see make_read_only); callbacks must copy a view
+        before changing it.
+        :param df: dataframe with a Year column.
+        :param sort_by: list of column names to sort each year's rows by.
+        :param index: optional column name whose values label each view's rows, so callbacks can look rows up by
+        label rather than by position. The column itself is kept for graphing.
+        :return: read-only mapping of year to read-only dataframe.
+        """
+
+        views = {}
+
+        for year, group in df.sort_values(by=sort_by).groupby("Year", sort=True):
+            group = group.reset_index(drop=True)
+            if index:
+                group.index = pd.Index(group[index].tolist())
+            views[int(year)] = cls.make_read_only(group)
+
+        return MappingProxyType(views)
+
+    @staticmethod
+    def describe_disparities(df, opening, activity):
+        """
+        Writes the markdown saying how many times as likely each group is as white people to be arrested, searched
+        etc., most disproportionate first, from one dataset, year and area of the disparities table.
+        :param df: dataframe with Ethnicity, Ratio, Lower and Upper columns, sorted by Rank.
+        :param opening: string the sentence starts with, e.g. 'This year'.
+        :param activity: string, e.g. 'arrested'.
+        :return: string.
+        """
+
+        groups = df["Ethnicity"].tolist()
+        values = ["**{:.1f}**".format(ratio) for ratio in df["Ratio"]]
+        intervals = [
+            "{:.2f} to {:.2f}".format(lower, upper)
+            for lower, upper in zip(df["Lower"], df["Upper"])
+        ]
+
+        if len(groups) > 1:
+            groups = ", ".join(groups[:-1]) + ", and " + groups[-1]
+            values = ", ".join(values[:-1]) + " and " + values[-1]
+            intervals = ", ".join(intervals[:-1]) + " and " + intervals[-1]
+        else:
+            groups, values, intervals = (
+                "".join(groups),
+                "".join(values),
+                "".join(intervals),
+            )
+
+        return """
+    {} {} people were respectively {} times as likely as white 
+    people to be {} (95% confidence intervals {}).""".format(
+            opening, groups, values, activity, intervals
+        )
+
+    @classmethod
+    def make_selection_views(cls, df, by, sort_by, index=None):
+        """
+        Splits a dataframe into pre-sorted views keyed by every combination of some columns that it holds, like
+        make_year_views does by year, so a callback can look up any selection with one dictionary lookup.
+        :param df: dataframe.
+        :param by: list of the column names to key the views by. A Year column is keyed by int.
+        :param sort_by: list of column names to sort each view's rows by.
+        :param index: optional column name whose values label each view's rows.
+        :return: read-only mapping of a tuple of the by column values to read-only dataframe.
+        """
+
+        views = {}
+
+        for key, group in df.sort_values(by=sort_by).groupby(by, sort=True):
+            group = group.reset_index(drop=True)
+            if index:
+                group.index = pd.Index(group[index].tolist())
+            key = tuple(
+                int(value) if column == "Year" else value
+                for column, value in zip(by, key)
+            )
+            views[key] = cls.make_read_only(group)
+
+        return MappingProxyType(views)
+
 
 if __name__ == "__main__":
 
     DashBLM = DashBLM()
-    DashBLM.make_arrests_dataframe()
+
+    # The population estimates behind every rate are worked out once and shared by each step that needs them
+
+    denominators = DashBLM.make_denominator_table()
+    DashBLM.make_denominators(denominators)
+    DashBLM.make_arrests_dataframe(denominators)
+    DashBLM.make_arrests_store()
     DashBLM.make_choropleth_inputs()
-    DashBLM.make_scattermapbox_inputs()
+    df_scatter = DashBLM.make_scattermapbox_inputs()
+    DashBLM.make_density_inputs(df_scatter)
+    DashBLM.make_stopsearch_store()
+    DashBLM.make_stopsearch_trends(denominators)
     DashBLM.make_sunburst_input()
+    DashBLM.make_disparities(denominators=denominators)
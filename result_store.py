@@ -0,0 +1,263 @@
+import gzip
+import hashlib
+import json
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+
+class ResultWriter:
+    """
+    Writes stop and search records out one per line (NDJSON), gzipped when the filename ends in .gz. Records are
+    written in batches so a harvest only ever holds one batch in memory, and each batch is flushed to disk so a run
+    that dies part way through keeps everything up to its last batch.
+    Opening an existing file in append mode adds to it; gzip readers read appended files as one stream.
+    """
+
+    def __init__(self, filename, mode="w", batch_size=1000):
+        opener = gzip.open if str(filename).endswith(".gz") else open
+        self.file = opener(filename, mode + "t", encoding="utf-8")
+        self.batch_size = batch_size
+        self.batch = []
+        self.count = 0
+
+    def write(self, record):
+        self.batch.append(json.dumps(record, separators=(",", ":")))
+        self.count += 1
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def write_many(self, records):
+        for record in records:
+            self.write(record)
+
+    def flush(self):
+        if self.batch:
+            self.file.write("\n".join(self.batch) + "\n")
+            self.file.flush()
+            self.batch = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_results(filename):
+    """
+    Reads stop and search records back a line at a time. Also reads the older merged json files written by
+    get-stopsearch-data.py, which have to be loaded whole, so both can be processed the same way.
+    :param filename: string, path to a .ndjson, .ndjson.gz or merged .json file.
+    :return: generator of (month, record) tuples.
+    """
+
+    filename = str(filename)
+
+    if filename.endswith(".json"):
+        with open(filename, "r") as f:
+            stopsearchdata = json.load(f)
+        for month, records in stopsearchdata["results"].items():
+            for record in records:
+                yield month, record
+        return
+
+    opener = gzip.open if filename.endswith(".gz") else open
+    with opener(filename, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield record.get("month") or record["datetime"][:7], record
+
+
+class RecordIndex:
+    """
+    A persistent index of the stop searches already in the store, so the same search turning up again is only kept
+    once. Neighbouring LADs, cut lines between tiles and re-harvests all return searches that were fetched before.
+    Searches are identified by a hash of their identifying fields, i.e. everything except which LAD or month they
+    were fetched for, and the index is a sqlite database so it doesn't have to fit in memory. The hash only depends on
+    the fields' text, so the index stays valid across library upgrades; if the way records are hashed ever changes,
+    hash_scheme goes up and older indexes are emptied so they get rebuilt from the store.
+
+    Several people searched together can give identical records, so identical records aren't simply dropped.
+    Each source (a LAD's results, or one file of a bulk download) keeps the copies of a search it returns, but only
+    as many as the store doesn't already have. Rows from a source are expected to arrive together.
+    """
+
+    identity_columns = [
+        "Datetime",
+        "Latitude",
+        "Longitude",
+        "Ethnicity",
+        "Age range",
+        "Gender",
+        "Object of search",
+    ]
+    hash_scheme = 1
+
+    def __init__(self, filename=":memory:"):
+        self.connection = sqlite3.connect(str(filename))
+
+        # The index can always be rebuilt from the store so it doesn't need to survive a crash mid-write
+
+        self.connection.execute("PRAGMA synchronous = OFF")
+        self.connection.execute("PRAGMA journal_mode = MEMORY")
+
+        # Keys from another hash scheme wouldn't match, so an index written with one starts again from empty
+
+        (scheme,) = self.connection.execute("PRAGMA user_version").fetchone()
+        if scheme != self.hash_scheme:
+            with self.connection:
+                self.connection.execute("DROP TABLE IF EXISTS counts")
+                self.connection.execute(
+                    "PRAGMA user_version = {:d}".format(self.hash_scheme)
+                )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS counts "
+            "(month TEXT, key INTEGER, kept INTEGER, PRIMARY KEY (month, key))"
+        )
+        self.running = pd.Series(
+            dtype="int64", index=pd.MultiIndex.from_arrays([[], []])
+        )
+
+    @classmethod
+    def hash_records(cls, df):
+        """
+        Hashes the identifying fields of each search, as the first 8 bytes of a BLAKE2 digest of the fields written
+        out as a JSON list of strings.
+        :param df: dataframe with the identity_columns.
+        :return: int64 array.
+        """
+
+        fields = df[cls.identity_columns].fillna("").astype(str)
+
+        return np.fromiter(
+            (
+                int.from_bytes(
+                    hashlib.blake2b(
+                        json.dumps(row, separators=(",", ":")).encode("utf-8"),
+                        digest_size=8,
+                    ).digest(),
+                    "little",
+                    signed=True,
+                )
+                for row in fields.itertuples(index=False, name=None)
+            ),
+            dtype=np.int64,
+            count=len(fields),
+        )
+
+    def has_month(self, month):
+        """
+        :param month: string; YYYY-MM.
+        :return: bool, whether any searches for the month are in the index.
+        """
+
+        return (
+            self.connection.execute(
+                "SELECT 1 FROM counts WHERE month = ? LIMIT 1", (month,)
+            ).fetchone()
+            is not None
+        )
+
+    def add_stored(self, chunks):
+        """
+        Indexes searches that are in the store already, e.g. a month written before the index was or after it was
+        deleted, so they aren't written again.
+        :param chunks: iterable of dataframes read back from the store.
+        :return: None.
+        """
+
+        running = self.running
+        for df in chunks:
+            self.keep_new(df, np.full(len(df), "store", dtype=object))
+        self.running = running
+
+        return None
+
+    def clear_month(self, month):
+        """
+        Forgets the searches for a month, for when its file in the store has been removed.
+        :param month: string; YYYY-MM.
+        :return: None.
+        """
+
+        with self.connection:
+            self.connection.execute("DELETE FROM counts WHERE month = ?", (month,))
+
+        return None
+
+    def keep_new(self, df, source):
+        """
+        Works out which searches in a chunk aren't in the store yet and adds them to the index.
+        :param df: dataframe with a Month column and the identity_columns.
+        :param source: series or array naming where each row came from.
+        :return: boolean array of the rows to keep.
+        """
+
+        frame = pd.DataFrame(
+            {
+                "month": df["Month"].to_numpy(),
+                "source": pd.Series(np.asarray(source, dtype=object))
+                .fillna("")
+                .to_numpy(),
+                "key": self.hash_records(df),
+            }
+        )
+
+        # Number each copy of a search within its source, carrying on from the last chunk if a source runs over
+
+        pairs = pd.MultiIndex.from_frame(frame[["source", "key"]])
+        frame["copy"] = (
+            frame.groupby(["source", "key"], sort=False).cumcount().to_numpy()
+            + 1
+            + self.running.reindex(pairs, fill_value=0).to_numpy()
+        )
+
+        # Look up how many copies of each search the store has already, then record the most copies any one
+        # source has had
+
+        most = frame.groupby(["month", "key"], sort=False)["copy"].max().reset_index()
+        with self.connection:
+            self.connection.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS chunk (month TEXT, key INTEGER, copies INTEGER)"
+            )
+            self.connection.execute("DELETE FROM chunk")
+            self.connection.executemany(
+                "INSERT INTO chunk VALUES (?, ?, ?)",
+                zip(
+                    most["month"].tolist(), most["key"].tolist(), most["copy"].tolist()
+                ),
+            )
+            kept = pd.DataFrame(
+                self.connection.execute(
+                    "SELECT month, key, kept FROM counts JOIN chunk USING (month, key)"
+                ).fetchall(),
+                columns=["month", "key", "kept"],
+            )
+            self.connection.execute(
+                "INSERT INTO counts SELECT month, key, copies FROM chunk WHERE true "
+                "ON CONFLICT (month, key) DO UPDATE SET kept = max(kept, excluded.kept)"
+            )
+
+        frame = frame.merge(
+            kept.astype({"key": "int64"}), on=["month", "key"], how="left"
+        )
+        keep = (
+            (frame["copy"] > frame["kept"].fillna(0))
+            & ~frame.duplicated(["month", "key", "copy"])
+        ).to_numpy()
+
+        if len(frame):
+            last = frame[frame["source"] == frame["source"].iloc[-1]]
+            self.running = last.groupby(["source", "key"])["copy"].max()
+
+        return keep
+
+    def close(self):
+        self.connection.close()
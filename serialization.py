@@ -0,0 +1,77 @@
+import hashlib
+import threading
+
+import flask
+import plotly.io as pio
+from plotly.io.json import to_json_plotly
+
+
+def enable_fast_json():
+    """
+    Switches plotly, and so every figure Dash sends to the browser, over to encoding JSON with orjson when it is
+    installed. orjson writes numpy arrays out directly instead of converting them to lists of python floats first.
+    :return: bool, whether orjson is now being used.
+    """
+
+    try:
+        import orjson  # noqa: F401
+    except ImportError:
+        return False
+
+    pio.json.config.default_engine = "orjson"
+
+    return True
+
+
+class LayoutCache:
+    """
+    Serves the app layout from bytes that are encoded once rather than on every page load. The layout embeds the
+    stop and search map, so without this every visitor pays for encoding tens of thousands of points again.
+    The bytes are tagged with a hash so browsers that already have them get a 304 back instead.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.app = None
+        self.payload = None
+        self.etag = None
+
+    def install(self, app):
+        """
+        Replaces the Dash layout route with one that serves the cached bytes. Only use this with a static layout,
+        not a function that builds the layout for each request.
+        :param app: the dash.Dash app.
+        :return: None.
+        """
+
+        self.app = app
+        endpoint = app.config.routes_pathname_prefix + "_dash-layout"
+        app.server.view_functions[endpoint] = self.serve_layout
+
+        return None
+
+    def encode(self):
+        """
+        Encodes the layout if it hasn't been already. Runs on the first request rather than at startup.
+        :return: tuple of the encoded layout and its etag.
+        """
+
+        with self.lock:
+            if self.payload is None:
+                payload = to_json_plotly(self.app._layout_value()).encode("utf-8")
+                self.etag = hashlib.sha1(payload).hexdigest()
+                self.payload = payload
+
+            return self.payload, self.etag
+
+    def clear(self):
+        with self.lock:
+            self.payload = None
+            self.etag = None
+
+    def serve_layout(self):
+        payload, etag = self.encode()
+        response = flask.Response(payload, mimetype="application/json")
+        response.set_etag(etag)
+
+        return response.make_conditional(flask.request)